@@ -1,81 +1,334 @@
+import math
+import random
 import time
+from concurrent.futures import ProcessPoolExecutor
 
+import instrumentation
 from structs import *
 from shelf_box import *
 from greedy import Greedy, GreedyArea
+from max_rects_box import MaxRectsBox
+from run_control import RunControl
+from progress import ProgressStream, Snapshot
 import numpy as np
-import sys
-
-sys.setrecursionlimit(1111) # the maximal limit for recursion is 1000
 
 class SimulatedAnnealing:
-    def __init__(self, problem=None, initial_temp=1000, cooling_rate=0.99):
+    """
+    Simulated annealing over complete packings in MaxRectsBoxes.
+
+    Every step proposes a move as a small descriptor:
+        ("relocate", i, box)  move rectangle i into another box
+        ("swap", i, j)        exchange two rectangles of different boxes
+        ("rotate", i)         rotate rectangle i inside its box
+        ("empty", box)        move all rectangles of the emptiest box elsewhere
+    The move is applied in place inside a transaction on the touched boxes
+    and rolled back if it is rejected. The objective is the number of boxes
+    plus the fill of the least filled box, so emptying a box is rewarded
+    before the box count drops; only the touched boxes are re-evaluated.
+
+    Schedules:
+        "geometric"  the temperature is multiplied by cooling_rate every move,
+                     by default it reaches final_temp after iterations moves
+        "adaptive"   geometric, but reheated to a halved initial temperature
+                     when the best solution did not improve for reheat_after moves
+        "time"       the temperature decays geometrically from initial_temp to
+                     final_temp over time_limit seconds
+
+    A RunControl given as control is checked before every move, and the run
+    stops when the best solution reaches its lower bound; run() returns the
+    best solution found so far in any case. A ProgressStream given as progress
+    gets the current and best objective and the best solution.
+    """
+
+    SCHEDULES = ("geometric", "adaptive", "time")
+
+    def __init__(
+        self,
+        problem=None,
+        initial_temp=0.05,
+        cooling_rate=None,
+        schedule="geometric",
+        iterations=None,
+        time_limit=10.0,
+        final_temp=1e-3,
+        reheat_after=None,
+        seed=None,
+        control=None,
+        progress=None,
+    ):
+        if schedule not in self.SCHEDULES:
+            raise ValueError(f"Unknown schedule: {schedule}")
         if problem is None:
             pass
         else:
             self.problem = problem
+            self.initial_temp = initial_temp
             self.temperature = initial_temp
+            self.final_temp = final_temp
+            self.schedule = schedule
+            self.time_limit = time_limit
+            self.iterations = (
+                iterations if iterations is not None else 200 * problem._num_rectangles
+            )
+            if cooling_rate is None:
+                cooling_rate = (final_temp / initial_temp) ** (1 / max(self.iterations, 1))
             self.cooling_rate = cooling_rate
-            self.iterations = len(problem._rectangles)
-            self._boxes = [Box(self.problem.get_box_size())]
+            self.reheat_after = (
+                reheat_after if reheat_after is not None else max(self.iterations // 20, 1)
+            )
+            self._rng = random.Random(seed)
+            self._box_size = problem.get_box_size()
+            self._rectangles = problem.get_rectangles()
+            self._boxes = []
+            self._box_by_id = {}
+            # free space of every non-empty box, by box id
+            self._space = {}
             self.best_solution = None
             self.best_score = float("inf")
+            self.moves = 0
+            self.accepted = 0
+            self.control = control if control is not None else RunControl()
+            self.progress = progress if progress is not None else ProgressStream()
 
     def objective_function(self, boxes):
-        """Evaluate the placement by measuring remaining free space and overlap."""
-        return len(boxes)  # Lower is better
-
-    def random_perturbation(self, boxes):
-        """Modify the placement by moving or rotating a rectangle."""
-        if any(box.get_rectangles() for box in boxes):
-            return boxes
-
-        new_boxes = [box.copy() for box in boxes]
-        # randomly select some solutions that are feasible
-        box = np.random.choice(new_boxes)
-        rect = np.random.choice(box.get_rectangles())
-        box.remove_rectangle(rect)
-
-        # Try placing it at a new random location or rotated
-        rect.rotate() if np.random.random() < 0.5 else None
-        placed = any(b.place(rect) for b in new_boxes)
-
-        # If placement fails, revert rotation and retry
-        if not placed:
-            rect.rotate()
-            any(b.place(rect) for b in new_boxes)
+        """Number of boxes plus the fill of the least filled box, lower is better."""
+        boxes = [box for box in boxes if box.get_rectangles()]
+        if not boxes:
+            return 0
+        box_area = self._box_size * self._box_size
+        return len(boxes) + (box_area - max(box.get_space() for box in boxes)) / box_area
+
+    def _objective(self):
+        """objective_function() of the current boxes from the cached free space."""
+        if not self._space:
+            return 0
+        box_area = self._box_size * self._box_size
+        return len(self._space) + (box_area - max(self._space.values())) / box_area
+
+    def propose_move(self):
+        """Draw a random move descriptor, None if there is nothing to move."""
+        rng = self._rng
+        n, num_boxes = len(self._rectangles), len(self._boxes)
+        if n == 0 or num_boxes < 2:
+            return ("rotate", rng.randrange(n)) if n else None
+        kind = rng.random()
+        if kind < 0.25:
+            # only the emptiest box counts in the objective, so moving its
+            # rectangles away is what makes progress
+            emptiest = max(self._boxes, key=lambda box: box.get_space())
+            rectangle = rng.choice(emptiest.get_rectangles())
+            return ("relocate", rectangle.id, rng.randrange(num_boxes))
+        if kind < 0.5:
+            return ("relocate", rng.randrange(n), rng.randrange(num_boxes))
+        if kind < 0.75:
+            return ("swap", rng.randrange(n), rng.randrange(n))
+        if kind < 0.9:
+            return ("rotate", rng.randrange(n))
+        emptiest = max(self._boxes, key=lambda box: box.get_space())
+        return ("empty", self._boxes.index(emptiest))
+
+    def _place_either_way(self, box, rectangle) -> bool:
+        """Place the rectangle as it is or rotated."""
+        if box.place(rectangle):
+            return True
+        rectangle.rotate()
+        return box.place(rectangle)
+
+    def apply_move(self, move):
+        """
+        Apply a move in place inside a transaction on the touched boxes.
+        Returns:
+            list: the touched boxes, the caller commits or rolls them back,
+                  or None if the move is not possible (nothing is changed)
+        """
+        kind = move[0]
+        rectangles = self._rectangles
+        if kind == "relocate":
+            rectangle = rectangles[move[1]]
+            source, target = self._box_by_id[rectangle.box_id], self._boxes[move[2]]
+            if source is target:
+                return None
+            touched = [source, target]
+            begin_all(touched)
+            source.remove_rectangle(rectangle)
+            if self._place_either_way(target, rectangle):
+                return touched
+        elif kind == "swap":
+            first, second = rectangles[move[1]], rectangles[move[2]]
+            box_a, box_b = self._box_by_id[first.box_id], self._box_by_id[second.box_id]
+            if box_a is box_b:
+                return None
+            # each rectangle has to fit into the free area the other one leaves behind
+            difference = first.width * first.height - second.width * second.height
+            if difference > box_b.get_space() or -difference > box_a.get_space():
+                return None
+            touched = [box_a, box_b]
+            begin_all(touched)
+            box_a.remove_rectangle(first)
+            box_b.remove_rectangle(second)
+            if self._place_either_way(box_b, first) and self._place_either_way(box_a, second):
+                return touched
+        elif kind == "rotate":
+            rectangle = rectangles[move[1]]
+            box = self._box_by_id[rectangle.box_id]
+            touched = [box]
+            box.begin()
+            if box.rotate(rectangle):
+                return touched
+        elif kind == "empty":
+            source = self._boxes[move[1]]
+            # fullest boxes first, the rectangles go where they fit best
+            targets = sorted(
+                (box for box in self._boxes if box is not source), key=lambda box: box.get_space()
+            )
+            touched = [source] + targets
+            begin_all(touched)
+            for rectangle in list(source.get_rectangles()):
+                source.remove_rectangle(rectangle)
+                if not any(self._place_either_way(box, rectangle) for box in targets):
+                    break
+            else:
+                return touched
+        else:
+            raise ValueError(f"Unknown move: {kind}")
+        rollback_all(touched)
+        return None
+
+    def _update_space(self, boxes):
+        """Refresh the cached free space of the boxes, returns the old entries."""
+        saved = [(box.id, self._space.get(box.id)) for box in boxes]
+        for box in boxes:
+            if box.get_rectangles():
+                self._space[box.id] = box.get_space()
+            else:
+                self._space.pop(box.id, None)
+        return saved
+
+    def _restore_space(self, saved):
+        for box_id, space in saved:
+            if space is None:
+                self._space.pop(box_id, None)
+            else:
+                self._space[box_id] = space
+
+    def step(self, temperature) -> bool:
+        """
+        Propose one move and accept or reject it at the given temperature.
+        Returns:
+            bool: True if the move was accepted
+        """
+        self.moves += 1
+        stats = instrumentation.active
+        if stats is not None:
+            mark = time.perf_counter()
+        move = self.propose_move()
+        touched = None if move is None else self.apply_move(move)
+        if stats is not None:
+            mark = stats.lap("neighbors", mark)
+        if touched is None:
+            return False
+        current = self._current_score
+        saved = self._update_space(touched)
+        delta = self._objective() - current
+        if stats is not None:
+            mark = stats.lap("scoring", mark)
+        # if <=0 the solution is not worse. However, to avoid getting stuck in
+        # the local optima, we might still accept the positive delta with some probabilities.
+        # As the temperature lowers, the probability to be accepted decreases
+        if delta <= 0 or self._rng.random() < math.exp(-delta / temperature):
+            commit_all(touched)
+            for box in touched:
+                if not box.get_rectangles():
+                    self._boxes.remove(box)
+                    del self._box_by_id[box.id]
+            self._current_score = current + delta
+            self.accepted += 1
+            if self._current_score < self.best_score - 1e-12:
+                self.best_score = self._current_score
+                self._best_state = self.problem.get_rectangle_set().get_state()
+                self._since_improvement = 0
+                self.control.bound_reached(len(self._space))
+            if stats is not None:
+                stats.lap("acceptance", mark)
+            return True
+        rollback_all(touched)
+        self._restore_space(saved)
+        if stats is not None:
+            stats.lap("acceptance", mark)
+        return False
 
-        return new_boxes
+    def _load_state(self, state):
+        """Rebuild the boxes from a snapshot of the rectangle set."""
+        rectangle_set = self.problem.get_rectangle_set()
+        rectangle_set.set_state(state)
+        self._boxes = []
+        self._box_by_id = {}
+        for rectangle in self._rectangles:
+            box = self._box_by_id.get(rectangle.box_id)
+            if box is None:
+                box = MaxRectsBox(self._box_size, id=rectangle.box_id)
+                self._box_by_id[box.id] = box
+                self._boxes.append(box)
+            box.place_no_check(rectangle)
+        self._space = {box.id: box.get_space() for box in self._boxes}
+        self._current_score = self._objective()
+
+    def _initial_solution(self):
+        # the GreedyArea packing, a first fit in input order starts boxes behind
+        # it and the annealing spends its moves catching up
+        rectangle_set = self.problem.get_rectangle_set()
+        Greedy(self.problem, GreedyArea(), box_type=MaxRectsBox).run()
+        self._load_state(rectangle_set.get_state())
+        self.best_score = self._current_score
+        self._best_state = self.problem.get_rectangle_set().get_state()
+        self._since_improvement = 0
 
     def run(self):
         """Execute the simulated annealing algorithm."""
-        for rect in self.problem.get_rectangles():
-            self.place_rectangle(rect)
-
-        current_solution = self._boxes
-        current_score = self.objective_function(self._boxes)
-
-        for i in range(self.iterations):
-            new_solution = self.random_perturbation(current_solution)
-            new_score = self.objective_function(new_solution)
-
-            delta = new_score - current_score
-
-            # if <0 it means that the solution is better. However, to avoid getting stuck in
-            # the local optima, we might still accept the positive delta with some probabilities.
-            # As the temperature lowers, the probability to be accepted decreases
-            if delta < 0 or np.random.random() < np.exp(-delta / self.temperature):
-                current_solution, current_score = new_solution, new_score
-
-                if new_score < self.best_score:
-                    self.best_solution, self.best_score = new_solution, new_score
-
-            self.temperature *= self.cooling_rate
-            if self.temperature < 1e-6:
+        control = self.control.start()
+        progress = self.progress
+        progress.start()
+        self._initial_solution()
+        control.bound_reached(len(self._space))
+        self.moves = self.accepted = 0
+        temperature = self.initial_temp
+        start = time.perf_counter()
+        reheats = 0
+        while True:
+            if control.step():
                 break
-
+            if progress.due():
+                self._publish()
+            if self.schedule == "time":
+                if self.moves % 256 == 0:
+                    elapsed = time.perf_counter() - start
+                    if elapsed >= self.time_limit:
+                        break
+                    temperature = self.initial_temp * (
+                        self.final_temp / self.initial_temp
+                    ) ** (elapsed / self.time_limit)
+            elif self.moves >= self.iterations:
+                break
+            self.step(temperature)
+            self._since_improvement += 1
+            if self.schedule != "time":
+                temperature *= self.cooling_rate
+            if self.schedule == "adaptive" and self._since_improvement >= self.reheat_after:
+                reheats += 1
+                temperature = max(temperature, self.initial_temp * 0.5 ** reheats)
+                self._since_improvement = 0
+
+        self._load_state(self._best_state)
+        self.best_solution = self._boxes
+        self._publish(final=True)
         return self.best_solution
 
+    def _publish(self, final=False):
+        self.progress.publish(
+            type(self).__name__, self.moves, self._current_score, self.best_score,
+            lambda: Snapshot.from_state(self._best_state), final,
+        )
+
     def place_rectangle(self, rectangle):
         placed = False
         for box in self._boxes:
@@ -83,180 +336,601 @@ class SimulatedAnnealing:
             if placed:
                 break
         if not placed:
-            box = Box(self.problem.get_box_size())
+            box = MaxRectsBox(self.problem.get_box_size())
             box.place(rectangle)
             self._boxes.append(box)
 
     def get_solution(self):
         return self.best_solution if self.best_solution else self._boxes
 
-# this backtracking runs really long because it creates different branches
-# class Backtracking:
-#     def __init__(self, problem=None):
-#         try:
-#             self.max_time = 240.0
-#             self.start_time = time.time()
-#             if problem is None:
-#                 pass
-#             else:
-#                 self.problem = problem
-#                 self.best_solution = None
-#                 self.best_score = len(problem.get_rectangles())
-#                 self._boxes = [Box(self.problem.get_box_size())]
-#                 self.placed_rectangles = set()  # To keep track of placed rectangles
-#                 self.visited = set()  # To track visited states
-#                 greedy_solver = Greedy(problem,GreedyArea())
-#                 greedy_solution = greedy_solver.run()
-#                 self.upper_bound = len(greedy_solution)
-#         except Exception as e:
-#             print(f"An error occurred: {e}")
-
-#     def objective_function(self, boxes):
-#         """Objective function to evaluate the number of boxes used."""
-#         return len(boxes)
-#         #return boxes[-1].get_space()
-
-#     def can_place_rectangle(self, box, rectangle):
-#         """Check if a rectangle can be placed in a given box without overlap."""
-#         for coordinate in box._coordinates:
-#             x, y = coordinate
-#             if box.can_place(rectangle, x, y):
-#                 return True
-#         return False
-
-#     def place_rectangle(self, box, rectangle):
-#         """Place the rectangle in the box if possible."""
-#         for coordinate in box._coordinates:
-#             x, y = coordinate
-#             if box.can_place(rectangle, x, y):
-#                 box.place(rectangle)
-#                 return True
-#         return False
-
-#     def backtrack(self, index=0, rectangles=None, boxes_local=None):
-#         try:
-#             """Perform backtracking to place all rectangles."""
-#             if len(boxes_local) > self.upper_bound:
-#                 return
-#             if time.time() - self.start_time > self.max_time:
-#                 return
-#             if index == len(self.problem.get_rectangles()):
-#                 score = self.objective_function(boxes_local)
-#                 if score <= self.best_score:
-#                     self.best_score = score
-#                     self.best_solution = [box.copy() for box in boxes_local]
-#                 return
-#             self._boxes = boxes_local
-#             rectangle = rectangles[index]
-#             is_placed = False
-
-#             for box in boxes_local:
-#                 if self.can_place_rectangle(box, rectangle):
-#                     box.place(rectangle)
-#                     self.backtrack(index + 1, rectangles, [box.copy() for box in boxes_local])
-#                     box.remove_rectangle(rectangle)
-#                     is_placed = True
-
-
-#             if not is_placed:
-#                 new_box = Box(self.problem.get_box_size())
-#                 if new_box.place(rectangle):
-#                     new_boxes = [box.copy() for box in boxes_local]
-#                     new_boxes.append(new_box)
-#                     self.backtrack(index + 1, rectangles, new_boxes)
-#                     new_boxes.pop()
-#         except Exception as e:
-#             print(f"An error occurred: {e}")
-
-#     def run(self):
-#         """Run the backtracking algorithm to minimize the number of boxes."""
-
-#         # we create the idea of tree and then we choose which branch is the most efficient (best_score)
-#         # if len(self.problem.get_rectangles()) > 5:
-#         #     iteration = 2
-#         # else:
-#         #     iteration = len(self.problem.get_rectangles())
-#         try:
-#             #for x in range(0, iteration):
-#             rectangles = self.problem.get_rectangles_random()
-#             boxes_local = [Box(self.problem.get_box_size())]
-#                 # if self.best_solution is not None: self._boxes = self.best_solution
-#             self.backtrack(0, rectangles, boxes_local)
-
-#             return self.best_solution
-#         except Exception as e:
-#             print(f"An error occurred: {e}")
+
+# the problem of the worker processes of ParallelTempering, set once per process
+_worker_problem = None
+
+
+def _init_tempering_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _tempering_segment(state, temperature, moves, seed):
+    return ParallelTempering.run_segment(_worker_problem, state, temperature, moves, seed)
+
+
+class ParallelTempering:
+    """
+    Replica exchange over SimulatedAnnealing chains.
+
+    The replicas run at a geometric ladder of fixed temperatures between
+    min_temp and max_temp, each for sync_every moves per round and each in its
+    own worker process if workers > 1. Between the rounds only the placements
+    travel, as the per-rectangle arrays of RectangleSet.get_state(), and
+    neighbouring temperatures swap their states with the Metropolis rule
+        P(swap i, j) = min(1, exp((1/T_i - 1/T_j) * (E_i - E_j)))
+    so good states sink to the cold end while the hot chains keep exploring.
+    Args:
+        replicas: number of chains and temperatures
+        rounds: number of sync points, the run also ends after time_limit seconds
+        workers: number of processes, by default one per replica
+        seed: the result does not depend on the number of workers
+        progress: ProgressStream that gets the moves of all replicas, the best
+                  current and the best overall objective after the rounds
+        control: RunControl checked between the rounds, it counts the moves of
+                 all replicas, so max_iterations is reached at the end of a
+                 round; the run also stops when the best state reaches the
+                 lower bound
+    """
+
+    def __init__(
+        self,
+        problem=None,
+        replicas=4,
+        min_temp=0.002,
+        max_temp=0.1,
+        sync_every=500,
+        rounds=20,
+        time_limit=None,
+        workers=None,
+        seed=None,
+        progress=None,
+        control=None,
+    ):
+        if problem is None:
+            pass
+        else:
+            self.problem = problem
+            self.replicas = replicas
+            if replicas > 1:
+                ratio = (max_temp / min_temp) ** (1 / (replicas - 1))
+                self.temperatures = [min_temp * ratio**k for k in range(replicas)]
+            else:
+                self.temperatures = [min_temp]
+            self.sync_every = sync_every
+            self.rounds = rounds
+            self.time_limit = time_limit
+            self.workers = replicas if workers is None else workers
+            self._rng = random.Random(seed)
+            self._boxes = []
+            self.best_solution = None
+            self.best_score = float("inf")
+            # per temperature: moves, accepted moves and acceptance rate
+            self.acceptance = []
+            # per pair of neighbouring temperatures: attempted and accepted swaps
+            self.swap_attempts = [0] * max(replicas - 1, 0)
+            self.swaps = [0] * max(replicas - 1, 0)
+            self.progress = progress if progress is not None else ProgressStream()
+            self.control = control if control is not None else RunControl()
+
+    @staticmethod
+    def run_segment(problem, state, temperature, moves, seed):
+        """
+        Run one chain for a number of moves at a fixed temperature.
+        Returns:
+            tuple: (state, score, best state, best score, accepted moves)
+        """
+        annealing = SimulatedAnnealing(problem, initial_temp=temperature, iterations=moves, seed=seed)
+        annealing._load_state(state)
+        annealing.best_score = annealing._current_score
+        annealing._best_state = state
+        for _ in range(moves):
+            annealing.step(temperature)
+        return (
+            problem.get_rectangle_set().get_state(),
+            annealing._current_score,
+            annealing._best_state,
+            annealing.best_score,
+            annealing.accepted,
+        )
+
+    def _exchange(self, states, scores, parity):
+        """Metropolis swaps between the neighbouring temperatures k, k + 1 of one parity."""
+        temperatures = self.temperatures
+        for k in range(parity, self.replicas - 1, 2):
+            self.swap_attempts[k] += 1
+            exponent = (1 / temperatures[k] - 1 / temperatures[k + 1]) * (scores[k] - scores[k + 1])
+            if exponent >= 0 or self._rng.random() < math.exp(exponent):
+                states[k], states[k + 1] = states[k + 1], states[k]
+                scores[k], scores[k + 1] = scores[k + 1], scores[k]
+                self.swaps[k] += 1
+
+    def run(self):
+        """Run the replicas and return the best solution found by any of them."""
+        control = self.control.start()
+        self.progress.start()
+        start = SimulatedAnnealing(self.problem, seed=self._rng.getrandbits(32))
+        start._initial_solution()
+        states = [start._best_state] * self.replicas
+        scores = [start.best_score] * self.replicas
+        self.best_score, best_state = start.best_score, start._best_state
+        moves = [0] * self.replicas
+        accepted = [0] * self.replicas
+
+        executor = None
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_tempering_worker,
+                initargs=(self.problem,),
+            )
+        started = time.perf_counter()
+        try:
+            for round_index in range(self.rounds):
+                if self.time_limit is not None and time.perf_counter() - started >= self.time_limit:
+                    break
+                if control.bound_reached(self._num_boxes(best_state)):
+                    break
+                if control.step(self.replicas * self.sync_every):
+                    break
+                seeds = [self._rng.getrandbits(32) for _ in range(self.replicas)]
+                jobs = zip(states, self.temperatures, [self.sync_every] * self.replicas, seeds)
+                if executor is None:
+                    results = [self.run_segment(self.problem, *job) for job in jobs]
+                else:
+                    futures = [executor.submit(_tempering_segment, *job) for job in jobs]
+                    results = [future.result() for future in futures]
+                for k, (state, score, chain_best_state, chain_best, chain_accepted) in enumerate(results):
+                    states[k], scores[k] = state, score
+                    moves[k] += self.sync_every
+                    accepted[k] += chain_accepted
+                    if chain_best < self.best_score - 1e-12:
+                        self.best_score, best_state = chain_best, chain_best_state
+                self._exchange(states, scores, round_index % 2)
+                if self.progress.due():
+                    self._publish(sum(moves), min(scores), best_state)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.acceptance = [
+            {
+                "temperature": temperature,
+                "moves": moves[k],
+                "accepted": accepted[k],
+                "acceptance_rate": accepted[k] / moves[k] if moves[k] else 0.0,
+            }
+            for k, temperature in enumerate(self.temperatures)
+        ]
+        start._load_state(best_state)
+        self._boxes = self.best_solution = start._boxes
+        self._publish(sum(moves), min(scores), best_state, final=True)
+        return self.best_solution
+
+    @staticmethod
+    def _num_boxes(state) -> int:
+        return len(np.unique(state[4]))
+
+    def _publish(self, moves, current_score, best_state, final=False):
+        self.progress.publish(
+            type(self).__name__, moves, current_score, self.best_score,
+            lambda: Snapshot.from_state(best_state), final,
+        )
+
+    def swap_rates(self) -> list:
+        """Accepted fraction of the state swaps per pair of neighbouring temperatures."""
+        return [
+            swaps / attempts if attempts else 0.0
+            for swaps, attempts in zip(self.swaps, self.swap_attempts)
+        ]
+
+    def get_solution(self):
+        return self.best_solution if self.best_solution else self._boxes
+
+
+def area_lower_bound(widths, heights, box_size) -> int:
+    """L1 bound: the total area divided by the area of a box, rounded up."""
+    total = int(np.sum(np.asarray(widths, dtype=np.int64) * np.asarray(heights, dtype=np.int64)))
+    return -(-total // (box_size * box_size))
+
+
+def one_dimensional_lower_bound(sizes, capacity) -> int:
+    """
+    Martello-Toth L2 bound for one-dimensional bin packing. For every alpha the
+    items larger than capacity - alpha and larger than capacity / 2 each need
+    their own bin, and the items between alpha and capacity / 2 can at most
+    fill the space left in the bins of the latter.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    if len(sizes) == 0:
+        return 0
+    best = 0
+    for alpha in np.unique(np.append(sizes[2 * sizes <= capacity], 0)):
+        j1 = sizes > capacity - alpha
+        j2 = ~j1 & (2 * sizes > capacity)
+        j3 = (2 * sizes <= capacity) & (sizes >= alpha)
+        free = int(j2.sum()) * capacity - int(sizes[j2].sum())
+        rest = int(sizes[j3].sum()) - free
+        best = max(best, int(j1.sum() + j2.sum()) + max(0, -(-rest // capacity)))
+    return best
+
+
+def l2_lower_bound(widths, heights, box_size) -> int:
+    """
+    Lower bound for two-dimensional bin packing without rotation. Rectangles
+    higher than half the box cannot be stacked, so in every box they are side
+    by side: their widths form a one-dimensional bin packing instance, and
+    the same holds for the heights of the rectangles wider than half the box.
+    Returns the maximum of these bounds and the L1 bound.
+    """
+    widths = np.asarray(widths, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.int64)
+    tall = 2 * heights > box_size
+    wide = 2 * widths > box_size
+    return max(
+        area_lower_bound(widths, heights, box_size),
+        one_dimensional_lower_bound(widths[tall], box_size),
+        one_dimensional_lower_bound(heights[wide], box_size),
+    )
+
+
+def _dual_feasible_values(sizes, capacity):
+    """
+    Values of the sizes under dual feasible functions: sizes that fit side by
+    side into the capacity keep fitting into the capacity of every function
+    after the mapping. The identity, the functions u^(k) of Fekete and
+    Schepers (scaled by k to stay integral) and the functions that round
+    sizes above capacity - eps up to the capacity and sizes below eps down to
+    zero.
+    Returns:
+        tuple: (functions x sizes array of the values, capacity of every function)
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    values, capacities = [sizes], [capacity]
+    for k in range(2, 11):
+        values.append(np.where((k + 1) * sizes % capacity == 0, k * sizes, (k + 1) * sizes // capacity * capacity))
+        capacities.append(k * capacity)
+    for eps in np.unique(sizes[2 * sizes <= capacity]):
+        values.append(np.where(sizes > capacity - eps, capacity, np.where(sizes < eps, 0, sizes)))
+        capacities.append(capacity)
+    return np.array(values), np.array(capacities, dtype=np.int64)
+
+
+def rotated_lower_bound(widths, heights, box_size) -> int:
+    """
+    Lower bound for two-dimensional bin packing when the rectangles may be
+    rotated. The area of the rectangles after mapping both sides with dual
+    feasible functions still fits into the mapped box area in every box, with
+    rotation each rectangle counts with the smaller of its two orientations.
+    Rectangles with both sides above half the box all cover its center, so
+    each needs its own box. Returns the maximum of these bounds and the L1
+    bound.
+    """
+    widths = np.asarray(widths, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.int64)
+    n = len(widths)
+    if n == 0:
+        return 0
+    values, capacities = _dual_feasible_values(np.concatenate((widths, heights)), box_size)
+    mapped_widths, mapped_heights = values[:, :n], values[:, n:]
+    # every pair of functions, the first one for x and the second one for y
+    areas = np.minimum(
+        mapped_widths[:, None, :] * mapped_heights[None, :, :],
+        mapped_heights[:, None, :] * mapped_widths[None, :, :],
+    ).sum(axis=2)
+    box_areas = capacities[:, None] * capacities[None, :]
+    return max(
+        area_lower_bound(widths, heights, box_size),
+        int((2 * np.minimum(widths, heights) > box_size).sum()),
+        int((-(-areas // box_areas)).max()),
+    )
+
+
+def _merge_segments(segments) -> tuple:
+    """Joins neighbouring skyline segments (x, width, height) of the same height."""
+    merged = []
+    for segment in segments:
+        if merged and merged[-1][2] == segment[2]:
+            x, width, height = merged[-1]
+            merged[-1] = (x, width + segment[1], height)
+        else:
+            merged.append(segment)
+    return tuple(merged)
+
 
 class Backtracking:
-    def __init__(self, problem=None):
+    """
+    Exact branch-and-bound solver that minimizes the number of boxes, the
+    rectangles may be rotated.
+
+    Starting with the GreedyArea solution it asks whether the rectangles fit
+    into one box less than the best solution, until the answer is no or the
+    lower bound is reached. A question is answered by a depth first search
+    that fills the boxes one after the other. The filled part of the open box
+    is a skyline of segments (x, width, height), and the search looks at its
+    lowest, leftmost empty cell: either a rectangle of a remaining size gets
+    its bottom left corner there, in either orientation, or the cell stays
+    empty. In a packing where no rectangle can be moved down or left, the
+    cells above an empty cell stay empty up to the lower of the next higher
+    column left of it, the column right of its segment and the smallest
+    remaining side, so the whole stretch is marked empty at once; a segment
+    narrower than every remaining side is filled up to its lower neighbour.
+    Every packing can be pushed down and left until no rectangle moves and the
+    search follows all of these packings, so a search that ends without a
+    packing proves that there is none and the best solution is optimal.
+
+    The empty area of a packing is fixed by the box count, a branch is cut
+    when the cells marked empty plus the cells that stay empty in every
+    completion exceed it: per column the room above the skyline that no stack
+    of remaining sides fills, per segment between higher neighbours the width
+    that no row of remaining sides fills. A full box is only closed if the
+    rotated_lower_bound() of the remaining rectangles fits into the remaining
+    boxes. Equal rectangles are one size with a count, every box holds the
+    largest size that was left when it was opened, and explored states
+    (skyline, remaining counts) are not searched again. The pruning data is
+    kept up to date per step, the memo key is the skyline tuple and the
+    counts.
+
+    A RunControl given as control is checked before every search step, and
+    max_nodes caps the steps of all questions; a search stopped by either
+    proves nothing and run() returns the best solution found so far, at worst
+    the GreedyArea one. The search also stops when the best solution reaches
+    the lower bound of the control. A ProgressStream given as progress gets
+    the boxes of the current partial solution, the boxes of the best solution
+    and the best solution.
+    """
+
+    def __init__(self, problem=None, max_nodes=500000, control=None, progress=None):
         if problem is None:
             pass
         else:
             self.problem = problem
             self.best_solution = None
             self.best_score = 0
-            self._boxes = [Box(self.problem.get_box_size())]
-            self.placed_rectangles = set()  # To keep track of placed rectangles
-            self.visited = set()  # To track visited states
+            self._boxes = []
+            self.visited = set()  # explored states of the current question
+            self.max_nodes = max_nodes
+            self.nodes = 0
+            self.lower_bound = 0
+            self.proven_optimal = False
+            self.control = control if control is not None else RunControl()
+            self.progress = progress if progress is not None else ProgressStream()
 
     def objective_function(self, boxes):
         """Objective function to evaluate the number of boxes used."""
-        # return len(boxes)
-        return boxes[-1].get_space()
-
-    def can_place_rectangle(self, box, rectangle):
-        """Check if a rectangle can be placed in a given box without overlap."""
-        for coordinate in box._coordinates:
-            x, y = coordinate
-            if box.can_place(rectangle, x, y):
-                return True
-        return False
-
-    def place_rectangle(self, box, rectangle):
-        """Place the rectangle in the box if possible."""
-        for coordinate in box._coordinates:
-            x, y = coordinate
-            if box.can_place(rectangle, x, y):
-                box.place(rectangle)
-                return True
-        return False
+        return len(boxes)
 
-    def backtrack(self, index=0, rectangles=None, boxes_local=None):
-        """Perform backtracking to place all rectangles."""
-        if index == len(self.problem.get_rectangles()):
-            score = self.objective_function(boxes_local)
-            if score >= self.best_score:
-                self.best_score = score
-                self.best_solution = boxes_local # [box.copy() for box in self._boxes]
-                self._boxes = [box.copy() for box in boxes_local]
-            return
-
-        # Get the rectangle to place
-        rectangle = rectangles[index] # self.problem.get_rectangles()[index]
-        is_placed = False
-        # Try to place the rectangle in existing boxes
-        for box in boxes_local:
-            if self.can_place_rectangle(box, rectangle):
-                # Place the rectangle and try the next one with recursion
-                box.place(rectangle)
-                is_placed = True
-                self.backtrack(index + 1, rectangles, boxes_local)
-            if is_placed:
+    def run(self):
+        """Run the branch and bound to minimize the number of boxes."""
+        control = self.control.start()
+        self.progress.start()
+        box_size = self.problem.get_box_size()
+        rectangle_set = self.problem.get_rectangle_set()
+
+        greedy = Greedy(self.problem, GreedyArea(), box_type=MaxRectsBox)
+        self.best_solution = greedy.run()
+        self.best_score = self.objective_function(self.best_solution)
+        self._boxes = self.best_solution
+        self.lower_bound = rotated_lower_bound(rectangle_set.width, rectangle_set.height, box_size)
+
+        # the sizes (shorter side, longer side) in decreasing area, with counts
+        counts = {}
+        for width, height in zip(rectangle_set.width.tolist(), rectangle_set.height.tolist()):
+            size = (min(width, height), max(width, height))
+            counts[size] = counts.get(size, 0) + 1
+        sizes = sorted(counts, key=lambda size: (-size[0] * size[1], -size[1]))
+
+        self.nodes = 0
+        self.proven_optimal = self.best_score <= self.lower_bound
+        while not self.proven_optimal and not control.bound_reached(self.best_score):
+            placements = self._search(sizes, [counts[size] for size in sizes], self.best_score - 1)
+            if placements is None:
+                # an exhausted search is the proof, a stopped one proves nothing
+                self.proven_optimal = not self._stopped
                 break
+            self.best_solution = self._build(placements, sizes, self.best_score - 1)
+            self.best_score = self.objective_function(self.best_solution)
+            self._boxes = self.best_solution
+            self.proven_optimal = self.best_score <= self.lower_bound
+        self._publish(self.best_score, final=True)
+        return self.best_solution
 
-        self._boxes = boxes_local # just for displaying
-
-        if not is_placed:
-        # If the rectangle can't be placed in any existing box, create a new box
-            new_box = Box(self.problem.get_box_size())
-            new_box.place(rectangle)
-            boxes_local.append(new_box)
-            self.backtrack(index + 1, rectangles, boxes_local)
+    def _search(self, sizes, counts, num_boxes):
+        """
+        Depth first search for a packing into num_boxes boxes.
+        Returns:
+            list: the placements (box, x, y, width, height, size index), None
+                  if there is none or the search was stopped (self._stopped)
+        """
+        box_size = self.problem.get_box_size()
+        self._sizes = sizes
+        self._num_boxes = num_boxes
+        self._empty_area = num_boxes * box_size * box_size - sum(
+            width * height * count for (width, height), count in zip(sizes, counts)
+        )
+        self._fill = {}
+        self._needed = {}
+        self.visited = set()
+        self._stopped = False
+        total = sum(counts)
+        path = []
+        stack = [self._children(((0, box_size, 0),), 0, 0, 0, False, counts, path)]
+        while stack:
+            if self.control.step() or (self.max_nodes is not None and self.nodes >= self.max_nodes):
+                self._stopped = True
+                return None
+            if self.progress.due():
+                self._publish(path[-1][0] + 1 if path else 1)
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            self.nodes += 1
+            if len(path) == total:
+                return list(path)
+            stack.append(self._children(*child, counts, path))
+        return None
+
+    def _children(self, segments, box, empty, largest, has_largest, counts, path):
+        """
+        Yields the child states (segments, box, empty area, largest size of
+        the box, True if the box holds it) of a state. The placements of the
+        children are applied to counts and path while they are searched.
+        """
+        box_size = self.problem.get_box_size()
+        remaining = tuple(counts)
+        key = (segments, remaining, box, largest, has_largest)
+        if key in self.visited:
+            return
+        self.visited.add(key)
+        sizes = self._sizes
+        heights = [segment[2] for segment in segments]
+        y = min(heights)
+        i = heights.index(y)
+        x, width, _ = segments[i]
+        if y == box_size:
+            # the box is full
+            if not has_largest or box + 1 == self._num_boxes:
+                return
+            needed = self._needed.get(remaining)
+            if needed is None:
+                widths = [size[0] for size, count in zip(sizes, counts) for _ in range(count)]
+                heights = [size[1] for size, count in zip(sizes, counts) for _ in range(count)]
+                needed = rotated_lower_bound(widths, heights, box_size)
+                self._needed[remaining] = needed
+            if box + 1 + needed <= self._num_boxes:
+                first = next(k for k, count in enumerate(counts) if count)
+                yield ((0, box_size, 0),), box + 1, empty, first, False
+            return
 
-    def run(self):
-        """Run the backtracking algorithm to minimize the number of boxes."""
-        rectangles = self.problem.get_rectangles_random()
-        boxes_local = [Box(self.problem.get_box_size())]
-        self.backtrack(0, rectangles, boxes_local)
+        room = box_size - y
+        fill, smallest = self._sums(remaining)
+        if not has_largest and sizes[largest][0] > room:
+            return
+        if empty + self._certain_empty_area(segments, fill) > self._empty_area:
+            return
+        left = segments[i - 1][2] if i > 0 else box_size
+        right = segments[i + 1][2] if i + 1 < len(segments) else box_size
+
+        # exact fits of the segment and of the left neighbour's height first,
+        # gaps that no rectangle fills last
+        options = []
+        for k, count in enumerate(counts):
+            if not count:
+                continue
+            a, b = sizes[k]
+            for w, h in ((a, b), (b, a)) if a != b else ((a, b),):
+                if w <= width and h <= room:
+                    gap = width - w
+                    options.append((
+                        0 if gap == 0 else 2 if gap < smallest else 1,
+                        y + h != left and y + h != box_size,
+                        -a * b, k, w, h,
+                    ))
+        options.sort()
+        for _, _, _, k, w, h in options:
+            rest = ((x + w, width - w, y),) if width > w else ()
+            counts[k] -= 1
+            path.append((box, x, y, w, h, k))
+            yield (
+                _merge_segments(segments[:i] + ((x, w, y + h),) + rest + segments[i + 1 :]),
+                box, empty, largest, has_largest or k == largest,
+            )
+            path.pop()
+            counts[k] += 1
+
+        # the cell stays empty
+        if width < smallest:
+            top = min(left, right)
+            filled = ((x, width, top),)
+            area = (top - y) * width
+        else:
+            top = min(
+                left, segments[i + 1][2] if i + 1 < len(segments) else box_size, y + smallest, box_size
+            )
+            filled = ((x, 1, top),) + (((x + 1, width - 1, y),) if width > 1 else ())
+            area = top - y
+        if empty + area <= self._empty_area:
+            yield (
+                _merge_segments(segments[:i] + filled + segments[i + 1 :]),
+                box, empty + area, largest, has_largest,
+            )
+
+    def _sums(self, remaining) -> tuple:
+        """
+        fill[v], the largest sum of at most v of one side per remaining
+        rectangle, and the smallest remaining side.
+        """
+        sums = self._fill.get(remaining)
+        if sums is None:
+            box_size = self.problem.get_box_size()
+            # reachable sums as a bit set
+            reachable, mask = 1, (1 << (box_size + 1)) - 1
+            for (a, b), count in zip(self._sizes, remaining):
+                for _ in range(count):
+                    reachable |= ((reachable << a) | (reachable << b)) & mask
+            fill, best = [0] * (box_size + 1), 0
+            for value in range(box_size + 1):
+                if reachable >> value & 1:
+                    best = value
+                fill[value] = best
+            smallest = min(size[0] for size, count in zip(self._sizes, remaining) if count)
+            sums = self._fill[remaining] = (fill, smallest)
+        return sums
+
+    def _certain_empty_area(self, segments, fill) -> int:
+        """
+        Area above the skyline that stays empty in every completion. The
+        rectangles above a column form a stack of one side each, the ones
+        crossing a row between two higher neighbours a row of one side each,
+        the part of the room or width that no such sum (see _sums()) reaches
+        is empty.
+        """
+        box_size = self.problem.get_box_size()
+        area = 0
+        previous = box_size
+        last = len(segments) - 1
+        for j, (_, width, y) in enumerate(segments):
+            room = box_size - y
+            columns = (room - fill[room]) * width
+            top = min(previous, segments[j + 1][2] if j < last else box_size)
+            if top > y:
+                rows = (top - y) * (width - fill[width])
+                area += rows if rows > columns else columns
+            else:
+                area += columns
+            previous = y
+        return area
+
+    def _build(self, placements, sizes, num_boxes) -> list:
+        """The boxes of a packing found by _search(), with copies of the rectangles."""
+        rectangle_set = self.problem.get_rectangle_set()
+        by_size = {}
+        for i, (width, height) in enumerate(zip(rectangle_set.width.tolist(), rectangle_set.height.tolist())):
+            by_size.setdefault((min(width, height), max(width, height)), []).append(i)
+        chosen = [by_size[sizes[k]].pop() for _, _, _, _, _, k in placements]
+        rectangles = copy_rectangles([rectangle_set[i] for i in chosen])
+        boxes = [MaxRectsBox(self.problem.get_box_size()) for _ in range(num_boxes)]
+        for rectangle, (box, x, y, width, height, _) in zip(rectangles, placements):
+            if rectangle.width != width:
+                rectangle.rotate()
+            boxes[box].place_at(rectangle, x, y)
+        return [box for box in boxes if box.get_rectangles()]
+
+    def _publish(self, current_boxes, final=False):
+        best = self.best_solution
+        self.progress.publish(
+            type(self).__name__, self.nodes, current_boxes, self.best_score,
+            lambda: Snapshot.from_boxes(best), final,
+        )
 
-        return self.best_solution
\ No newline at end of file
+    def get_solution(self):
+        return self.best_solution if self.best_solution else self._boxes
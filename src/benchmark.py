@@ -0,0 +1,346 @@
+"""
+Reproducible benchmark suite for the packing algorithms. Run from the src
+directory:
+
+    python -m benchmark --output results.json --save-baseline baseline.json
+    python -m benchmark --baseline baseline.json --threshold 0.2
+
+Every algorithm runs on fixed, seeded instance families (uniform and skewed
+rectangle sizes, several box sizes, n = 100 to 100k) under a time budget,
+each case in a fresh process so the peak memory is its own and a case that
+overruns can be killed. A case records the wall time, peak memory (growth of
+the resident set during the run), box count, gap to the L2 lower bound and
+iterations per second. Against a stored baseline, cases that got slower,
+bigger or worse by more than the threshold are reported as regressions and
+the exit status is 1.
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+import zlib
+
+import numpy as np
+
+
+ALGORITHMS = (
+    "greedy_area",
+    "greedy_perimeter",
+    "geometry",
+    "rule_based",
+    "partial_overlap",
+    "annealing",
+    "backtracking",
+)
+FAMILIES = ("uniform", "skewed")
+SIZES = (100, 1000, 10000, 100000)
+BOX_SIZES = (50, 100, 400)
+# largest n per algorithm: a first step that cannot be stopped at the time
+# budget takes minutes above it (the O(n^2) sweeps of the neighborhoods, the
+# overlaps of PartialOverlapNeighborhood's one-box start, the first fit start
+# of SimulatedAnnealing)
+MAX_SIZE = {
+    "geometry": 10000,
+    "rule_based": 10000,
+    "partial_overlap": 1000,
+    "annealing": 10000,
+}
+# the metrics compared with the baseline, and when they are too small to compare
+COMPARED = {"time": 0.05, "peak_memory_mb": 1.0, "num_boxes": 0}
+
+
+def instance_seed(family, n, box_size) -> int:
+    """Fixed seed of an instance, independent of the Python hash seed."""
+    return zlib.crc32(f"{family}-{n}-{box_size}".encode())
+
+
+def make_sizes(family, n, box_size, seed):
+    """
+    Rectangle widths and heights of an instance.
+        "uniform"  sizes uniform in [1, 0.4 * box_size]
+        "skewed"   mostly small rectangles and a few large ones, sizes
+                   1 + 0.6 * box_size * u^3 for uniform u
+    """
+    rng = np.random.default_rng(seed)
+    if family == "uniform":
+        sizes = rng.integers(1, max(2, int(0.4 * box_size)) + 1, size=(2, n))
+    elif family == "skewed":
+        sizes = 1 + np.floor(0.6 * box_size * rng.random((2, n)) ** 3).astype(np.int64)
+    else:
+        raise ValueError(f"Unknown instance family: {family}")
+    return sizes[0], sizes[1]
+
+
+def make_algorithm(name, problem, control):
+    from greedy import Greedy, GreedyArea, GreedyPerimeter
+
+    if name == "greedy_area":
+        return Greedy(problem, GreedyArea(), control=control)
+    if name == "greedy_perimeter":
+        return Greedy(problem, GreedyPerimeter(), control=control)
+    if name in ("geometry", "rule_based", "partial_overlap"):
+        import local_search
+
+        neighborhood = {
+            "geometry": local_search.GeometryBasedNeighborhood,
+            "rule_based": local_search.RuleBasedNeighborhood,
+            "partial_overlap": local_search.PartialOverlapNeighborhood,
+        }[name]()
+        return local_search.LocalSearch(problem, neighborhood, seed=0, control=control)
+    import algorithms
+
+    if name == "annealing":
+        return algorithms.SimulatedAnnealing(problem, seed=0, control=control)
+    if name == "backtracking":
+        return algorithms.Backtracking(problem, control=control)
+    raise ValueError(f"Unknown algorithm: {name}")
+
+
+def _max_rss_mb() -> float:
+    """High-water mark of the resident set of this process, None where it is not available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def run_case(case, time_limit) -> dict:
+    """Run one case in this process, see cases() for its keys."""
+    import random
+
+    from algorithms import l2_lower_bound
+    from progress import Snapshot
+    from run_control import RunControl
+    from structs import OptimizationProblem
+
+    seed = instance_seed(case["family"], case["n"], case["box_size"])
+    random.seed(seed)
+    np.random.seed(seed)
+    widths, heights = make_sizes(case["family"], case["n"], case["box_size"], seed)
+    problem = OptimizationProblem.from_sizes(case["box_size"], widths, heights)
+    lower_bound = l2_lower_bound(widths, heights, case["box_size"])
+    control = RunControl(time_limit)
+    algorithm = make_algorithm(case["algorithm"], problem, control)
+
+    memory_before = _max_rss_mb()
+    started = time.perf_counter()
+    boxes = algorithm.run()
+    elapsed = time.perf_counter() - started
+    memory_after = _max_rss_mb()
+
+    placed = Snapshot.from_boxes(boxes).placements[:, 0]
+    num_boxes = len(boxes)
+    return dict(
+        case,
+        status="ok",
+        seed=seed,
+        time=elapsed,
+        peak_memory_mb=None if memory_after is None else memory_after - memory_before,
+        num_boxes=num_boxes,
+        lower_bound=lower_bound,
+        gap=(num_boxes - lower_bound) / lower_bound if lower_bound else 0.0,
+        iterations=control.iterations,
+        moves_per_second=control.iterations / elapsed if elapsed > 0 else 0.0,
+        stop_reason=control.stop_reason,
+        # every rectangle placed exactly once
+        valid=len(placed) == case["n"] and len(np.unique(placed)) == case["n"],
+    )
+
+
+def _case_process(connection, case, time_limit):
+    try:
+        connection.send(run_case(case, time_limit))
+    except Exception as error:
+        connection.send(dict(case, status="error", error=repr(error)))
+    finally:
+        connection.close()
+
+
+def run_isolated(case, time_limit, hard_limit) -> dict:
+    """Run one case in a fresh process, killed after hard_limit seconds."""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_case_process, args=(sender, case, time_limit))
+    process.start()
+    sender.close()
+    if receiver.poll(hard_limit):
+        try:
+            result = receiver.recv()
+        except EOFError:
+            # the process died without an answer, e.g. out of memory
+            process.join()
+            result = dict(case, status="error", error=f"exit code {process.exitcode}")
+    else:
+        process.terminate()
+        result = dict(case, status="timeout", time=hard_limit)
+    process.join()
+    return result
+
+
+def cases(algorithms=ALGORITHMS, families=FAMILIES, sizes=SIZES, box_sizes=BOX_SIZES, caps=True):
+    """The benchmark matrix, skipped cases are marked as such."""
+    for algorithm in algorithms:
+        for family in families:
+            for box_size in box_sizes:
+                for n in sizes:
+                    case = {"algorithm": algorithm, "family": family, "box_size": box_size, "n": n}
+                    if caps and n > MAX_SIZE.get(algorithm, n):
+                        case["status"] = "skipped"
+                    yield case
+
+
+def case_key(record) -> tuple:
+    return record["algorithm"], record["family"], record["box_size"], record["n"]
+
+
+def compare(results, baseline, threshold=0.2, quality_threshold=0.0) -> list:
+    """
+    Regressions of the results against the baseline records: a time or peak
+    memory more than threshold above the baseline (values below COMPARED are
+    noise and ignored), more than quality_threshold more boxes, or a case that
+    ran in the baseline and fails now. The box counts are only compared if
+    both runs finished on their own: a run stopped at the time budget got as
+    far as the machine allowed, a slower machine is not a worse algorithm.
+    """
+    previous = {case_key(record): record for record in baseline}
+    regressions = []
+    for record in results:
+        old = previous.get(case_key(record))
+        if old is None or old.get("status") != "ok":
+            continue
+        if record.get("status") != "ok":
+            regressions.append({"case": case_key(record), "metric": "status", "baseline": "ok",
+                                "value": record.get("status")})
+            continue
+        for metric, floor in COMPARED.items():
+            before, after = old.get(metric), record.get(metric)
+            if before is None or after is None or max(before, after) <= floor:
+                continue
+            if metric == "num_boxes" and (old.get("stop_reason") or record.get("stop_reason")):
+                continue
+            limit = quality_threshold if metric == "num_boxes" else threshold
+            if after > before * (1 + limit):
+                regressions.append({"case": case_key(record), "metric": metric, "baseline": before,
+                                    "value": after, "change": after / before - 1 if before else None})
+    return regressions
+
+
+def scaling(results) -> dict:
+    """
+    Scaling exponent of the time per (algorithm, family, box size): the slope
+    of log(time) over log(n), from the cases that finished within the budget.
+    """
+    curves = {}
+    for record in results:
+        if record.get("status") == "ok" and record.get("stop_reason") is None and record["time"] > 0:
+            key = (record["algorithm"], record["family"], record["box_size"])
+            curves.setdefault(key, []).append((record["n"], record["time"]))
+    exponents = {}
+    for key, points in curves.items():
+        if len(points) >= 2:
+            n, seconds = np.log(np.array(points, dtype=np.float64)).T
+            exponents[key] = float(np.polyfit(n, seconds, 1)[0])
+    return exponents
+
+
+def plot_scaling(path, results):
+    """Log-log time over n per algorithm and family, for the first box size."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 5))
+    FigureCanvasAgg(figure)
+    box_size = min(record["box_size"] for record in results)
+    families = [family for family in FAMILIES if any(record["family"] == family for record in results)]
+    for index, family in enumerate(families):
+        axes = figure.add_subplot(1, len(families), index + 1)
+        for algorithm in ALGORITHMS:
+            points = sorted(
+                (record["n"], record["time"]) for record in results
+                if record["algorithm"] == algorithm and record["family"] == family
+                and record["box_size"] == box_size and record.get("status") == "ok"
+            )
+            if points:
+                axes.plot(*zip(*points), marker="o", label=algorithm)
+        axes.set_xscale("log")
+        axes.set_yscale("log")
+        axes.set_title(f"{family}, box size {box_size}")
+        axes.set_xlabel("rectangles")
+        axes.set_ylabel("seconds")
+        if axes.lines:
+            axes.legend(fontsize="small")
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def _format(record) -> str:
+    head = f"{record['algorithm']:<17}{record['family']:<9}{record['box_size']:>5}{record['n']:>8}  "
+    if record.get("status") != "ok":
+        return head + record.get("status", "") + (f" {record['error']}" if "error" in record else "")
+    memory = record["peak_memory_mb"]
+    return head + (
+        f"{record['time']:8.2f}s {'-' if memory is None else f'{memory:7.1f}MB'} "
+        f"{record['num_boxes']:>7} boxes  gap {record['gap']:6.1%} "
+        f"{record['moves_per_second']:>9.0f}/s  {record['stop_reason'] or ''}"
+        + ("" if record["valid"] else "  INVALID")
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--algorithms", nargs="+", default=ALGORITHMS, choices=ALGORITHMS)
+    parser.add_argument("--families", nargs="+", default=FAMILIES, choices=FAMILIES)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--box-sizes", nargs="+", type=int, default=BOX_SIZES)
+    parser.add_argument("--quick", action="store_true", help="n up to 1000 and box size 100 only")
+    parser.add_argument("--no-caps", action="store_true", help="also run the cases above MAX_SIZE")
+    parser.add_argument("--time-limit", type=float, default=5.0, help="budget of one case in seconds")
+    parser.add_argument("--output", "-o", help="write the records as JSON")
+    parser.add_argument("--baseline", help="compare with the records of an earlier run")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the records as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative time and memory increase that counts as a regression")
+    parser.add_argument("--quality-threshold", type=float, default=0.0,
+                        help="relative box count increase that counts as a regression, "
+                             "only for cases that finished within the time budget")
+    parser.add_argument("--plot", metavar="PATH", help="draw the scaling curves (needs matplotlib)")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes = [n for n in args.sizes if n <= 1000]
+        args.box_sizes = [100]
+
+    # a case that cannot be stopped in time, e.g. in its first step, is killed
+    hard_limit = 3 * args.time_limit + 60
+    results = []
+    for case in cases(args.algorithms, args.families, args.sizes, args.box_sizes, not args.no_caps):
+        record = case if case.get("status") == "skipped" else run_isolated(case, args.time_limit, hard_limit)
+        results.append(record)
+        print(_format(record), flush=True)
+
+    exponents = scaling(results)
+    if exponents:
+        print("\nscaling exponents of the time, log(time) over log(n):")
+        for (algorithm, family, box_size), exponent in sorted(exponents.items()):
+            print(f"  {algorithm:<17}{family:<9}{box_size:>5}  {exponent:5.2f}")
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump(results, file, indent=1)
+    if args.plot:
+        plot_scaling(args.plot, results)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold, args.quality_threshold)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            return 1
+        print("no regressions against", args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import bisect
+
+import numpy as np
+
+
+class BoxIndex:
+    """
+    Index over the open boxes of a packing, used to skip boxes that cannot
+    possibly fit a rectangle.
+
+    Every box describes its free space by a list of (width, height) extents
+    (box.get_free_extents()): a rectangle can only be placed if it fits in one
+    of them. The index keeps, per box, the largest free width for every height
+    level and the largest free area. first_fit_candidates() walks a max segment
+    tree over these profiles in opening order and reaches the first box that
+    may fit in O(log B). best_fit_candidates() walks the boxes sorted by
+    residual area, starting at the smallest residual area that is large enough.
+
+    Heights are grouped into at most max_levels levels, rounding down, so the
+    profile stays an upper bound; with box sizes up to max_levels it is exact.
+    """
+
+    def __init__(self, box_size: int, max_levels: int = 256):
+        num_levels = min(box_size, max_levels) + 1
+        # lower edge of every height level, level 0 is height 0
+        self._levels = [(k * box_size) // (num_levels - 1) for k in range(num_levels)]
+        self._level_array = np.array(self._levels)
+        self._boxes = []
+        self._capacity = 1
+        # segment tree with the maximum free width per height level and the
+        # maximum free area per node
+        self._widths = np.full((2, num_levels), -1, dtype=np.int64)
+        self._area = [-1] * 2
+        # residual area per box and (space, index) pairs sorted by it, for best fit
+        self._spaces = []
+        self._by_space = []
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def _grow(self):
+        num_levels = len(self._levels)
+        old_capacity = self._capacity
+        self._capacity *= 2
+        widths = np.full((2 * self._capacity, num_levels), -1, dtype=np.int64)
+        area = [-1] * (2 * self._capacity)
+        count = len(self._boxes)
+        widths[self._capacity : self._capacity + count] = self._widths[old_capacity : old_capacity + count]
+        area[self._capacity : self._capacity + count] = self._area[old_capacity : old_capacity + count]
+        self._widths, self._area = widths, area
+        for node in range(self._capacity - 1, 0, -1):
+            self._pull(node)
+
+    def _set_leaf(self, i, box):
+        node = self._capacity + i
+        extents = box.get_free_extents()
+        if extents:
+            sizes = np.array(extents, dtype=np.int64)
+            # width usable for each level: extents at least as high as the level
+            usable = np.where(
+                sizes[:, 1:2] >= self._level_array[None, :], sizes[:, 0:1], -1
+            )
+            self._widths[node] = usable.max(axis=0)
+            self._area[node] = min(int((sizes[:, 0] * sizes[:, 1]).max()), box.get_space())
+        else:
+            self._widths[node] = -1
+            self._area[node] = -1
+
+    def _pull(self, node):
+        left, right = 2 * node, 2 * node + 1
+        np.maximum(self._widths[left], self._widths[right], out=self._widths[node])
+        self._area[node] = max(self._area[left], self._area[right])
+
+    def append(self, box):
+        """Add a newly opened box."""
+        if len(self._boxes) == self._capacity:
+            self._grow()
+        self._boxes.append(box)
+        self._spaces.append(None)
+        self.update(len(self._boxes) - 1)
+
+    def update(self, i):
+        """Refresh the summary of box i after it changed."""
+        box = self._boxes[i]
+        if self._spaces[i] is not None:
+            position = bisect.bisect_left(self._by_space, (self._spaces[i], i))
+            self._by_space.pop(position)
+        self._spaces[i] = box.get_space()
+        bisect.insort(self._by_space, (self._spaces[i], i))
+        self._set_leaf(i, box)
+        node = (self._capacity + i) // 2
+        while node >= 1:
+            self._pull(node)
+            node //= 2
+
+    def _level(self, height):
+        return bisect.bisect_right(self._levels, height) - 1
+
+    def first_fit(self, area, width, height, start=0):
+        """
+        Returns the index of the first box at or after start that may fit a
+        width x height rectangle, or None. The box still has to confirm the
+        placement, the summary is only an upper bound.
+        """
+        return next(self.first_fit_candidates(area, width, height, start), None)
+
+    def first_fit_candidates(self, area, width, height, start=0):
+        """
+        Yields the indices of the boxes that may fit the rectangle, in opening
+        order, with a single walk over the tree. The index must not change
+        while the generator is used.
+        """
+        level = self._level(height)
+        widths, areas = self._widths, self._area
+        if start >= len(self._boxes) or widths[1, level] < width or areas[1] < area:
+            return
+        stack = [(1, 0, self._capacity)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi <= start or widths[node, level] < width or areas[node] < area:
+                continue
+            if hi - lo == 1:
+                yield lo
+                continue
+            mid = (lo + hi) // 2
+            # push right first, so the left child is searched first
+            stack.append((2 * node + 1, mid, hi))
+            stack.append((2 * node, lo, mid))
+
+    def best_fit_candidates(self, area, width, height):
+        """
+        Yields the indices of the boxes that may fit the rectangle, in order of
+        increasing residual area.
+        """
+        level = self._level(height)
+        position = bisect.bisect_left(self._by_space, (area, -1))
+        for _, i in self._by_space[position:]:
+            node = self._capacity + i
+            if self._widths[node, level] >= width and self._area[node] >= area:
+                yield i
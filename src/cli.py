@@ -0,0 +1,363 @@
+"""
+Headless batch runner, e.g. for jobs started by a scheduler. Run from the src
+directory:
+
+    python -m cli pack --algorithm annealing --rectangles 200 --time-limit 5 --output solution.json
+    python -m cli tsp --algorithm lin_kernighan --instance cities.npy -p k=10 --render tour.png
+
+An instance is loaded with --instance or generated from the size options
+(seeded with --seed). The solution and its metrics are written as JSON to
+--output or stdout. PyQt5 is never imported, matplotlib only for --render,
+and the algorithm modules only for the problem that is solved.
+"""
+import argparse
+import ast
+import contextlib
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+import instrumentation
+from instrumentation import Instrumentation
+
+
+PACKING_ALGORITHMS = (
+    "greedy_area",
+    "greedy_perimeter",
+    "geometry",
+    "rule_based",
+    "partial_overlap",
+    "annealing",
+    "tempering",
+    "backtracking",
+)
+TSP_ALGORITHMS = (
+    "nearest_neighbor",
+    "greedy_edge",
+    "hilbert",
+    "rule_based",
+    "two_opt",
+    "lin_kernighan",
+    "partitioned",
+)
+
+
+def parse_params(items) -> dict:
+    """key=value pairs of -p, the values as Python literals if they parse as one, else as strings."""
+    params = {}
+    for item in items:
+        key, separator, value = item.partition("=")
+        if not separator or not key:
+            raise ValueError(f"Expected key=value, got: {item}")
+        try:
+            params[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[key] = value
+    return params
+
+
+def _load_json(path) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def _write_json(data, path):
+    if path is None or path == "-":
+        json.dump(data, sys.stdout)
+        sys.stdout.write("\n")
+    else:
+        with open(path, "w") as file:
+            json.dump(data, file)
+
+
+def _print_progress(event):
+    print(
+        f"{event.algorithm}: iteration {event.iteration}, {event.elapsed:.1f}s, "
+        f"best {event.best_score:.4f}, {event.snapshot.num_boxes} boxes, "
+        f"{event.moves_per_second:.0f}/s",
+        file=sys.stderr,
+    )
+
+
+def _construct(build, name, *args):
+    """Call an algorithm builder, a parameter the algorithm does not take is a usage error."""
+    try:
+        return build(name, *args)
+    except TypeError as error:
+        raise ValueError(f"{name}: {error}") from error
+
+
+def packing_problem(args):
+    from structs import OptimizationProblem
+
+    if args.instance:
+        data = _load_json(args.instance)
+        sizes = np.asarray(data["rectangles"], dtype=np.int64).reshape(-1, 2)
+        return OptimizationProblem.from_sizes(data["box_size"], sizes[:, 0], sizes[:, 1])
+    return OptimizationProblem(args.box_size, args.rectangles, args.min_size, args.max_size)
+
+
+def packing_algorithm(name, problem, params, control, progress, seed):
+    """The packing algorithm called name, params are passed on to its constructor."""
+    from structs import Box
+    from shelf_box import ShelfBox
+    from max_rects_box import MaxRectsBox
+    from greedy import Greedy, GreedyArea, GreedyPerimeter
+
+    params = dict(params)
+    limits = {"control": control, "progress": progress}
+    if name in ("greedy_area", "greedy_perimeter"):
+        box_types = {"box": Box, "shelf": ShelfBox, "max_rects": MaxRectsBox}
+        params["box_type"] = box_types[params.get("box_type", "box")]
+        strategy = GreedyArea() if name == "greedy_area" else GreedyPerimeter()
+        return Greedy(problem, strategy, **limits, **params)
+    if name in ("geometry", "rule_based", "partial_overlap"):
+        import local_search
+
+        neighborhoods = {
+            "geometry": local_search.GeometryBasedNeighborhood,
+            "rule_based": local_search.RuleBasedNeighborhood,
+            "partial_overlap": local_search.PartialOverlapNeighborhood,
+        }
+        workers = params.pop("workers", 1)
+        occupancy = params.pop("occupancy", "hash")
+        return local_search.LocalSearch(
+            problem, neighborhoods[name](**params), workers, seed, **limits, occupancy=occupancy
+        )
+
+    import algorithms
+
+    if name == "annealing":
+        return algorithms.SimulatedAnnealing(problem, seed=seed, **limits, **params)
+    if name == "tempering":
+        # the control is checked between the rounds, the replicas run in worker processes
+        return algorithms.ParallelTempering(problem, seed=seed, **limits, **params)
+    if name == "backtracking":
+        return algorithms.Backtracking(problem, **limits, **params)
+    raise ValueError(f"Unknown packing algorithm: {name}")
+
+
+def run_packing(args, params) -> dict:
+    from algorithms import l2_lower_bound
+    from progress import ProgressStream, Snapshot
+    from run_control import RunControl
+    from scoring import box_metrics_from_arrays
+
+    problem = packing_problem(args)
+    rectangle_set = problem.get_rectangle_set()
+    box_size = problem.get_box_size()
+    lower_bound = l2_lower_bound(rectangle_set.width, rectangle_set.height, box_size)
+    control = RunControl(
+        args.time_limit, args.max_iterations, lower_bound=lower_bound if args.stop_at_bound else None
+    )
+    progress = ProgressStream(args.progress_interval)
+    if args.progress:
+        progress.subscribe(_print_progress)
+    algorithm = _construct(packing_algorithm, args.algorithm, problem, params, control, progress, args.seed)
+
+    started = time.perf_counter()
+    boxes = algorithm.run()
+    elapsed = time.perf_counter() - started
+    snapshot = Snapshot.from_boxes(boxes)
+
+    placements = snapshot.placements
+    box_metrics = box_metrics_from_arrays(*placements[:, 1:].T, box_size, snapshot.num_boxes)
+    result = {
+        "problem": "packing",
+        "algorithm": args.algorithm,
+        "params": {key: repr(value) for key, value in params.items()},
+        "seed": args.seed,
+        "box_size": box_size,
+        "num_rectangles": len(rectangle_set),
+        "num_boxes": snapshot.num_boxes,
+        "lower_bound": lower_bound,
+        "time": elapsed,
+        "stop_reason": control.stop_reason,
+        "iterations": control.iterations,
+        "utilization": box_metrics.utilization.tolist(),
+    }
+    if not args.metrics_only:
+        result["columns"] = list(Snapshot.COLUMNS)
+        result["placements"] = placements.tolist()
+    if args.write_instance:
+        sizes = np.stack([rectangle_set.width, rectangle_set.height], axis=1)
+        _write_json({"box_size": box_size, "rectangles": sizes.tolist()}, args.write_instance)
+    if args.render:
+        render_packing(args.render, snapshot, box_size, rectangle_set.color, args.algorithm)
+    if args.results:
+        from results import ResultStore, packing_record
+
+        record, arrays = packing_record(
+            problem, args.algorithm, boxes, elapsed, params, args.seed, control, instrumentation.active,
+            lower_bound,
+        )
+        result["run_id"] = ResultStore(args.results).append(record, arrays)
+    return result
+
+
+def render_packing(path, snapshot, box_size, colors, title=None, columns=10):
+    """Draw the boxes of a Snapshot in a grid, like the GUI, to an image file (Agg canvas)."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import PatchCollection
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Rectangle as Patch
+
+    rows = max(1, -(-snapshot.num_boxes // columns))
+    figure = Figure(figsize=(columns, rows + 0.5), dpi=100)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    pitch = box_size * 1.1
+    frames, patches, faces = [], [], []
+    for box in snapshot.boxes():
+        if not len(box):
+            continue
+        index = int(box[0, 1])
+        left, top = (index % columns) * pitch, (index // columns) * pitch
+        frames.append(Patch((left, top), box_size, box_size))
+        for rect_id, _, x, y, width, height in box.tolist():
+            patches.append(Patch((left + x, top + y), width, height))
+            faces.append(colors[rect_id] / 255.0)
+    axes.add_collection(PatchCollection(frames, facecolor="white", edgecolor="black", linewidth=0.5))
+    axes.add_collection(PatchCollection(patches, facecolor=faces, edgecolor="black", linewidth=0.2))
+    axes.set_xlim(0, columns * pitch)
+    axes.set_ylim(rows * pitch, 0)
+    axes.set_aspect("equal")
+    axes.axis("off")
+    if title is not None:
+        axes.set_title(title)
+    figure.savefig(path)
+    return path
+
+
+def tsp_problem(args):
+    from traveling_sales_man import TSPProblem
+
+    if args.instance:
+        if args.instance.endswith(".npy"):
+            coordinates = np.load(args.instance)
+        else:
+            coordinates = np.asarray(_load_json(args.instance)["cities"])
+        return TSPProblem.from_coordinates(coordinates, args.distance_mode, args.distance_directory)
+    return TSPProblem(args.cities, args.width, args.height, args.distance_mode, args.distance_directory)
+
+
+def tsp_algorithm(name, problem, params, control, seed):
+    """The TSP algorithm called name, params are passed on to its constructor."""
+    import traveling_sales_man as tsp
+    from greedy import Greedy
+    from local_search import LocalSearch
+
+    if name in ("nearest_neighbor", "greedy_edge", "hilbert"):
+        return Greedy(problem, tsp.GreedyTSP(name), control=control)
+    if name == "rule_based":
+        return LocalSearch(problem, tsp.RuleBasedTSP(), seed=seed, control=control)
+    if name == "two_opt":
+        return LocalSearch(problem, tsp.TwoOptTSP(**params), seed=seed, control=control)
+    if name == "lin_kernighan":
+        # the time limit is the budget of the optimizer itself
+        time_limit = control.time_limit if control.time_limit is not None else 10.0
+        return tsp.LinKernighanTSP(problem, time_limit=time_limit, seed=seed, **params)
+    if name == "partitioned":
+        return tsp.PartitionedTSP(problem, seed=seed, **params)
+    raise ValueError(f"Unknown TSP algorithm: {name}")
+
+
+def run_tsp(args, params) -> dict:
+    from run_control import RunControl
+
+    problem = tsp_problem(args)
+    control = RunControl(args.time_limit, args.max_iterations)
+    algorithm = _construct(tsp_algorithm, args.algorithm, problem, params, control, args.seed)
+
+    started = time.perf_counter()
+    tour = np.asarray(algorithm.run(), dtype=np.int64)
+    elapsed = time.perf_counter() - started
+    result = {
+        "problem": "tsp",
+        "algorithm": args.algorithm,
+        "params": {key: repr(value) for key, value in params.items()},
+        "seed": args.seed,
+        "num_cities": problem.get_num_cities(),
+        "length": problem.get_oracle().route_length(tour),
+        "time": elapsed,
+        "stop_reason": control.stop_reason,
+    }
+    if not args.metrics_only:
+        result["tour"] = tour.tolist()
+    if args.write_instance:
+        _write_json({"cities": problem.get_coordinates().tolist()}, args.write_instance)
+    if args.render:
+        from tsp_render import render_tour
+
+        render_tour(args.render, problem.get_coordinates(), tour, args.algorithm)
+    return result
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Run an algorithm without the GUI.")
+    subparsers = parser.add_subparsers(dest="problem", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--instance", help="instance file to load instead of generating one")
+    common.add_argument("--write-instance", metavar="PATH", help="also write the instance as JSON")
+    common.add_argument("-p", "--param", action="append", default=[], metavar="KEY=VALUE",
+                        help="parameter of the algorithm, may be repeated")
+    common.add_argument("--seed", type=int, help="seeds the instance and the algorithm")
+    common.add_argument("--time-limit", type=float, help="seconds until the algorithm stops")
+    common.add_argument("--max-iterations", type=int, help="iterations until the algorithm stops")
+    common.add_argument("--output", "-o", help="result JSON file, stdout by default")
+    common.add_argument("--metrics-only", action="store_true", help="leave the solution out of the result")
+    common.add_argument("--render", metavar="PATH", help="draw the solution to an image file (needs matplotlib)")
+    common.add_argument("--instrument", action="store_true",
+                        help="add the hot-path counters and phase times of the run to the result")
+
+    pack = subparsers.add_parser("pack", parents=[common], help="rectangle packing")
+    pack.add_argument("--algorithm", "-a", required=True, choices=PACKING_ALGORITHMS)
+    pack.add_argument("--box-size", type=int, default=100)
+    pack.add_argument("--rectangles", type=int, default=100, help="number of rectangles")
+    pack.add_argument("--min-size", type=int, default=1)
+    pack.add_argument("--max-size", type=int, default=40)
+    pack.add_argument("--stop-at-bound", action="store_true",
+                      help="stop as soon as a solution reaches the L2 lower bound")
+    pack.add_argument("--results", metavar="DIRECTORY",
+                      help="also add the run to the results store in DIRECTORY (see results.py)")
+    pack.add_argument("--progress", action="store_true", help="print progress events to stderr")
+    pack.add_argument("--progress-interval", type=float, default=1.0, metavar="SECONDS")
+
+    tsp = subparsers.add_parser("tsp", parents=[common], help="traveling salesman")
+    tsp.add_argument("--algorithm", "-a", required=True, choices=TSP_ALGORITHMS)
+    tsp.add_argument("--cities", type=int, default=100, help="number of cities")
+    tsp.add_argument("--width", type=int, default=100)
+    tsp.add_argument("--height", type=int, default=100)
+    tsp.add_argument("--distance-mode", default="auto", choices=("auto", "dense", "memmap", "lazy"))
+    tsp.add_argument("--distance-directory", help="where the memory mapped distance matrices are kept")
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        params = parse_params(args.param)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    stats = Instrumentation() if args.instrument else contextlib.nullcontext()
+    try:
+        with stats:
+            result = run_packing(args, params) if args.problem == "pack" else run_tsp(args, params)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.instrument:
+        result["instrumentation"] = stats.as_dict()
+    _write_json(result, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,109 @@
 from structs import *
 from shelf_box import *
+from max_rects_box import MaxRectsBox
+from box_index import BoxIndex
+from run_control import RunControl
+from progress import ProgressStream, Snapshot
 
 # Greedy Algorithm
 class Greedy:
-    def __init__(self, problem, strategy):
+    def __init__(
+        self, problem, strategy, box_type=Box, selection="first_fit", control=None, progress=None,
+        occupancy="hash",
+    ):
+        """
+        :param box_type: the box class used for new boxes, e.g. Box or MaxRectsBox
+        :param occupancy: overlap check backend of new Boxes, "hash" or "bitmap" (see Box),
+               the other box types keep their own free space bookkeeping
+        :param selection: "first_fit" puts a rectangle in the first open box it fits in,
+               "best_fit" in the box with the smallest residual area it fits in
+        :param control: RunControl checked before every rectangle; once it stops the run
+               the remaining rectangles go into shelf boxes, so the solution stays complete
+        :param progress: ProgressStream that gets the number of boxes and the boxes so far
+        """
+        if selection not in ("first_fit", "best_fit"):
+            raise ValueError(f"Unknown box selection: {selection}")
         self.problem = problem
         self.strategy = strategy
+        self._box_type = box_type
+        self._occupancy = occupancy
+        self._selection = selection
+        self.control = control if control is not None else RunControl()
+        self.progress = progress if progress is not None else ProgressStream()
         self._boxes = []
+        # skips the boxes that cannot fit a rectangle, only packing problems have boxes
+        self._index = (
+            BoxIndex(problem.get_box_size()) if isinstance(problem, OptimizationProblem) else None
+        )
 
     def run(self):
+        self.control.start()
+        self.progress.start()
         objects = self.strategy.start(self.problem)
         sorted_objects = self.strategy.generate_order(objects)
 
         # Apply the strategy to place rectangles
         if isinstance(self.strategy, GreedyArea) or isinstance(self.strategy, GreedyPerimeter):
-            for rectangle in sorted_objects:
-                self.place_rectangle(rectangle)
+            control, progress = self.control, self.progress
+            for i, rectangle in enumerate(sorted_objects):
+                if control.step():
+                    self._place_after_stop(rectangle)
+                else:
+                    self.place_rectangle(rectangle)
+                if progress.due():
+                    self._publish(i + 1)
+            self._publish(len(sorted_objects), final=True)
             # return boxes
             return self._boxes
 
         return sorted_objects
 
+    def _publish(self, placed, final=False):
+        self.progress.publish(
+            type(self).__name__, placed, len(self._boxes), len(self._boxes),
+            lambda: Snapshot.from_boxes(self._boxes), final,
+        )
+
+    def _place_in_open_box(self, rectangle) -> bool:
+        """Try the open boxes that may fit the rectangle, as chosen by the index."""
+        area = rectangle.width * rectangle.height
+        width, height = rectangle.width, rectangle.height
+        if self._selection == "best_fit":
+            candidates = self._index.best_fit_candidates(area, width, height)
+        else:
+            candidates = self._index.first_fit_candidates(area, width, height)
+        for i in candidates:
+            if self._boxes[i].place(rectangle):
+                self._index.update(i)
+                return True
+        return False
+
+    def _open_box(self, box, rectangle):
+        box.place(rectangle)
+        self._boxes.append(box)
+        self._index.append(box)
+
+    def _new_box(self):
+        if self._box_type is Box:
+            return Box(self.problem.get_box_size(), occupancy=self._occupancy)
+        return self._box_type(self.problem.get_box_size())
+
     def place_rectangle(self, rectangle):
-        placed = False
-        for box in self._boxes:
-            placed = box.place(rectangle)
-            if placed: break
-        if not placed:
-            box = Box(self.problem.get_box_size())
-            box.place(rectangle)
-            self._boxes.append(box)
+        if not self._place_in_open_box(rectangle):
+            self._open_box(self._new_box(), rectangle)
 
     def fast_place_rectangle(self, rectangle):
-        placed = False
-        for box in self._boxes:
-            placed = box.place(rectangle)
-            if placed: break
-        if not placed:
+        if not self._place_in_open_box(rectangle):
+            self._open_box(ShelfBox(self.problem.get_box_size()), rectangle)
+
+    def _place_after_stop(self, rectangle):
+        """
+        The cheapest placement that keeps the solution complete once the run is
+        stopped: only the last box is tried if it is a shelf box, otherwise a
+        new shelf box is opened.
+        """
+        last = self._boxes[-1] if self._boxes else None
+        if not (isinstance(last, ShelfBox) and last.place(rectangle)):
             box = ShelfBox(self.problem.get_box_size())
             box.place(rectangle)
             self._boxes.append(box)
@@ -47,18 +114,23 @@ class Greedy:
 # Strategy Implementations for Greedy; 1 by area, 2 by perimeter
 class GreedyArea:
     def start(self, problem):
-        return problem.get_rectangles()
+        return problem.get_rectangle_set()
     """
     Greedy strategy to sort the rectangles by area. The rectangles are sorted in decreasing order of area.
     """
     def generate_order(self, solution):
+        if isinstance(solution, RectangleSet):
+            # stable sort on the area column, same order as sorted(..., reverse=True)
+            return solution.take(np.argsort(-solution.area(), kind="stable"))
         return sorted(solution, key=lambda x: x.width * x.height, reverse=True)
 
 class GreedyPerimeter:
     def start(self, problem):
-        return problem.get_rectangles()
+        return problem.get_rectangle_set()
     """
     Greedy strategy to sort the rectangles by perimeter. The rectangles are sorted in decreasing order of perimeter.
     """
     def generate_order(self, solution):
+        if isinstance(solution, RectangleSet):
+            return solution.take(np.argsort(-solution.perimeter(), kind="stable"))
         return sorted(solution, key=lambda x: x.width + x.height, reverse=True)
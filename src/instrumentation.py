@@ -0,0 +1,83 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# the Instrumentation that is recording, None when instrumentation is off
+active = None
+
+
+class Instrumentation:
+    """
+    Hot-path counters and phase timers of one run. The counting sites read
+    the module attribute active and do nothing else while it is None, so an
+    uninstrumented run pays one attribute read per call. Recording is
+    process wide: one run at a time, a nested recording takes over until it
+    ends.
+
+    Counters:
+        Box.place, Box.can_place, Box.copy, MaxRectsBox.place, MaxRectsBox.copy,
+        Box.compute_overlap and Box.compute_overlap.cells (grid cells visited)
+        or Box.compute_overlap.rows (bitmap rows summed, occupancy="bitmap"),
+        ShelfBox.place and ShelfBox.gap_scans (gaps compared with the rectangle),
+        Neighborhood._score_solution
+    Phases (seconds):
+        neighbors, scoring and acceptance of LocalSearch and SimulatedAnnealing
+
+    Usage:
+        with Instrumentation() as stats:
+            algorithm.run()
+        stats.as_dict()
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.phases = defaultdict(float)
+        self._previous = None
+
+    def __enter__(self):
+        global active
+        self.reset()
+        self._previous, active = active, self
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        active, self._previous = self._previous, None
+        return False
+
+    def reset(self):
+        self.counters.clear()
+        self.phases.clear()
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def lap(self, phase, since) -> float:
+        """Add the seconds from since to now to phase, returns now for the next phase."""
+        now = time.perf_counter()
+        self.phases[phase] += now - since
+        return now
+
+    def as_dict(self) -> dict:
+        """Copy of the counters and phase seconds, safe to hand to another thread."""
+        return {"counters": dict(self.counters), "phases": dict(self.phases)}
+
+
+def snapshot():
+    """as_dict() of the active recording, None when instrumentation is off."""
+    return None if active is None else active.as_dict()
+
+
+@contextmanager
+def suspended():
+    """
+    Turn the active recording off for a block, for work done only for the
+    caller, e.g. scoring a solution for a progress event.
+    """
+    global active
+    previous, active = active, None
+    try:
+        yield
+    finally:
+        active = previous
@@ -1,51 +1,227 @@
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 from itertools import permutations
+import instrumentation
 from structs import *
 from greedy import *
 from scoring import *
+from overlap import OverlapTracker, has_overlap, overlap_area
+from run_control import RunControl
+from progress import ProgressStream, Snapshot
 
 
 # Local Search Algorithm
 class LocalSearch:
-    def __init__(self, optimization_problem, neighborhood):
+    """
+    Best-improvement local search.
+    Args:
+        workers: number of processes used to score the candidate moves of
+                 neighborhoods that describe their moves compactly (see
+                 Neighborhood.evaluate_moves(), RuleBasedNeighborhood and
+                 PartialOverlapNeighborhood), 1 scores them in this process
+        seed: seeds random and numpy.random at the start of run(), the
+              result does not depend on the number of workers
+        control: RunControl checked before every neighborhood step, a stopped
+                 search returns its current solution, which is the best one
+                 so far; a solution that still has overlaps is replaced by
+                 the last one without overlaps, or if there was none by the
+                 GreedyArea packing within the rest of the deadline
+        progress: ProgressStream that gets the neighborhood score and the
+                  current solution after the neighborhood steps
+        occupancy: overlap check backend of the Boxes of the neighborhoods,
+                   "hash" or "bitmap" (see Box)
+    """
+
+    def __init__(
+        self, optimization_problem, neighborhood, workers=1, seed=None, control=None, progress=None,
+        occupancy="hash",
+    ):
         self._problem = optimization_problem
         self._neighborhood = neighborhood
         self._boxes = []
+        self._workers = workers
+        self._seed = seed
+        self.control = control if control is not None else RunControl()
+        self.progress = progress if progress is not None else ProgressStream()
+        self._occupancy = occupancy
 
     def run(self):
+        self.control.start()
+        self.progress.start()
+        if self._seed is not None:
+            random.seed(self._seed)
+            np.random.seed(self._seed)
+        if self._workers > 1:
+            with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                return self._search(executor)
+        return self._search()
+
+    def _search(self, executor=None):
+        # long neighborhood steps can check the control inside the step
+        self._neighborhood.control = self.control
+        self._neighborhood.occupancy = self._occupancy
         self._boxes = self._neighborhood.start(self._problem)
+        # only improving neighbors are accepted, the last feasible one is the best
+        best_feasible = self._boxes if self._neighborhood.feasible(self._boxes) else None
+        iteration = 0
         # Perform the search by iterating through neighbors
         while True:
-            neighbors = self._neighborhood.generate_neighbors(self._boxes)
+            if self.progress.due():
+                self._publish(iteration)
+            if self._at_lower_bound() or self.control.step():
+                break
+            iteration += 1
+            stats = instrumentation.active
+            if stats is not None:
+                mark = time.perf_counter()
+            if executor is None:
+                neighbors = self._neighborhood.generate_neighbors(self._boxes)
+            else:
+                neighbors = self._neighborhood.generate_neighbors(
+                    self._boxes, executor=executor, workers=self._workers
+                )
+            if stats is not None:
+                mark = stats.lap("neighbors", mark)
             best_neighbor = self._boxes if len(neighbors) ==0 else neighbors[0]
-            if self._neighborhood._score_solution(best_neighbor) > self._neighborhood._score_solution(self._boxes):
+            improved = self._neighborhood._score_solution(best_neighbor) > self._neighborhood._score_solution(self._boxes)
+            if stats is not None:
+                mark = stats.lap("scoring", mark)
+            stop = False
+            if improved:
                 self._boxes = best_neighbor
+                if self._neighborhood.feasible(best_neighbor):
+                    best_feasible = best_neighbor
             else:
                 if "PartialOverlapNeighborhood" in str(type(self._neighborhood)):
                     if self._neighborhood.iteration < self._neighborhood.max_iterations:
                         self._neighborhood.iteration = self._neighborhood.max_iterations
                     else:
-                        break
+                        stop = True
                 else:
-                    break
+                    stop = True
+            if stats is not None:
+                stats.lap("acceptance", mark)
+            if stop:
+                break
+        if self.control.stopped and not self._neighborhood.feasible(self._boxes):
+            self._boxes = best_feasible if best_feasible is not None else self._fallback()
+        self._publish(iteration, final=True)
         return self._boxes
 
+    def _fallback(self):
+        """
+        GreedyArea packing in MaxRectsBoxes within the rest of the deadline,
+        the rectangles left when it runs out go into shelf boxes.
+        """
+        control = RunControl(time_limit=self.control.remaining(), token=self.control.token)
+        return Greedy(self._problem, GreedyArea(), box_type=MaxRectsBox, control=control).run()
+
+    def _publish(self, iteration, final=False):
+        """The current solution is the best one, only improving neighbors are accepted."""
+        if not self.progress.subscribed:
+            return
+        boxes = self._boxes
+        # not part of the search, so not counted
+        with instrumentation.suspended():
+            score = self._neighborhood._score_solution(boxes)
+        self.progress.publish(
+            type(self).__name__, iteration, score, score, lambda: Snapshot.from_boxes(boxes), final
+        )
+
+    def _at_lower_bound(self) -> bool:
+        lower_bound = self.control.lower_bound
+        return (
+            lower_bound is not None
+            and len(self._boxes) <= lower_bound
+            and self._neighborhood.feasible(self._boxes)
+            and self.control.bound_reached(len(self._boxes))
+        )
+
 
 class Neighborhood:
+    # RunControl of the LocalSearch that uses the neighborhood
+    control = None
+    # occupancy backend of the Boxes the neighborhood creates
+    occupancy = "hash"
+
     def start(self, problem: OptimizationProblem):
         raise NotImplementedError()
 
-    def generate_neighbors(self, solution):
+    def generate_neighbors(self, solution, executor=None, workers=1):
+        raise NotImplementedError()
+
+    def feasible(self, solution) -> bool:
+        """False if the solution is not a valid packing yet, e.g. it has overlaps."""
+        return True
+
+    def move_state(self, solution):
+        """
+        Compact, picklable state of the current solution that score_moves()
+        needs, e.g. NumPy arrays instead of boxes.
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def score_moves(cls, state, moves) -> list:
+        """Score compact move descriptions against a state from move_state()."""
         raise NotImplementedError()
 
+    def evaluate_moves(self, solution, moves, executor=None, workers=1) -> list:
+        """
+        Score compact move descriptions against the current solution. With a
+        concurrent.futures executor the moves are split round-robin into one
+        task per worker, every task carries the state of the solution once and
+        its moves, and only the scores come back. The scores are returned in
+        the order of the moves, independent of the number of workers.
+        """
+        state = self.move_state(solution)
+        if executor is None or workers <= 1 or len(moves) < 2:
+            return type(self).score_moves(state, moves)
+        chunks = [range(k, len(moves), workers) for k in range(min(workers, len(moves)))]
+        futures = [
+            executor.submit(type(self).score_moves, state, [moves[i] for i in chunk])
+            for chunk in chunks
+        ]
+        scores = [None] * len(moves)
+        for chunk, future in zip(chunks, futures):
+            for i, score in zip(chunk, future.result()):
+                scores[i] = score
+        return scores
+
+    @staticmethod
+    def _materialize(new_solution, solution, touched):
+        """
+        Turn a solution that is built on top of the (journaled) boxes of the
+        current solution into an independent one. Only the boxes touched by
+        the move, and boxes that were added, are copied.
+        """
+        original = {id(box) for box in solution}
+        return [
+            box.copy() if id(box) in touched or id(box) not in original else box
+            for box in new_solution
+        ]
+
     def _score_solution(self, solution):
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("Neighborhood._score_solution")
+        return self._score_metrics(SolutionMetrics.from_solution(solution))
+
+    def _score_metrics(self, metrics: SolutionMetrics):
+        """
+        Score from the aggregated box metrics. A neighbor that changes a few
+        boxes is scored with metrics.replace(), without visiting the others.
+        """
         # get relevant infos
-        num_boxes = len(solution)
-        minimum_util = compute_min_utilization(solution)
-        avg_compactness = compute_average_compactness(solution)
-        avg_irregular_gap = compute_average_irregular_gap_penalty(solution)
-        avg_contiguity = compute_average_contiguity(solution)
+        num_boxes = metrics.num_boxes
+        minimum_util = metrics.min_utilization()
+        avg_compactness = metrics.average_compactness()
+        avg_irregular_gap = metrics.average_irregular_gap_penalty()
+        avg_contiguity = metrics.average_contiguity()
 
         # weights
         w_num_boxes = 1000
@@ -69,6 +245,10 @@ class GeometryBasedNeighborhood(Neighborhood):
     1. We move rectangles to the different box or within the same box
     2. Swap with another rectangle
     3. Rotate the rectangle
+
+    The neighbor is a single sweep in which every move depends on the ones
+    before it, there are no independent candidates to score in parallel, so
+    the workers of LocalSearch are not used.
     """
 
     def start(self, problem):
@@ -78,12 +258,12 @@ class GeometryBasedNeighborhood(Neighborhood):
         solution = []
         for object in objects:
             # box = ShelfBox(box_size) # much faster
-            box = Box(box_size)
+            box = Box(box_size, occupancy=self.occupancy)
             box.place(object)
             solution.append(box)
         return solution
 
-    def generate_neighbors(self, solution):
+    def generate_neighbors(self, solution, executor=None, workers=1):
         """
         Generate a set of neighbor solutions by moving rectangles between boxes.
         Uses a scoring system to prioritize the most promising neighbors.
@@ -103,11 +283,19 @@ class GeometryBasedNeighborhood(Neighborhood):
     def _move_rectangle(self, solution):
         """
         Generate neighbors by moving rectangles between boxes.
+        The moves are applied to the boxes of the current solution inside a
+        transaction, only the touched boxes are copied for the neighbor and the
+        current solution is rolled back afterwards.
         """
         neighbors = []
         # new_solution: list[ShelfBox] = [box.copy() for box in solution] much faster
-        new_solution: list[Box] = [box.copy() for box in solution]
+        new_solution: list[Box] = list(solution)
+        begin_all(solution)
+        touched = set()
         for j, targeted_box in enumerate(new_solution):
+            # every applied move keeps the solution valid, so a stopped sweep is a neighbor too
+            if self.control is not None and self.control.should_stop():
+                break
             remove_index = 0  # To adjust the index after removing a box
             # (e.g, if a box is removed, the index of the next box will be reduced by 1 not by 2)
             for i, source_box in enumerate(reversed(new_solution)):
@@ -121,9 +309,14 @@ class GeometryBasedNeighborhood(Neighborhood):
                     break
                 rect = source_box.get_rectangles()[-1]
 
+                move_boxes = (source_box, new_solution[j])
+                begin_all(move_boxes)
+                new_solution[real_index].remove_rectangle(rect)
                 if new_solution[j].place(rect):
-                    new_solution[real_index].remove_rectangle(rect)
+                    commit_all(move_boxes)
+                    touched.update(id(box) for box in move_boxes)
                 else:
+                    rollback_all(move_boxes)
                     continue
                 # If the source box becomes empty, remove it
                 if new_solution[real_index].get_rectangles() == []:
@@ -131,7 +324,12 @@ class GeometryBasedNeighborhood(Neighborhood):
                     remove_index += 1
 
                 # Add the modified solution as a neighbor
-                neighbors.append(new_solution)
+                if not neighbors:
+                    neighbors.append(new_solution)
+        if neighbors:
+            # every neighbor is the same list with all moves applied
+            neighbors = [self._materialize(new_solution, solution, touched)]
+        rollback_all(solution)
         return neighbors
 
     def _score_solution(self, solution):
@@ -139,6 +337,9 @@ class GeometryBasedNeighborhood(Neighborhood):
         Scoring function for the geometry-based neighborhood.
         The score is calculated based on the number of boxes and the wasted space in the last box.
         """
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("Neighborhood._score_solution")
         num_boxes = len(solution)
         last_box_wasted_space = solution[-1].get_space()
         score = 1000 - (num_boxes * 1000) - last_box_wasted_space
@@ -147,90 +348,169 @@ class GeometryBasedNeighborhood(Neighborhood):
 
 
 class RuleBasedNeighborhood(Neighborhood):
-    def __init__(self):
+    """
+    Searches over the order in which the rectangles are packed into shelf
+    boxes. The moves are swaps of two of 4 sections of the order and
+    num_swaps random swaps of adjacent rectangles, they can be scored in
+    parallel (see Neighborhood.evaluate_moves()).
+    """
+
+    num_sections = 4
+
+    def __init__(self, num_swaps=10):
         self._order = []
+        self.num_swaps = num_swaps
 
     def start(self, problem):
         presort = True
-        self._order = problem.get_rectangles()
+        self._order = list(problem.get_rectangles())
         if presort:
             # greedy_area = Greedy(problem, GreedyArea())
             # greedy_area.run()
             # solution = greedy_area.get_solution()
-            self._order = sorted(
-                self._order, key=lambda x: x.width * x.height, reverse=True
-            )
-        solution = [ShelfBox(problem.get_box_size())]
-        for rectangle in self._order:
+            self._order = GreedyArea().generate_order(problem.get_rectangle_set())
+        box_size = problem.get_box_size()
+        return self._decode(self._order, box_size, [ShelfBox(box_size)])
+
+    @staticmethod
+    def _decode(order, box_size, boxes):
+        """
+        Pack the rectangles in the given order into the boxes (first fit),
+        opening new boxes as needed.
+        Returns:
+            list: the boxes
+        """
+        for rectangle in order:
             placed = False
-            for box in solution:
+            for box in boxes:
                 placed = box.place(rectangle)
                 if placed:
                     break
             if not placed:
-                box = ShelfBox(problem.get_box_size())
+                box = ShelfBox(box_size)
                 box.place(rectangle)
-                solution.append(box)
-        return solution
+                boxes.append(box)
+        return boxes
 
-    def generate_neighbors(self, solution):
+    def generate_neighbors(self, solution, executor=None, workers=1):
         # Generate neighbors by modifying the order of rectangles
         neighbors = []
         best_score = self._score_solution(solution)
         best_neighbor = solution
-        length = len(self._order)
         box_size = solution[0].get_length()
-        prev_order = self._order
-        # section based permutation with 4 sections
-        num_sections = 4
-        section_size = length // num_sections
-        sections = [
-            prev_order[i * section_size : (i + 1) * section_size]
-            for i in range(num_sections - 1)
-        ]
-        sections.append(prev_order[section_size * (num_sections - 1) :])
-        new_orders = self._permutate(sections)
-        # max 10 random swaps
-        num_swaps = min(10, length - 1)  # Swap at most 10 pairs
-        swap_indices = random.sample(range(length - 1), num_swaps)
-        for i in swap_indices:
-            # Swap two elements
-            new_order = prev_order  # Create a copy before modifying
-            new_order[i], new_order[i + 1] = new_order[i + 1], new_order[i]
-            new_orders.append(new_order)
-
-        for order in new_orders:
-            fresh_order = [rect.copy() for rect in order]
-            new_neighbor = [ShelfBox(box_size)]
-            for rectangle in fresh_order:
-                placed = False
-                for box in new_neighbor:
-                    placed = box.place(rectangle)
-                    if placed: break
-                if not placed:
-                    box = ShelfBox(box_size)
-                    box.place(rectangle)
-                    new_neighbor.append(box)
+        moves = self._candidate_moves()
+
+        best_move = None
+        for move, score in zip(moves, self.evaluate_moves(solution, moves, executor, workers)):
             # only save neighbor if it is better
-            score = self._score_solution(new_neighbor)
             if score > best_score:
                 best_score = score
-                best_neighbor = new_neighbor
-                self._order = order
+                best_move = move
+        if best_move is not None:
+            order = self._move_order(len(self._order), best_move, self.num_sections)
+            self._order = [self._order[i] for i in order]
+            fresh_order = copy_rectangles(self._order)
+            best_neighbor = self._decode(fresh_order, box_size, [ShelfBox(box_size)])
         neighbors.append(best_neighbor)
         return neighbors
 
-    def _permutate(self, sections):
-        result = []
-        for i in range(len(sections)):
-            for j in range(len(sections)):
-                new_neighbor = sections[:]
-                new_neighbor[i], new_neighbor [j] = new_neighbor[j], new_neighbor[i]
-                result.append(new_neighbor)
-
-        # Flatten the permutations before returning
-        return [[rect for section in perm for rect in section] for perm in result]
-
+    def _candidate_moves(self):
+        """
+        Compact descriptions of the candidate orders:
+            ("sections", i, j)  swap the sections i and j
+            ("swap", i)         swap the rectangles at i and i + 1
+        """
+        length = len(self._order)
+        moves = []
+        # section based permutation, swapping empty sections changes nothing
+        if length >= self.num_sections:
+            moves.extend(
+                ("sections", i, j)
+                for i in range(self.num_sections)
+                for j in range(i + 1, self.num_sections)
+            )
+        # max num_swaps random swaps
+        num_swaps = min(self.num_swaps, length - 1)
+        swap_indices = random.sample(range(length - 1), num_swaps)
+        moves.extend(("swap", i) for i in swap_indices)
+        return moves
+
+    @staticmethod
+    def _move_order(length, move, num_sections):
+        """The candidate order of a move, as positions in the current order."""
+        positions = list(range(length))
+        if move[0] == "swap":
+            i = move[1]
+            positions[i], positions[i + 1] = positions[i + 1], positions[i]
+            return positions
+        _, i, j = move
+        section_size = length // num_sections
+        sections = [
+            positions[k * section_size : (k + 1) * section_size]
+            for k in range(num_sections - 1)
+        ]
+        sections.append(positions[section_size * (num_sections - 1) :])
+        sections[i], sections[j] = sections[j], sections[i]
+        return [position for section in sections for position in section]
+
+    def move_state(self, solution):
+        widths = np.array([rect.width for rect in self._order], dtype=np.int32)
+        heights = np.array([rect.height for rect in self._order], dtype=np.int32)
+        return widths, heights, solution[0].get_length()
+
+    @classmethod
+    def score_moves(cls, state, moves):
+        widths, heights, box_size = state
+        # fresh rectangles in the current order, the colors are not needed
+        rectangles = RectangleSet(
+            widths, heights, color=np.zeros((len(widths), 3), dtype=np.uint8)
+        ).views()
+        orders = [cls._move_order(len(widths), move, cls.num_sections) for move in moves]
+        return cls()._score_orders(rectangles, orders, box_size)
+
+    def _score_orders(self, rectangles, orders, box_size):
+        """
+        Score candidate orders, given as lists of positions in the list of
+        rectangles in the current order. The current order is decoded once, and a transaction is begun
+        on the boxes at every length of a prefix shared with a candidate, which
+        makes the packing state after that prefix a snapshot. The candidates
+        are evaluated from the longest shared prefix to the shortest: rolling
+        back to the snapshot and replaying the suffix costs O(n - prefix).
+        Returns:
+            list: the score of every order
+        """
+        current = np.arange(len(rectangles))
+        prefixes = []
+        for order in orders:
+            differs = np.flatnonzero(np.asarray(order) != current)
+            prefixes.append(int(differs[0]) if len(differs) else len(current))
+
+        boxes = [ShelfBox(box_size)]
+        snapshots = []  # (prefix length, number of boxes) per transaction
+        decoded = 0
+        for prefix in sorted(set(prefixes)):
+            self._decode(rectangles[decoded:prefix], box_size, boxes)
+            decoded = prefix
+            begin_all(boxes)
+            snapshots.append((prefix, len(boxes)))
+
+        scores = [None] * len(orders)
+        for k in sorted(range(len(orders)), key=lambda k: prefixes[k], reverse=True):
+            # drop the snapshots behind the shared prefix, then restore the one
+            # at the prefix; boxes opened after a snapshot are not in its
+            # transaction and are simply discarded
+            while snapshots[-1][0] > prefixes[k]:
+                _, count = snapshots.pop()
+                rollback_all(boxes[:count])
+                del boxes[count:]
+            _, count = snapshots[-1]
+            rollback_all(boxes[:count])
+            del boxes[count:]
+            begin_all(boxes)
+            suffix = [rectangles[i] for i in orders[k][prefixes[k]:]]
+            self._decode(suffix, box_size, boxes)
+            scores[k] = self._score_solution(boxes)
+        return scores
 
 class PartialOverlapNeighborhood(Neighborhood):
     """
@@ -239,6 +519,8 @@ class PartialOverlapNeighborhood(Neighborhood):
     the overlap threshold down to 0%. Any overlap beyond the current
     threshold is heavily penalized in the scoring function, thus
     guiding the local search to eventually eliminate overlaps.
+    While overlaps are tolerated the candidate moves are compact (source box,
+    order of its rectangles, seed) and can be scored in parallel.
     """
 
     def __init__(self, max_iterations=10):
@@ -249,6 +531,8 @@ class PartialOverlapNeighborhood(Neighborhood):
         super().__init__()
         self.iteration = 0
         self.max_iterations = max_iterations
+        # big constant factor to heavily penalize large overlaps
+        self.overlap_penalty_factor = 1000000
         # Start at 100% overlap allowed and end at 0%.
         self.current_tolerance = 1.0
 
@@ -261,7 +545,7 @@ class PartialOverlapNeighborhood(Neighborhood):
         """
         objects = problem.get_rectangles()
         box_size = problem.get_box_size()
-        solution = [Box(box_size)]
+        solution = [Box(box_size, occupancy=self.occupancy)]
 
         for obj in objects:
             solution[0].place_no_check(obj)
@@ -272,7 +556,7 @@ class PartialOverlapNeighborhood(Neighborhood):
             self.iteration = self.max_iterations
         return solution
 
-    def generate_neighbors(self, solution):
+    def generate_neighbors(self, solution, executor=None, workers=1):
         """
         Generate neighbors by attempting random "moves" of rectangles
         between boxes or within the same box. Each neighbor is evaluated
@@ -291,80 +575,46 @@ class PartialOverlapNeighborhood(Neighborhood):
         # Produce a handful of neighbors by randomly moving rectangles.
         # (You can refine or optimize how many neighbors you generate.)
 
-        # Flatten all boxes' rectangles for easy indexing
+        # Overlaps of every box from the sweep-line engine, O(n log n + k)
+        trackers = {id(b): OverlapTracker(b.get_rectangles()) for b in solution}
         scored_boxes = []
-        rect_count = 0
         for b_idx, b in enumerate(solution):
             rects = b.get_rectangles()
-            scored_rects = []
-            box_overlap = 0
-            for i in range(len(rects)):
-                rect_count += 1
-                rect_overlap = 0
-                for j in range(i + 1, len(rects)):
-                    r1 = rects[i]
-                    r2 = rects[j]
-                    rect_overlap += self._calc_overlap_area(r1, r2)
-                box_overlap += rect_overlap
-                scored_rects.append((rect_overlap, i))
+            # overlap of every rectangle with the ones after it in the box
+            forward = trackers[id(b)].forward_overlaps(rects)
+            box_overlap = sum(forward)
+            scored_rects = list(zip(forward, range(len(rects))))
             sorted_rects = sorted(scored_rects, key=lambda x: x[0], reverse = True)
             scored_boxes.append((box_overlap, b_idx, sorted_rects))
         sorted_boxes = sorted(scored_boxes, key=lambda x: (x[0], -len(x[2])), reverse = True)
         if self.current_tolerance>0.001:
             num_moves = min(20, len(sorted_boxes))
-            for i in range(num_moves):
-                new_solution = [box.copy() for box in solution]
-                source_box_idx = sorted_boxes[i][1]
-                source_box = new_solution[source_box_idx]
-                moved_idx = 0
-                rects = source_box.get_rectangles()
-                num_rects_moved =  len(rects)//self.iteration
-                for _ in range(num_rects_moved):
-                    #select the rect with most overlap
-                    sorted_rects = sorted_boxes[i][2]
-                    rect = rects[sorted_rects[moved_idx][1]]
-                    # remove that rectangle
-                    source_box.remove_rectangle(rect, False)
-                    #adjust index
-                    for j in range(len(sorted_rects)):
-                        if sorted_rects[j][1] > sorted_rects[moved_idx][1]:
-                            sorted_rects[j] = (sorted_rects[j][0],sorted_rects[j][1] - 1)
-                    moved_idx += 1
-                    #give option to expand
-                    box_size = solution[0].get_length()
-                    box_area = box_size*box_size
-                    if (compute_min_utilization(new_solution) +
-                            ((rect.height * rect.width) / box_area))>0.8:
-                        new_solution.append(Box(box_size))
-                    placed = False
-                    counter = 0
-                    # pick a random target box, if same, get a different one
-                    while not placed:
-                        target_box_idx = random.randint(0, len(new_solution) - 1)
-                        while target_box_idx == source_box_idx:
-                            target_box_idx = random.randint(0, len(new_solution) - 1)
-                        target_box = new_solution[target_box_idx]
-                        placed = target_box.place(rect, False)
-                        if not placed:
-                            counter += 1
-                        if counter > 100:
-                            rect.x, rect.y = (0,0)
-                            target_box.place_no_check(rect)
-                            placed = True
-                    # If source box is now empty, remove it
-
-                    if len(source_box.get_rectangles()) == 0:
-                        new_solution.remove(source_box)
-                    if len(new_solution[-1].get_rectangles()) == 0:
-                        new_solution.remove(new_solution[-1])
-
-                neighbors.append(new_solution)
-            # Sort neighbors by the new scoring function (including overlap penalty)
-            scored_neighbors = [(self._score_solution(n), n) for n in neighbors]
-            scored_neighbors.sort(reverse=True, key=lambda x: x[0])
-            return [neigh for _, neigh in scored_neighbors[:num_moves]]
+            # compact moves: the source box, the order in which its rectangles
+            # are moved and the seed that picks the target boxes and corners
+            moves = [
+                (sorted_boxes[i][1], tuple(index for _, index in sorted_boxes[i][2]), random.getrandbits(32))
+                for i in range(num_moves)
+            ]
+            if not moves:
+                return neighbors
+            if executor is None or workers <= 1:
+                # the boxes behave as the ones rebuilt by score_moves(), the
+                # current boxes and trackers are used directly
+                scores = self._score_moves(solution, trackers, moves)
+            else:
+                scores = self.evaluate_moves(solution, moves, executor, workers)
+            best_move = moves[max(range(len(moves)), key=scores.__getitem__)]
+            # the move is replayed on the current boxes and rolled back after
+            # the touched boxes were copied
+            begin_all(solution)
+            new_solution, _, _, touched, _ = self._apply_move(solution, trackers, best_move)
+            neighbors.append(self._materialize(new_solution, solution, touched))
+            rollback_all(solution)
+            return neighbors
         else:
-            new_solution = [box.copy() for box in solution]
+            new_solution = list(solution)
+            begin_all(solution)
+            touched = set()
             problem_rects = []
             for sb_data in sorted_boxes:
                 if sb_data[0] == 0:
@@ -372,24 +622,21 @@ class PartialOverlapNeighborhood(Neighborhood):
                 source_box_idx = sb_data[1]
                 source_box = new_solution[source_box_idx]
                 rects = source_box.get_rectangles()
-                sorted_rects = sb_data[2]
-                r_data = sorted_rects[0]
-                while r_data[0] != 0:
-                    rectangle = rects[r_data[1]]
+                tracker = trackers[id(source_box)]
+                position = {rect: i for i, rect in enumerate(rects)}
+                forward = dict(zip(rects, tracker.forward_overlaps(rects)))
+                # the first rectangle with the most overlap
+                rectangle = max(rects, key=forward.__getitem__)
+                while forward[rectangle] != 0:
                     problem_rects.append(rectangle)
+                    # only the rectangles before it counted their overlap with it
+                    for other, area in tracker.partners(rectangle).items():
+                        if position[other] < position[rectangle]:
+                            forward[other] -= area
+                    tracker.remove(rectangle)
                     source_box.remove_rectangle(rectangle)
-                    scored_rects = []
-                    for i in range(len(rects)):
-                        rect_count += 1
-                        rect_overlap = 0
-                        for j in range(i + 1, len(rects)):
-                            r1 = rects[i]
-                            r2 = rects[j]
-                            rect_overlap += self._calc_overlap_area(r1, r2)
-                        #overlap_ratio = rect_overlap/rects[i].height * rects[i].width
-                        scored_rects.append((rect_overlap, i))
-                    sorted_rects = sorted(scored_rects, key=lambda x: x[0], reverse=True)
-                    r_data = sorted_rects[0]
+                    touched.add(id(source_box))
+                    rectangle = max(rects, key=forward.__getitem__)
             for rect in problem_rects:
                 box_size = new_solution[0].get_length()
                 placed = False
@@ -402,15 +649,172 @@ class PartialOverlapNeighborhood(Neighborhood):
                         placed = box.place(rect)
                         if placed: break
                 if not placed:
-                    box = Box(box_size)
+                    box = Box(box_size, occupancy=self.occupancy)
                     box.place(rect)
                     new_solution.append(box)
-            neighbors.append(new_solution)
+                touched.add(id(box))
+            neighbors.append(self._materialize(new_solution, solution, touched))
+            rollback_all(solution)
             return neighbors
 
 
 
 
+
+    def _apply_move(self, solution, trackers, move):
+        """
+        Apply a move to the boxes of the solution and to their overlap
+        trackers: the rectangles of the source box are moved in the given
+        order to random target boxes, on random corners. The caller begins
+        and rolls back the transactions.
+        Returns:
+            (list, dict, dict, set, list): the new solution, the metrics of
+            the changed boxes before the move and the changed boxes (both by
+            box id), the ids of the touched boxes and the boxes opened by the
+            move
+        """
+        source_box_idx, order, seed = move
+        rng = random.Random(seed)
+        new_solution = list(solution)
+        source_box = new_solution[source_box_idx]
+        touched = {id(source_box)}
+        # metrics of the touched boxes before the move, and the boxes themselves
+        old_metrics = {id(source_box): source_box.get_metrics()}
+        changed = {id(source_box): source_box}
+        new_boxes = []
+        moved_idx = 0
+        rects = source_box.get_rectangles()
+        sorted_rects = list(order)
+        num_rects_moved =  len(rects)//self.iteration
+        for _ in range(num_rects_moved):
+            #select the rect with most overlap
+            rect = rects[sorted_rects[moved_idx]]
+            # remove that rectangle
+            source_box.remove_rectangle(rect, False)
+            trackers[id(source_box)].remove(rect)
+            #adjust index
+            for j in range(len(sorted_rects)):
+                if sorted_rects[j] > sorted_rects[moved_idx]:
+                    sorted_rects[j] -= 1
+            moved_idx += 1
+            #give option to expand
+            box_size = solution[0].get_length()
+            box_area = box_size*box_size
+            if (compute_min_utilization(new_solution) +
+                    ((rect.height * rect.width) / box_area))>0.8:
+                new_box = Box(box_size, occupancy=self.occupancy)
+                new_solution.append(new_box)
+                changed[id(new_box)] = new_box
+                trackers[id(new_box)] = OverlapTracker()
+                new_boxes.append(new_box)
+            placed = False
+            counter = 0
+            # pick a random target box, if same, get a different one
+            while not placed:
+                target_box_idx = rng.randint(0, len(new_solution) - 1)
+                while target_box_idx == source_box_idx:
+                    target_box_idx = rng.randint(0, len(new_solution) - 1)
+                target_box = new_solution[target_box_idx]
+                if id(target_box) not in changed:
+                    old_metrics[id(target_box)] = target_box.get_metrics()
+                    changed[id(target_box)] = target_box
+                placed = target_box.place(rect, False, rng)
+                if not placed:
+                    counter += 1
+                if counter > 100:
+                    rect.x, rect.y = (0,0)
+                    target_box.place_no_check(rect)
+                    placed = True
+            trackers[id(target_box)].add(rect)
+            touched.add(id(target_box))
+            # If source box is now empty, remove it
+
+            if len(source_box.get_rectangles()) == 0:
+                new_solution.remove(source_box)
+                changed.pop(id(source_box), None)
+            if len(new_solution[-1].get_rectangles()) == 0:
+                if changed.pop(id(new_solution[-1]), None) is None:
+                    old_metrics[id(new_solution[-1])] = new_solution[-1].get_metrics()
+                new_solution.remove(new_solution[-1])
+        return new_solution, old_metrics, changed, touched, new_boxes
+
+    def move_state(self, solution):
+        """
+        The tolerance and per box the rectangles (x, y, width, height) in box
+        order and the sorted corners, enough to rebuild boxes on which the
+        moves behave as on the current ones.
+        """
+        boxes = [
+            (
+                np.array(
+                    [(r.x, r.y, r.width, r.height) for r in box.get_rectangles()], dtype=np.int32
+                ).reshape(-1, 4),
+                np.array(sorted(box._coordinates), dtype=np.int32).reshape(-1, 2),
+            )
+            for box in solution
+        ]
+        return (
+            solution[0].get_length(), self.iteration, self.current_tolerance,
+            self.overlap_penalty_factor, boxes,
+        )
+
+    @classmethod
+    def score_moves(cls, state, moves):
+        box_size, iteration, tolerance, penalty_factor, boxes = state
+        neighborhood = cls()
+        neighborhood.iteration = iteration
+        neighborhood.current_tolerance = tolerance
+        neighborhood.overlap_penalty_factor = penalty_factor
+        placements = np.concatenate([rectangles for rectangles, _ in boxes])
+        # fresh rectangles on the positions of the current ones, the colors are not needed
+        rectangles = RectangleSet(
+            placements[:, 2], placements[:, 3], placements[:, 0], placements[:, 1],
+            color=np.zeros((len(placements), 3), dtype=np.uint8),
+        ).views()
+        solution = []
+        begin = 0
+        for box_rectangles, coordinates in boxes:
+            box = Box(box_size)
+            for rectangle in rectangles[begin : begin + len(box_rectangles)]:
+                box.place_no_check(rectangle)
+            begin += len(box_rectangles)
+            box._coordinates = set(map(tuple, coordinates.tolist()))
+            solution.append(box)
+
+        trackers = {id(box): OverlapTracker(box.get_rectangles()) for box in solution}
+        return neighborhood._score_moves(solution, trackers, moves)
+
+    def _score_moves(self, solution, trackers, moves):
+        """Score the moves on the boxes of a solution and their overlap trackers, see score_moves()."""
+        tolerance, penalty_factor = self.current_tolerance, self.overlap_penalty_factor
+        metrics = SolutionMetrics.from_solution(solution)
+        penalties = {
+            key: tracker.penalty(tolerance, penalty_factor) for key, tracker in trackers.items()
+        }
+        total_penalty = sum(penalties.values())
+        base_trackers = list(trackers.values())
+        scores = []
+        for move in moves:
+            begin_all(solution)
+            begin_all(base_trackers)
+            _, old_metrics, changed, _, new_boxes = self._apply_move(solution, trackers, move)
+            # Score with the new scoring function (including overlap penalty),
+            # only the boxes changed by the move are looked at
+            new_metrics = metrics.replace(
+                list(old_metrics.values()), [box.get_metrics() for box in changed.values()]
+            )
+            new_penalty = (
+                total_penalty
+                - sum(penalties[key] for key in old_metrics)
+                + sum(trackers[key].penalty(tolerance, penalty_factor) for key in changed)
+            )
+            scores.append(self._score_metrics(new_metrics) - new_penalty)
+            rollback_all(solution)
+            rollback_all(base_trackers)
+            for box in new_boxes:
+                del trackers[id(box)]
+        return scores
+
     def _score_solution(self, solution):
         """
         Inherits the base scoring (min utilization, etc.) and adds
@@ -421,44 +825,27 @@ class PartialOverlapNeighborhood(Neighborhood):
         If ratio >  current_tolerance, penalize heavily so that
         the solution is forced to reduce these overlaps as tolerance shrinks.
         """
-        base_score = super()._score_solution(solution)
         #box_length = solution[0].get_length()
         #box_area = box_length * box_length
         #base_score = (-len(solution)*1000
         #              +(solution[len(solution)-1].get_space()/box_area))
+        return super()._score_solution(solution) - self._overlap_penalty(solution)
 
-        # big constant factor to heavily penalize large overlaps
-        overlap_penalty_factor = 1000000
-        total_penalty = 0.0
-        for box in solution:
-            rects = box.get_rectangles()
-            for i in range(len(rects)):
-                for j in range(i + 1, len(rects)):
-                    r1 = rects[i]
-                    r2 = rects[j]
-                    overlap_area = self._calc_overlap_area(r1, r2)
-                    if overlap_area == 0:
-                        continue
-                    bigger_rect_area = max(r1.width * r1.height, r2.width * r2.height)
-                    overlap_ratio = overlap_area / float(bigger_rect_area)
-
-                    # If this ratio is beyond current_tolerance => penalize
-                    if overlap_ratio > self.current_tolerance:
-                        violation = overlap_ratio - self.current_tolerance
-                        total_penalty += violation * overlap_penalty_factor
-        return base_score - total_penalty
+    def feasible(self, solution) -> bool:
+        return not any(has_overlap(box.get_rectangles()) for box in solution)
+
+    def _overlap_penalty(self, solution):
+        """Penalty for the pairs of rectangles that overlap more than the current tolerance."""
+        return sum(
+            OverlapTracker(box.get_rectangles()).penalty(
+                self.current_tolerance, self.overlap_penalty_factor
+            )
+            for box in solution
+        )
 
     def _calc_overlap_area(self, r1, r2):
         """
         Returns the overlap area between rectangles r1 and r2.
         If they do not overlap, returns 0.
         """
-        overlap_width = max(
-            0, min(r1.x + r1.width, r2.x + r2.width) - max(r1.x, r2.x)
-        )
-        overlap_height = max(
-            0, min(r1.y + r1.height, r2.y + r2.height) - max(r1.y, r2.y)
-        )
-        return overlap_width * overlap_height
-
-
+        return overlap_area(r1, r2)
@@ -1,12 +1,12 @@
 from local_search import *
 from greedy import *
 from algorithms import *
+from instrumentation import Instrumentation
+from results import ResultStore, packing_record
 import numpy as np
 import sys
 import os
 import time
-import json
-from datetime import datetime
 
 
 from PyQt5.QtGui import QPainter, QColor
@@ -20,26 +20,35 @@ from PyQt5.QtWidgets import (
     QCheckBox,
 )
 from PyQt5 import uic
-from PyQt5.QtCore import QTimer, QThread, pyqtSignal
+from PyQt5.QtCore import QThread, pyqtSignal
 
 
 class AlgorithmThread(QThread):
     finished_signal = pyqtSignal()
+    # ProgressEvents of the algorithm, delivered in the GUI thread
+    progress_signal = pyqtSignal(object)
 
     def __init__(self, algorithm):
         super().__init__()
         self._algorithm = algorithm
+        algorithm.progress.subscribe(self.progress_signal.emit)
 
     def run(self):
         self._algorithm.run()
         self.finished_signal.emit()  # Signal completion
 
+    def cancel(self):
+        """Stop the algorithm at its next iteration, it keeps the best solution found so far."""
+        self._algorithm.control.cancel()
+
 
 class ApplyWindow(QWidget):
     def __init__(self, problem: OptimizationProblem, strategy):
         super().__init__()
         self._problem = problem
         self._algorithm = None
+        # the best solution of the last progress event, the worker thread never touches it
+        self._snapshot = None
 
         current_dir = os.path.dirname(os.path.abspath(__file__))
         parent_dir = os.path.dirname(current_dir)
@@ -63,20 +72,24 @@ class ApplyWindow(QWidget):
         elif isinstance(strategy, Backtracking):
             self._algorithm = Backtracking(problem)
 
+        # redraw at most once a second
+        self._algorithm.progress.interval = 1.0
         self._thread = AlgorithmThread(self._algorithm)
+        self._thread.progress_signal.connect(self.on_progress)
         self._thread.finished_signal.connect(self.algorithm_finished)
         self._thread.start()
 
         # 10 columns and one row as a initial size
         self.setFixedSize(self._problem._box_size * 10, self._problem._box_size)
 
-        # Run algorithm in steps using QTimer
-        self._timer = QTimer(self)
-        self._timer.timeout.connect(self.update_ui)
-        self._timer.start(1000)
+    def on_progress(self, event):
+        self._snapshot = event.snapshot
+        self.update_ui()
 
     def update_ui(self):
-        num_boxes = len(self._algorithm._boxes)
+        if self._snapshot is None:
+            return
+        num_boxes = self._snapshot.num_boxes
         boxes_per_row = 10
         rows = (num_boxes // boxes_per_row) + (
             1 if num_boxes % boxes_per_row > 0 else 0
@@ -88,9 +101,15 @@ class ApplyWindow(QWidget):
         self.repaint()  # Redraw rectangles
         QApplication.processEvents()  # Process UI events
 
+    def closeEvent(self, event):
+        """Closing the window cancels a running algorithm"""
+        if self._thread.isRunning():
+            self._thread.cancel()
+            self._thread.wait()
+        super().closeEvent(event)
+
     def algorithm_finished(self):
         """Handles when the algorithm finishes execution"""
-        self._timer.stop()
         end_time = time.time()
         execution_time = end_time - self._start_time
         print(f"Algorithm execution time: {execution_time:.4f} seconds")
@@ -104,11 +123,11 @@ class ApplyWindow(QWidget):
         widget_width = self.width()
         widget_height = self.height()
         box_size = self._problem._box_size
-        boxes = self._algorithm._boxes
-        num_boxes = len(boxes)
-
-        if num_boxes == 0:
+        if self._snapshot is None or self._snapshot.num_boxes == 0:
             return
+        boxes = self._snapshot.boxes()
+        num_boxes = len(boxes)
+        colors = self._problem.get_rectangle_set().color
 
         boxes_per_row = 10
         rows = (num_boxes // boxes_per_row) + (
@@ -140,13 +159,13 @@ class ApplyWindow(QWidget):
                 scale_factor = min(
                     box_width / box_size, (widget_height // rows) / box_size
                 )
-                for rect in box.get_rectangles():
-                    scaled_x = x_offset + int(rect.x * scale_factor)
-                    scaled_y = y_offset + int(rect.y * scale_factor)
-                    scaled_width = int(rect.width * scale_factor)
-                    scaled_height = int(rect.height * scale_factor)
+                for rect_id, _, x, y, width, height in box.tolist():
+                    scaled_x = x_offset + int(x * scale_factor)
+                    scaled_y = y_offset + int(y * scale_factor)
+                    scaled_width = int(width * scale_factor)
+                    scaled_height = int(height * scale_factor)
 
-                    color = QColor(*rect.color)  # Use the rectangle's assigned color
+                    color = QColor(*colors[rect_id].tolist())  # Use the rectangle's assigned color
                     painter.setBrush(color)
                     painter.drawRect(scaled_x, scaled_y, scaled_width, scaled_height)
 
@@ -227,69 +246,56 @@ class MainWindow(QMainWindow):
             self._apply_window.show()
 
     def _run_log_file(self):
-        """Log results to a JSON file"""
-
-        # Simulate running the algorithm without GUI
-        start_time = time.time()
-
-        algorithm_data = {
-            "test_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "box_size": self._problem._box_size,
-            "min random value": self._problem._min_size,
-            "max random value": self._problem._max_size,
-            "algorithms": [],
-        }
-
-        # Run the selected strategy and algorithm
-        if self._strategy:
-            algorithm = None
-            if isinstance(self._strategy, GreedyArea) or isinstance(
-                self._strategy, GreedyPerimeter
-            ):
-                algorithm = Greedy(self._problem, self._strategy)
-            elif (
-                isinstance(self._strategy, GeometryBasedNeighborhood)
-                or isinstance(self._strategy, RuleBasedNeighborhood)
-                or isinstance(self._strategy, PartialOverlapNeighborhood)
-            ):
-                algorithm = LocalSearch(self._problem, self._strategy)
-            elif isinstance(self._strategy, SimulatedAnnealing):
-                algorithm = SimulatedAnnealing(self._problem)
-            elif isinstance(self._strategy, Backtracking):
-                algorithm = Backtracking(self._problem)
-
-            algorithm.run()
-
-            # Collect algorithm run data
-            algorithm_run_data = {
-                "algorithm": type(algorithm).__name__,
-                "num_rectangles": self._problem._num_rectangles,
-                "num_boxes_generated": len(algorithm._boxes),
-                "time": time.time() - start_time,
-                "utilization": [
-                    box.get_space() for box in algorithm._boxes
-                ],  # Space utilization per box
-                "strategy": self._strategy.__class__.__name__,
-                "neighborhood": (
-                    self._strategy.neighborhood.__class__.__name__
-                    if isinstance(self._strategy, LocalSearch)
-                    else None
-                ),
-            }
-
-            algorithm_data["algorithms"].append(algorithm_run_data)
-
-            # Output the log to a JSON file
-            log_dir = "logs"
-            if not os.path.exists(log_dir):
-                os.makedirs(log_dir)
-
-            log_file = os.path.join(log_dir, "algorithm_log.json")
-            with open(log_file, "a") as json_file:
-                json.dump(algorithm_data, json_file, indent=4)
-                json_file.write("\n")
-
-            print(f"Algorithm execution time: {algorithm_run_data['time']:.4f} seconds")
+        """Run the algorithm without the GUI and add the run to the results store in logs/"""
+        if not self._strategy:
+            return
+        if isinstance(self._strategy, (GreedyArea, GreedyPerimeter)):
+            algorithm = Greedy(self._problem, self._strategy)
+        elif isinstance(self._strategy, Neighborhood):
+            algorithm = LocalSearch(self._problem, self._strategy)
+        elif isinstance(self._strategy, SimulatedAnnealing):
+            algorithm = SimulatedAnnealing(self._problem)
+        elif isinstance(self._strategy, Backtracking):
+            algorithm = Backtracking(self._problem)
+        else:
+            return
+
+        # the best solution over time, from the progress events
+        progress = []
+        algorithm.progress.subscribe(
+            lambda event: progress.append(
+                (event.elapsed, event.iteration, event.best_score, event.snapshot.num_boxes)
+            )
+        )
+        # hot-path counters and phase times of this run
+        with Instrumentation() as stats:
+            start_time = time.perf_counter()
+            boxes = algorithm.run()
+            elapsed = time.perf_counter() - start_time
+
+        rectangle_set = self._problem.get_rectangle_set()
+        record, arrays = packing_record(
+            self._problem,
+            type(algorithm).__name__,
+            boxes,
+            elapsed,
+            params={
+                "strategy": type(self._strategy).__name__,
+                "min_size": self._problem._min_size,
+                "max_size": self._problem._max_size,
+            },
+            control=algorithm.control,
+            stats=stats,
+            lower_bound=l2_lower_bound(
+                rectangle_set.width, rectangle_set.height, self._problem.get_box_size()
+            ),
+        )
+        progress = np.array(progress, dtype=np.float64).reshape(-1, 4)
+        for k, column in enumerate(("time", "iteration", "best_score", "num_boxes")):
+            arrays["progress_" + column] = progress[:, k]
+        ResultStore("logs").append(record, arrays)
+
+        print(f"Algorithm execution time: {elapsed:.4f} seconds")
 
     def _on_rb_greedy_1_clicked(
         self,
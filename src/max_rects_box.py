@@ -0,0 +1,374 @@
+import random
+
+import instrumentation
+from structs import MetricsCache, MoveJournal, Rectangle, copy_rectangles, new_box_id
+
+
+class MaxRectsBox(MoveJournal, MetricsCache):
+    """
+    A box that keeps an explicit list of maximal free rectangles instead of the
+    corner set used by Box. Every placement splits the free rectangles it
+    intersects and prunes the ones contained in others, so a placement only
+    scans free rectangles and never runs overlap checks. Because the free list
+    covers all of the empty area, holes between rectangles are found as well.
+
+    Supported placement heuristics:
+        "bottom_left"           lowest top edge, then leftmost position
+        "best_short_side_fit"   smallest leftover on the shorter side
+        "best_area_fit"         smallest leftover area of the free rectangle
+    """
+
+    HEURISTICS = ("bottom_left", "best_short_side_fit", "best_area_fit")
+
+    def __init__(self, box_size: int, heuristic: str = "bottom_left", id=None):
+        if heuristic not in self.HEURISTICS:
+            raise ValueError(f"Unknown heuristic: {heuristic}")
+        self._length = box_size
+        self._rectangles = []
+        self._space = box_size * box_size
+        self._heuristic = heuristic
+        # free rectangles as (x, y, width, height) tuples
+        self._free_rectangles = [(0, 0, box_size, box_size)]
+        # removed areas that are not merged into the free rectangles yet
+        self._freed = ()
+        # merged free rectangles per tuple of freed areas, for one base free list
+        self._merges = (None, {})
+
+        if id is None:
+            self.id = new_box_id()
+        else:
+            self.id = id
+
+        self._init_journal()
+        self._init_metrics()
+
+    def _score_position(self, free_rect, width, height):
+        """
+        Score a placement of a width x height rectangle in the top left corner
+        of a free rectangle. Lower scores are better.
+        """
+        fx, fy, fw, fh = free_rect
+        if self._heuristic == "bottom_left":
+            return (fy + height, fx)
+        leftover_w = fw - width
+        leftover_h = fh - height
+        short_side = min(leftover_w, leftover_h)
+        long_side = max(leftover_w, leftover_h)
+        if self._heuristic == "best_short_side_fit":
+            return (short_side, long_side)
+        return (fw * fh - width * height, short_side)
+
+    def find_position(self, rectangle: Rectangle):
+        """
+        Find the best position for a rectangle according to the heuristic
+        Args:
+            rectangle (Rectangle): the rectangle to be placed
+        Returns:
+            tuple: (x, y) of the best position or None if it does not fit
+        """
+        width, height = rectangle.width, rectangle.height
+        best_score = None
+        best_position = None
+        for free_rect in self.get_free_rectangles():
+            if width <= free_rect[2] and height <= free_rect[3]:
+                score = self._score_position(free_rect, width, height)
+                if best_score is None or score < best_score:
+                    best_score = score
+                    best_position = (free_rect[0], free_rect[1])
+        return best_position
+
+    def can_place(self, rectangle: Rectangle, x, y) -> bool:
+        """
+        Check if a rectangle can be placed at a given coordinate. The position
+        is free if it is contained in one of the maximal free rectangles.
+        """
+        right, bottom = x + rectangle.width, y + rectangle.height
+        for fx, fy, fw, fh in self.get_free_rectangles():
+            if fx <= x and fy <= y and right <= fx + fw and bottom <= fy + fh:
+                return True
+        return False
+
+    def place(self, rectangle: Rectangle, check=True, rng=random) -> bool:
+        """
+        Place a rectangle in the box
+        Args:
+            rectangle (Rectangle): the rectangle to be placed
+            check: if False the rectangle is put on a random position inside
+                   the box without looking at the free space
+            rng: random number generator of that position, e.g. the seeded
+                 generator of the caller, see Box.place()
+        Returns:
+            bool: True if the rectangle was placed, False otherwise
+        """
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("MaxRectsBox.place")
+        if rectangle.width > self._length or rectangle.height > self._length:
+            return False
+        if check:
+            if rectangle.width * rectangle.height > self._space:
+                return False
+            position = self.find_position(rectangle)
+            if position is None:
+                return False
+        else:
+            position = (
+                rng.randint(0, self._length - rectangle.width),
+                rng.randint(0, self._length - rectangle.height),
+            )
+        self._update_placement(rectangle, position)
+        return True
+
+    def place_at(self, rectangle: Rectangle, x, y) -> bool:
+        """
+        Place a rectangle on the given coordinate if it is free there.
+        Returns:
+            bool: True if the rectangle was placed, False otherwise
+        """
+        if not self.can_place(rectangle, x, y):
+            return False
+        self._update_placement(rectangle, (x, y))
+        return True
+
+    def candidate_positions(self, rectangle: Rectangle) -> list:
+        """
+        Top left corners of the free rectangles the rectangle fits in, sorted
+        by y and then x.
+        """
+        width, height = rectangle.width, rectangle.height
+        return sorted(
+            {(fx, fy) for fx, fy, fw, fh in self.get_free_rectangles() if width <= fw and height <= fh},
+            key=lambda position: (position[1], position[0]),
+        )
+
+    def place_no_check(self, rectangle: Rectangle):
+        """Place the rectangle on its current coordinates without any checks."""
+        self._update_placement(rectangle, (rectangle.x, rectangle.y))
+
+    def _update_placement(self, rectangle: Rectangle, coordinate):
+        if self._journal_marks:
+            self._record("place", rectangle, rectangle.get_state(), self.get_free_rectangles())
+        rectangle.x, rectangle.y = coordinate
+        rectangle.box_id = self.id
+        self._rectangles.append(rectangle)
+        self._space -= rectangle.width * rectangle.height
+        self._metrics_add(rectangle)
+        self._split_free_rectangles(
+            rectangle.x, rectangle.y, rectangle.width, rectangle.height
+        )
+
+    def _split_free_rectangles(self, x, y, width, height):
+        """Split all free rectangles intersecting the used area and prune the pieces."""
+        right, bottom = x + width, y + height
+        kept = []
+        pieces = []
+        for free_rect in self.get_free_rectangles():
+            fx, fy, fw, fh = free_rect
+            f_right, f_bottom = fx + fw, fy + fh
+            if x >= f_right or right <= fx or y >= f_bottom or bottom <= fy:
+                kept.append(free_rect)
+                continue
+            # the used area intersects the free rectangle, keep the four sides
+            if x > fx:
+                pieces.append((fx, fy, x - fx, fh))
+            if right < f_right:
+                pieces.append((right, fy, f_right - right, fh))
+            if y > fy:
+                pieces.append((fx, fy, fw, y - fy))
+            if bottom < f_bottom:
+                pieces.append((fx, bottom, fw, f_bottom - bottom))
+        # a free rectangle that was not split is still maximal, the free space
+        # only shrank; only the pieces can be contained in another rectangle
+        self._free_rectangles = kept + self._prune(pieces, kept)
+
+    @staticmethod
+    def _contains(outer, inner) -> bool:
+        ox, oy, ow, oh = outer
+        x, y, w, h = inner
+        return ox <= x and oy <= y and x + w <= ox + ow and y + h <= oy + oh
+
+    @classmethod
+    def _prune(cls, candidates, others=()):
+        """
+        The candidates that are not contained in another candidate or in one
+        of others; others are maximal among themselves and always kept.
+        """
+        # larger rectangles first, so contained ones are always seen later
+        candidates = sorted(set(candidates), key=lambda r: (-r[2] * r[3], r[1], r[0]))
+        kept = []
+        for rect in candidates:
+            if not any(cls._contains(other, rect) for other in others) and not any(
+                cls._contains(other, rect) for other in kept
+            ):
+                kept.append(rect)
+        return kept
+
+    def _merge_free_rectangle(self, freed):
+        """
+        Add a freed area to the maximal free rectangles. Two free rectangles
+        that overlap or touch are joined horizontally (both x ranges on the
+        common rows) and vertically (both y ranges on the common columns).
+        Every rectangle inside a union of rectangles is contained in one that
+        is built by repeated joins of maximal ones, and a join of two old free
+        rectangles is free without the freed area, so it is contained in an old
+        free rectangle already. Only the joins that involve the freed area are
+        built, from the freed area outwards. A rectangle contained in a new one
+        is dropped right away, its joins are contained in the joins of the
+        larger one.
+        """
+        fx, fy, fw, fh = freed
+        f_right, f_bottom = fx + fw, fy + fh
+        free_rectangles = []
+        for rect in self._free_rectangles:
+            x, y, width, height = rect
+            if x <= fx and y <= fy and f_right <= x + width and f_bottom <= y + height:
+                return  # already free
+            if not (fx <= x and fy <= y and x + width <= f_right and y + height <= f_bottom):
+                free_rectangles.append(rect)
+        free_rectangles.append(freed)
+        pending = [freed]
+        while pending:
+            rect = pending.pop()
+            if rect not in free_rectangles:
+                continue  # contained in a later join
+            x, y, width, height = rect
+            right, bottom = x + width, y + height
+            for ox, oy, ow, oh in free_rectangles[:]:
+                o_right, o_bottom = ox + ow, oy + oh
+                # only rectangles that overlap or touch can be joined
+                if ox > right or oy > bottom or o_right < x or o_bottom < y:
+                    continue
+                low_x, high_x = max(x, ox), min(right, o_right)
+                low_y, high_y = max(y, oy), min(bottom, o_bottom)
+                joins = []
+                if low_y < high_y:
+                    left = min(x, ox)
+                    joins.append((left, low_y, max(right, o_right) - left, high_y - low_y))
+                if low_x < high_x:
+                    top = min(y, oy)
+                    joins.append((low_x, top, high_x - low_x, max(bottom, o_bottom) - top))
+                for join in joins:
+                    jx, jy, jw, jh = join
+                    j_right, j_bottom = jx + jw, jy + jh
+                    for kx, ky, kw, kh in free_rectangles:
+                        if kx <= jx and ky <= jy and j_right <= kx + kw and j_bottom <= ky + kh:
+                            break
+                    else:
+                        free_rectangles = [
+                            known for known in free_rectangles
+                            if not (jx <= known[0] and jy <= known[1]
+                                    and known[0] + known[2] <= j_right and known[1] + known[3] <= j_bottom)
+                        ]
+                        free_rectangles.append(join)
+                        pending.append(join)
+        self._free_rectangles = free_rectangles
+
+    def remove_rectangle(self, rectangle: Rectangle, grid=True):
+        """
+        Remove a rectangle from the box. Its area is merged into the maximal
+        free rectangles, only the free rectangles around it change, and only
+        when the free rectangles are needed next.
+        """
+        index = self._rectangles.index(rectangle)
+        if self._journal_marks:
+            self._record("remove", rectangle, rectangle.get_state(), (self._free_rectangles, self._freed), index)
+        self._rectangles.pop(index)
+        rectangle.box_id = -1
+        self._space += rectangle.width * rectangle.height
+        self._metrics_remove(rectangle)
+        # merged when the free rectangles are read, a move that is rolled back
+        # or a box that is only emptied never pays for it
+        self._freed += ((rectangle.x, rectangle.y, rectangle.width, rectangle.height),)
+
+    def rotate(self, rectangle: Rectangle) -> bool:
+        """
+        Rotate a placed rectangle, at the same position if possible, otherwise
+        at the best position for the heuristic.
+        Returns:
+            bool: True if the rectangle was rotated, False if the box is unchanged
+        """
+        x, y = rectangle.x, rectangle.y
+        self.begin()
+        self.remove_rectangle(rectangle)
+        rectangle.rotate()
+        self._record("rotate", rectangle)
+        if self.can_place(rectangle, x, y):
+            self._update_placement(rectangle, (x, y))
+            placed = True
+        else:
+            placed = self.place(rectangle)
+        if placed:
+            self.commit()
+        else:
+            self.rollback()
+        return placed
+
+    def _undo(self, entry):
+        # the free list is replaced and never mutated, so the entries can keep a reference
+        kind, rectangle = entry[0], entry[1]
+        if kind == "place":
+            _, _, state, free_rectangles = entry
+            self._rectangles.pop()
+            self._space += rectangle.width * rectangle.height
+            self._metrics_remove(rectangle)
+            self._free_rectangles, self._freed = free_rectangles, ()
+            rectangle.set_state(state)
+        elif kind == "remove":
+            _, _, state, (free_rectangles, freed), index = entry
+            rectangle.set_state(state)
+            self._rectangles.insert(index, rectangle)
+            self._space -= rectangle.width * rectangle.height
+            self._metrics_add(rectangle)
+            self._free_rectangles, self._freed = free_rectangles, freed
+        elif kind == "rotate":
+            rectangle.rotate()
+
+    def get_rectangles(self):
+        return self._rectangles
+
+    def get_space(self):
+        return self._space
+
+    def get_length(self):
+        return self._length
+
+    def get_free_rectangles(self):
+        if self._freed:
+            # rejected moves are rolled back to the same free list and tend to
+            # remove the same rectangles again, the free lists are never changed
+            # in place, so the merges are kept while the base list is current
+            base, merges = self._merges
+            if base is not self._free_rectangles:
+                merges = {}
+                self._merges = (self._free_rectangles, merges)
+            merged = merges.get(self._freed)
+            if merged is None:
+                for freed in self._freed:
+                    self._merge_free_rectangle(freed)
+                merged = merges[self._freed] = self._free_rectangles
+            self._free_rectangles, self._freed = merged, ()
+        return self._free_rectangles
+
+    def get_free_extents(self):
+        """
+        The (width, height) of the free rectangles, a placed rectangle always
+        lies inside one of them.
+        """
+        return [(w, h) for _, _, w, h in self.get_free_rectangles()]
+
+    def get_coordinates(self):
+        """Top left corners of the free rectangles, the candidate positions."""
+        return {(fx, fy) for fx, fy, _, _ in self.get_free_rectangles()}
+
+    def copy(self):
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("MaxRectsBox.copy")
+        new_box = MaxRectsBox(self._length, self._heuristic, self.id)
+        new_box._rectangles = copy_rectangles(self._rectangles)
+        new_box._space = self._space
+        new_box._copy_metrics(self)
+        # list of immutable tuples, so a shallow copy is fine
+        new_box._free_rectangles = self._free_rectangles[:]
+        new_box._freed = self._freed
+        return new_box
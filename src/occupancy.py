@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class OccupancyBitmap:
+    """
+    Occupancy backend for a box: for every row of unit squares the prefix sums
+    of the occupied cells, rows[y, x] is the number of occupied cells left of
+    x in row y. Placing or removing a rectangle only updates the rows it
+    covers, from its left edge on. A region is counted with two lookups per
+    row, and all candidate positions of a rectangle are tested in one
+    vectorized pass.
+
+    The rectangles indexed by a box never overlap, so a row sum is at most L
+    and fits into uint16. The rows are allocated on the first placement, a
+    box of side L needs 2*L*(L+1) bytes, e.g. 8 MB for L = 2000.
+    """
+
+    def __init__(self, length: int):
+        self._length = length
+        self.rows = None
+
+    def _allocate(self):
+        dtype = np.uint16 if self._length <= np.iinfo(np.uint16).max else np.uint32
+        self.rows = np.zeros((self._length, self._length + 1), dtype=dtype)
+
+    def region_sum(self, x, y, width, height) -> int:
+        """Number of occupied cells in the region."""
+        if self.rows is None:
+            return 0
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self._length), min(y + height, self._length)
+        if x1 <= x0 or y1 <= y0:
+            return 0
+        rows = self.rows[y0:y1]
+        return int(rows[:, x1].sum(dtype=np.int64) - rows[:, x0].sum(dtype=np.int64))
+
+    def is_free(self, x, y, width, height) -> bool:
+        return self.region_sum(x, y, width, height) == 0
+
+    def region_sums(self, xs, ys, width, height) -> np.ndarray:
+        """Vectorized region_sum for many positions of the same rectangle size inside the box."""
+        xs = np.asarray(xs, dtype=np.intp)
+        ys = np.asarray(ys, dtype=np.intp)
+        if self.rows is None:
+            return np.zeros(len(xs), dtype=np.int64)
+        # the covered rows of every position
+        covered = ys[:, None] + np.arange(height)
+        return (
+            self.rows[covered, (xs + width)[:, None]].sum(axis=1, dtype=np.int64)
+            - self.rows[covered, xs[:, None]].sum(axis=1, dtype=np.int64)
+        )
+
+    def free_positions(self, width, height) -> np.ndarray:
+        """
+        Boolean mask of shape (L - height + 1, L - width + 1): mask[y, x] is True
+        if a width x height rectangle fits at (x, y) without any overlap.
+        """
+        if width > self._length or height > self._length:
+            return np.zeros((0, 0), dtype=bool)
+        if self.rows is None:
+            return np.ones((self._length - height + 1, self._length - width + 1), dtype=bool)
+        # occupied cells of every row window, summed over height rows
+        windows = self.rows[:, width:].astype(np.int64) - self.rows[:, :-width]
+        windows = np.concatenate((np.zeros((1, windows.shape[1]), dtype=np.int64), windows.cumsum(axis=0)))
+        return windows[height:] - windows[:-height] == 0
+
+    def _update(self, x, y, width, height, sign):
+        if self.rows is None:
+            self._allocate()
+        rows = self.rows[y : y + height]
+        # the prefix sums inside the rectangle grow by 1, 2, ..., width and by
+        # width right of it; uint16 wraps around, so the removal is exact
+        inside = np.arange(1, width + 1, dtype=rows.dtype)
+        if sign > 0:
+            rows[:, x + 1 : x + width + 1] += inside
+            rows[:, x + width + 1 :] += rows.dtype.type(width)
+        else:
+            rows[:, x + 1 : x + width + 1] -= inside
+            rows[:, x + width + 1 :] -= rows.dtype.type(width)
+
+    def add(self, x, y, width, height):
+        """Mark the region of a placed rectangle as occupied."""
+        self._update(x, y, width, height, 1)
+
+    def remove(self, x, y, width, height):
+        """Release the region of a removed rectangle."""
+        self._update(x, y, width, height, -1)
+
+    def copy(self) -> "OccupancyBitmap":
+        new_bitmap = OccupancyBitmap(self._length)
+        if self.rows is not None:
+            new_bitmap.rows = self.rows.copy()
+        return new_bitmap
@@ -0,0 +1,307 @@
+import bisect
+import heapq
+import itertools
+
+import numpy as np
+
+from structs import MoveJournal
+
+
+# boxes with at most this many rectangles use the dense NumPy variant
+DENSE_LIMIT = 1500
+
+
+def overlap_area(r1, r2) -> int:
+    """
+    Returns the overlap area between rectangles r1 and r2.
+    If they do not overlap, returns 0.
+    """
+    overlap_width = max(0, min(r1.x + r1.width, r2.x + r2.width) - max(r1.x, r2.x))
+    overlap_height = max(0, min(r1.y + r1.height, r2.y + r2.height) - max(r1.y, r2.y))
+    return overlap_width * overlap_height
+
+
+def _geometry(rectangles):
+    xs = np.fromiter((r.x for r in rectangles), dtype=np.int64, count=len(rectangles))
+    ys = np.fromiter((r.y for r in rectangles), dtype=np.int64, count=len(rectangles))
+    ws = np.fromiter((r.width for r in rectangles), dtype=np.int64, count=len(rectangles))
+    hs = np.fromiter((r.height for r in rectangles), dtype=np.int64, count=len(rectangles))
+    return xs, ys, ws, hs
+
+
+def dense_overlaps(xs, ys, ws, hs) -> np.ndarray:
+    """
+    Vectorized variant for dense boxes: returns the n x n matrix of pairwise
+    overlap areas (zero on the diagonal) in one broadcast, O(n^2) memory.
+    """
+    xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+    ws, hs = np.asarray(ws, dtype=np.int64), np.asarray(hs, dtype=np.int64)
+    right, bottom = xs + ws, ys + hs
+    widths = np.minimum(right[:, None], right[None, :]) - np.maximum(xs[:, None], xs[None, :])
+    heights = np.minimum(bottom[:, None], bottom[None, :]) - np.maximum(ys[:, None], ys[None, :])
+    areas = np.clip(widths, 0, None) * np.clip(heights, 0, None)
+    np.fill_diagonal(areas, 0)
+    return areas
+
+
+def sweep_overlaps(xs, ys, ws, hs) -> list:
+    """
+    Returns all overlapping pairs as (i, j, area) with i < j, by sweeping a
+    vertical line over the left edges. The rectangles crossing the line are
+    kept sorted by their top edge, so only the ones whose top edge lies within
+    the tallest height above the query are visited: O(n log n + k) for k
+    overlapping pairs when the rectangle sizes are bounded.
+    """
+    n = len(xs)
+    xs, ys, ws, hs = (list(map(int, values)) for values in (xs, ys, ws, hs))
+    max_height = max(hs) if n else 0
+    order = sorted(range(n), key=lambda i: xs[i])
+    active_keys = []  # (y, i) of the rectangles crossing the sweep line
+    expiry = []  # heap of (right edge, y, i)
+    pairs = []
+    for i in order:
+        x, y, w, h = xs[i], ys[i], ws[i], hs[i]
+        while expiry and expiry[0][0] <= x:
+            _, ey, ej = heapq.heappop(expiry)
+            active_keys.pop(bisect.bisect_left(active_keys, (ey, ej)))
+        lo = bisect.bisect_right(active_keys, (y - max_height, n))
+        hi = bisect.bisect_left(active_keys, (y + h, -1))
+        for ay, j in active_keys[lo:hi]:
+            height = min(ay + hs[j], y + h) - max(ay, y)
+            if height > 0:
+                width = min(xs[j] + ws[j], x + w) - x
+                pairs.append((min(i, j), max(i, j), width * height))
+        bisect.insort(active_keys, (y, i))
+        heapq.heappush(expiry, (x + w, y, i))
+    return pairs
+
+
+def has_overlap(rectangles) -> bool:
+    """
+    True if any two of the rectangles overlap, the sweep of sweep_overlaps()
+    that stops at the first overlapping pair.
+    """
+    if len(rectangles) < 2:
+        return False
+    xs, ys, ws, hs = (values.tolist() for values in _geometry(rectangles))
+    max_height = max(hs)
+    order = sorted(range(len(xs)), key=lambda i: xs[i])
+    active_keys = []  # (y, i) of the rectangles crossing the sweep line
+    expiry = []  # heap of (right edge, y, i)
+    for i in order:
+        x, y, h = xs[i], ys[i], hs[i]
+        while expiry and expiry[0][0] <= x:
+            _, ey, ej = heapq.heappop(expiry)
+            active_keys.pop(bisect.bisect_left(active_keys, (ey, ej)))
+        lo = bisect.bisect_right(active_keys, (y - max_height, len(xs)))
+        hi = bisect.bisect_left(active_keys, (y + h, -1))
+        for ay, j in active_keys[lo:hi]:
+            if ay + hs[j] > y:
+                return True
+        bisect.insort(active_keys, (y, i))
+        heapq.heappush(expiry, (x + ws[i], y, i))
+    return False
+
+
+def pairwise_overlaps(rectangles, dense=None) -> list:
+    """
+    All overlapping pairs of a list of rectangles as (i, j, area) with i < j,
+    indices into the list. Uses the dense NumPy variant for up to DENSE_LIMIT
+    rectangles unless dense is given, the sweep line otherwise.
+    """
+    if len(rectangles) < 2:
+        return []
+    geometry = _geometry(rectangles)
+    if dense is None:
+        dense = len(rectangles) <= DENSE_LIMIT
+    if dense:
+        areas = dense_overlaps(*geometry)
+        rows, cols = np.nonzero(np.triu(areas, 1))
+        return list(zip(rows.tolist(), cols.tolist(), areas[rows, cols].tolist()))
+    return sweep_overlaps(*geometry)
+
+
+def overlap_ratio_penalty(area, area1, area2, tolerance, factor):
+    """
+    Penalty of one overlapping pair: the overlap ratio is the overlap area
+    relative to the bigger rectangle, only the part above the tolerance counts.
+    """
+    ratio = area / float(max(area1, area2))
+    if ratio > tolerance:
+        return (ratio - tolerance) * factor
+    return 0.0
+
+
+class OverlapTracker(MoveJournal):
+    """
+    Overlap areas of the rectangles of one box, per rectangle and per pair,
+    with incremental updates. The tracker is built with pairwise_overlaps();
+    add(), remove() and move() then only look at the rectangles in the
+    x-range of the changed one, which is kept sorted.
+    The tracker stores its own copy of the geometry, so it stays consistent if
+    the rectangles are moved before they are removed from it. Changes can be
+    journaled and rolled back like a box.
+    """
+
+    def __init__(self, rectangles=(), dense=None):
+        self._init_journal()
+        rectangles = list(rectangles)
+        self._geometry = {}
+        self._partners = {}
+        self._totals = {}
+        self._x_keys = []  # sorted (x, serial) of the tracked rectangles
+        self._x_rectangles = []  # rectangles in the order of _x_keys
+        self._serial = itertools.count()
+        self._serials = {}
+        self._max_width = 0
+        # (tolerance, factor) of the penalty kept up to date, see penalty()
+        self._penalty_params = None
+        self._penalty = 0.0
+        self._penalized = 0  # number of pairs with a positive penalty
+        for rect in rectangles:
+            self._insert(rect)
+            self._partners[rect] = {}
+            self._totals[rect] = 0
+        for i, j, area in pairwise_overlaps(rectangles, dense):
+            self._link(rectangles[i], rectangles[j], area)
+
+    def __len__(self):
+        return len(self._geometry)
+
+    def __contains__(self, rectangle):
+        return rectangle in self._geometry
+
+    def _insert(self, rect, geometry=None):
+        if geometry is None:
+            geometry = (rect.x, rect.y, rect.width, rect.height)
+        self._geometry[rect] = geometry
+        serial = next(self._serial)
+        self._serials[rect] = serial
+        position = bisect.bisect_left(self._x_keys, (geometry[0], serial))
+        self._x_keys.insert(position, (geometry[0], serial))
+        self._x_rectangles.insert(position, rect)
+        self._max_width = max(self._max_width, geometry[2])
+
+    def _link(self, r1, r2, area):
+        self._partners[r1][r2] = area
+        self._partners[r2][r1] = area
+        self._totals[r1] += area
+        self._totals[r2] += area
+        if self._penalty_params is not None:
+            self._add_penalty(self._pair_penalty(r1, r2, area), 1)
+
+    def _add_penalty(self, penalty, sign):
+        if penalty > 0:
+            self._penalty += sign * penalty
+            self._penalized += sign
+
+    def _pair_penalty(self, r1, r2, area):
+        _, _, w1, h1 = self._geometry[r1]
+        _, _, w2, h2 = self._geometry[r2]
+        return overlap_ratio_penalty(area, w1 * h1, w2 * h2, *self._penalty_params)
+
+    def _query(self, x, y, width, height):
+        """Tracked rectangles overlapping the region, with the overlap areas."""
+        lo = bisect.bisect_left(self._x_keys, (x - self._max_width + 1, -1))
+        hi = bisect.bisect_left(self._x_keys, (x + width, -1))
+        result = []
+        for other in self._x_rectangles[lo:hi]:
+            ox, oy, ow, oh = self._geometry[other]
+            overlap_width = min(ox + ow, x + width) - max(ox, x)
+            overlap_height = min(oy + oh, y + height) - max(oy, y)
+            if overlap_width > 0 and overlap_height > 0:
+                result.append((other, overlap_width * overlap_height))
+        return result
+
+    def add(self, rectangle):
+        """Start tracking a rectangle on its current position."""
+        overlaps = self._query(rectangle.x, rectangle.y, rectangle.width, rectangle.height)
+        self._insert(rectangle)
+        self._partners[rectangle] = {}
+        self._totals[rectangle] = 0
+        for other, area in overlaps:
+            self._link(rectangle, other, area)
+        self._record("add", rectangle)
+
+    def remove(self, rectangle):
+        """Stop tracking a rectangle, its stored position is used."""
+        geometry, partners = self._detach(rectangle)
+        self._record("remove", rectangle, geometry, partners)
+
+    def _detach(self, rectangle):
+        x = self._geometry[rectangle][0]
+        serial = self._serials.pop(rectangle)
+        position = bisect.bisect_left(self._x_keys, (x, serial))
+        self._x_keys.pop(position)
+        self._x_rectangles.pop(position)
+        partners = self._partners.pop(rectangle)
+        for other, area in partners.items():
+            del self._partners[other][rectangle]
+            self._totals[other] -= area
+            if self._penalty_params is not None:
+                self._add_penalty(self._pair_penalty(rectangle, other, area), -1)
+        del self._totals[rectangle]
+        return self._geometry.pop(rectangle), partners
+
+    def move(self, rectangle):
+        """Update a tracked rectangle after it was moved or rotated."""
+        self.remove(rectangle)
+        self.add(rectangle)
+
+    def _undo(self, entry):
+        kind, rectangle = entry[0], entry[1]
+        if kind == "add":
+            self._detach(rectangle)
+        elif kind == "remove":
+            _, _, geometry, partners = entry
+            self._insert(rectangle, geometry)
+            self._partners[rectangle] = {}
+            self._totals[rectangle] = 0
+            for other, area in partners.items():
+                self._link(rectangle, other, area)
+
+    def overlap(self, rectangle) -> int:
+        """Total overlap area of a tracked rectangle with all others."""
+        return self._totals[rectangle]
+
+    def partners(self, rectangle) -> dict:
+        """The rectangles overlapping a tracked rectangle, mapped to the overlap area."""
+        return self._partners[rectangle]
+
+    def pairs(self):
+        """Yields every overlapping pair once as (r1, r2, area)."""
+        seen = set()
+        for rect, partners in self._partners.items():
+            seen.add(rect)
+            for other, area in partners.items():
+                if other not in seen:
+                    yield rect, other, area
+
+    def total(self) -> int:
+        """Sum of the overlap areas of all pairs."""
+        return sum(self._totals.values()) // 2
+
+    def forward_overlaps(self, rectangles) -> list:
+        """
+        For every rectangle of the list, the overlap with the rectangles after
+        it in the list, in O(n + k).
+        """
+        position = {rect: i for i, rect in enumerate(rectangles)}
+        return [
+            sum(area for other, area in self._partners[rect].items() if position[other] > i)
+            for i, rect in enumerate(rectangles)
+        ]
+
+    def penalty(self, tolerance: float, factor: float) -> float:
+        """
+        Sum of overlap_ratio_penalty() over all overlapping pairs. The sum is
+        computed once and then kept up to date on every change, until it is
+        asked for with other parameters.
+        """
+        if self._penalty_params != (tolerance, factor):
+            self._penalty_params = (tolerance, factor)
+            self._penalty, self._penalized = 0.0, 0
+            for r1, r2, area in self.pairs():
+                self._add_penalty(self._pair_penalty(r1, r2, area), 1)
+        # without penalized pairs the sum is exactly 0, not rounding noise
+        return self._penalty if self._penalized else 0.0
@@ -0,0 +1,133 @@
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+import instrumentation
+
+
+class Snapshot:
+    """
+    Immutable copy of a packing, cheap to pass between threads: one row per
+    placed rectangle in a read-only int32 array with the COLUMNS
+    (rectangle id, box index, x, y, width, height), the width and height as
+    placed, i.e. after a rotation.
+    """
+
+    COLUMNS = ("id", "box", "x", "y", "width", "height")
+
+    def __init__(self, placements, num_boxes):
+        placements = np.array(placements, dtype=np.int32).reshape(-1, len(self.COLUMNS))
+        placements.setflags(write=False)
+        self.placements = placements
+        self.num_boxes = num_boxes
+
+    @classmethod
+    def from_boxes(cls, boxes) -> "Snapshot":
+        """Snapshot of a list of boxes, the box index is the position in the list."""
+        rows = [
+            (r.id, i, r.x, r.y, r.width, r.height)
+            for i, box in enumerate(boxes)
+            for r in box.get_rectangles()
+        ]
+        return cls(rows, len(boxes))
+
+    @classmethod
+    def from_state(cls, state) -> "Snapshot":
+        """Snapshot of a RectangleSet.get_state(), the boxes are numbered in the order of their ids."""
+        width, height, x, y, box_id, _ = state
+        placed = np.flatnonzero(box_id >= 0)
+        box_ids, box = np.unique(box_id[placed], return_inverse=True)
+        columns = (placed, box, x[placed], y[placed], width[placed], height[placed])
+        return cls(np.stack(columns, axis=1), len(box_ids))
+
+    def __len__(self):
+        return len(self.placements)
+
+    def boxes(self) -> list:
+        """The placements grouped by box, one (k, 6) array per box."""
+        order = np.argsort(self.placements[:, 1], kind="stable")
+        bounds = np.searchsorted(self.placements[order, 1], np.arange(1, self.num_boxes))
+        return np.split(self.placements[order], bounds)
+
+
+class ProgressEvent(NamedTuple):
+    """
+    One report of a running algorithm. The scores are in the algorithm's own
+    objective, e.g. the number of boxes for Greedy or the neighborhood score
+    for LocalSearch; snapshot is the best solution so far. stats are the
+    counters and phase seconds of the run so far (Instrumentation.as_dict())
+    while the run is instrumented, None otherwise.
+    """
+
+    algorithm: str
+    iteration: int
+    elapsed: float
+    current_score: float
+    best_score: float
+    moves_per_second: float
+    snapshot: Snapshot
+    final: bool = False
+    stats: dict = None
+
+
+class ProgressStream:
+    """
+    Rate-limited progress events of one algorithm run. The algorithm asks
+    due() at its iteration boundaries, which is only a clock read, and
+    publishes an event at most every interval seconds and once at the end
+    (final=True). The subscribers are called in the thread of the algorithm
+    and should only hand the event over, e.g. a GUI emits a Qt signal to its
+    own thread; the events are immutable, so that is safe. The interval is
+    counted from the end of the callbacks.
+    """
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._subscribers = []
+        self.start()
+
+    def subscribe(self, callback):
+        """Call callback(event) for every event, returns the callback."""
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    @property
+    def subscribed(self) -> bool:
+        return bool(self._subscribers)
+
+    def start(self):
+        """Reset the clock, called at the start of run()."""
+        self._started = self._last_time = time.perf_counter()
+        self._last_iteration = 0
+        self._next_time = self._started + self.interval
+
+    def due(self) -> bool:
+        """True if there are subscribers and the last event is at least interval seconds old."""
+        return bool(self._subscribers) and time.perf_counter() >= self._next_time
+
+    def publish(self, algorithm, iteration, current_score, best_score, snapshot, final=False):
+        """
+        Send an event to the subscribers.
+        Args:
+            algorithm: name of the algorithm
+            snapshot: function that returns the Snapshot of the best solution,
+                      only called if there are subscribers
+        """
+        if not self._subscribers:
+            return
+        now = time.perf_counter()
+        seconds = now - self._last_time
+        rate = (iteration - self._last_iteration) / seconds if seconds > 0 else 0.0
+        event = ProgressEvent(
+            algorithm, iteration, now - self._started, current_score, best_score, rate, snapshot(), final,
+            instrumentation.snapshot(),
+        )
+        self._last_time, self._last_iteration = now, iteration
+        for callback in list(self._subscribers):
+            callback(event)
+        # a slow subscriber cannot take over the run
+        self._next_time = time.perf_counter() + self.interval
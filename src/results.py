@@ -0,0 +1,243 @@
+"""
+Results store: one JSON line per run in <directory>/results.jsonl, the
+per-box data of a run optionally in a NumPy side file
+<directory>/runs/<run_id>.npz. Records are only appended, a reader streams
+the file line by line, so thousands of runs are aggregated without loading
+them at once.
+
+A record:
+
+    {
+        "run_id": "...", "date": "2026-01-01T12:00:00",
+        "problem": "packing", "algorithm": "SimulatedAnnealing",
+        "instance": {"fingerprint": "...", "size": 200, "box_size": 100},
+        "params": {...}, "seed": 1,
+        "metrics": {"num_boxes": 12, "time": 1.5, ...},
+        "instrumentation": {"counters": {...}, "phases": {...}} or None,
+        "arrays": "runs/<run_id>.npz" or None
+    }
+"""
+import hashlib
+import json
+import math
+import os
+import uuid
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+
+def instance_fingerprint(problem, *arrays) -> str:
+    """
+    Hash of an instance, equal for equal instances independent of how they
+    were generated or loaded, e.g.
+    instance_fingerprint("packing", [box_size], widths, heights).
+    """
+    digest = hashlib.sha256(problem.encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        if array.dtype.kind in "iub":
+            array = array.astype(np.int64)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def packing_record(problem, algorithm, boxes, elapsed, params=None, seed=None, control=None, stats=None,
+                   lower_bound=None):
+    """
+    Record and side file arrays of a packing run.
+    Args:
+        problem: the OptimizationProblem
+        algorithm: name of the algorithm
+        boxes: the solution
+        elapsed: seconds of the run
+        control: RunControl of the run, for the stop reason and the iterations
+        stats: Instrumentation of the run
+    Returns:
+        (dict, dict): the record for ResultStore.append() and the per-box
+                      arrays (the metrics of scoring.py and the rectangles per
+                      box, the placements)
+    """
+    from progress import Snapshot
+    from scoring import box_metrics_from_arrays
+
+    rectangle_set = problem.get_rectangle_set()
+    box_size = problem.get_box_size()
+    snapshot = Snapshot.from_boxes(boxes)
+    placements = snapshot.placements
+    box_metrics = box_metrics_from_arrays(*placements[:, 1:].T, box_size, snapshot.num_boxes)
+    utilization = box_metrics.utilization
+    record = {
+        "problem": "packing",
+        "algorithm": algorithm,
+        "instance": {
+            # the algorithms rotate the rectangles in place
+            "fingerprint": instance_fingerprint(
+                "packing", [box_size],
+                np.minimum(rectangle_set.width, rectangle_set.height),
+                np.maximum(rectangle_set.width, rectangle_set.height),
+            ),
+            "size": len(rectangle_set),
+            "box_size": box_size,
+        },
+        "params": dict(params or {}),
+        "seed": seed,
+        "metrics": {
+            "num_boxes": snapshot.num_boxes,
+            "num_placed": len(snapshot),
+            "lower_bound": lower_bound,
+            "time": elapsed,
+            "mean_utilization": float(utilization.mean()) if len(utilization) else 0.0,
+            "min_utilization": float(utilization.min()) if len(utilization) else 0.0,
+            "mean_compactness": float(box_metrics.compactness.mean()) if len(utilization) else 0.0,
+            "mean_irregular_gap": float(box_metrics.irregular_gap.mean()) if len(utilization) else 0.0,
+            "mean_contiguity": float(box_metrics.contiguity.mean()) if len(utilization) else 0.0,
+            "stop_reason": None if control is None else control.stop_reason,
+            "iterations": None if control is None else control.iterations,
+        },
+        "instrumentation": None if stats is None else stats.as_dict(),
+    }
+    arrays = {
+        **box_metrics._asdict(),
+        "rectangles": np.bincount(placements[:, 1], minlength=snapshot.num_boxes),
+        "placements": placements,
+    }
+    return record, arrays
+
+
+def field(record, path, default=None):
+    """Value of a dotted path, e.g. field(record, "metrics.num_boxes"), default if it is missing."""
+    value = record
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return default
+        value = value[key]
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return repr(value)
+
+
+class Summary(NamedTuple):
+    count: int
+    mean: float
+    std: float
+    min: float
+    max: float
+
+
+class ResultStore:
+    """
+    Append-only store of run records in a directory, see the module
+    docstring. Every record is written with a single write() on a file
+    opened for appending, so runs in separate processes can share a store.
+    A line that cannot be parsed, e.g. of a run that was killed while
+    writing, is skipped by the readers.
+    """
+
+    FILE = "results.jsonl"
+    ARRAYS = "runs"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILE)
+
+    def append(self, record, arrays=None) -> str:
+        """
+        Add a run. run_id and date are filled in if missing; the arrays, if
+        any, go to the side file before the record is written, so a record
+        never points to a missing file.
+        Returns:
+            str: the run_id
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        record = dict(record)
+        record.setdefault("run_id", uuid.uuid4().hex)
+        record.setdefault("date", datetime.now().isoformat(timespec="seconds"))
+        record["arrays"] = None
+        if arrays:
+            relative = os.path.join(self.ARRAYS, record["run_id"] + ".npz")
+            os.makedirs(os.path.join(self.directory, self.ARRAYS), exist_ok=True)
+            np.savez_compressed(os.path.join(self.directory, relative), **arrays)
+            record["arrays"] = relative
+        line = json.dumps(record, default=_json_default) + "\n"
+        if self._unterminated():
+            line = "\n" + line
+        with open(self.path, "a") as file:
+            file.write(line)
+        return record["run_id"]
+
+    def _unterminated(self) -> bool:
+        """True if the last line was cut off, the next record has to start on a new line."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return False
+        with open(self.path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) != b"\n"
+
+    def records(self, where=None, **equal):
+        """
+        Stream the records in the order they were added.
+        Args:
+            where: predicate on the record
+            equal: top level fields that have to match, e.g. algorithm="Greedy"
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if any(record.get(key) != value for key, value in equal.items()):
+                    continue
+                if where is not None and not where(record):
+                    continue
+                yield record
+
+    def load_arrays(self, record) -> dict:
+        """The side file arrays of a record, an empty dict if it has none."""
+        if not record.get("arrays"):
+            return {}
+        with np.load(os.path.join(self.directory, record["arrays"])) as data:
+            return {key: data[key] for key in data.files}
+
+    def aggregate(self, by, value, where=None, **equal) -> dict:
+        """
+        Summary of a numeric field per group in one pass over the file,
+        memory grows with the number of groups only.
+        Args:
+            by: dotted path or tuple of paths of the group key, e.g.
+                ("algorithm", "instance.size")
+            value: dotted path of the summarized field, e.g. "metrics.num_boxes";
+                   records without it are skipped
+        Returns:
+            dict: group key -> Summary
+        """
+        paths = (by,) if isinstance(by, str) else tuple(by)
+        # count, mean, sum of squared deviations, min, max (Welford)
+        groups = {}
+        for record in self.records(where, **equal):
+            x = field(record, value)
+            if x is None:
+                continue
+            key = tuple(field(record, path) for path in paths)
+            key = key[0] if isinstance(by, str) else key
+            count, mean, m2, low, high = groups.get(key, (0, 0.0, 0.0, math.inf, -math.inf))
+            count += 1
+            delta = x - mean
+            mean += delta / count
+            m2 += delta * (x - mean)
+            groups[key] = (count, mean, m2, min(low, x), max(high, x))
+        return {
+            key: Summary(count, mean, math.sqrt(m2 / (count - 1)) if count > 1 else 0.0, low, high)
+            for key, (count, mean, m2, low, high) in groups.items()
+        }
@@ -0,0 +1,106 @@
+import threading
+import time
+
+
+class CancellationToken:
+    """
+    Thread safe cancellation flag, set by the caller (e.g. the GUI thread)
+    and polled by a running algorithm. One token can be shared by several
+    RunControls to stop a group of runs together.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class RunControl:
+    """
+    Limits of one algorithm run, checked by the algorithms at their iteration
+    boundaries (a placed rectangle in Greedy, a neighborhood step in
+    LocalSearch, a move in SimulatedAnnealing, a search step in Backtracking). A
+    stopped algorithm returns the best solution found so far, the reason is
+    kept in stop_reason.
+
+    Args:
+        time_limit: seconds from start() until the run stops, None for no deadline
+        max_iterations: iterations until the run stops, None for no cap
+        token: CancellationToken to stop the run from another thread, a new one by default
+        lower_bound: number of boxes to stop at, e.g. l2_lower_bound() of the
+                     instance; no solution can be better, or the caller is
+                     content with it
+    """
+
+    DEADLINE = "deadline"
+    ITERATIONS = "iterations"
+    CANCELLED = "cancelled"
+    LOWER_BOUND = "lower_bound"
+
+    def __init__(self, time_limit=None, max_iterations=None, token=None, lower_bound=None):
+        self.time_limit = time_limit
+        self.max_iterations = max_iterations
+        self.token = token if token is not None else CancellationToken()
+        self.lower_bound = lower_bound
+        self.iterations = 0
+        self.stop_reason = None
+        self._started = time.perf_counter()
+        self._deadline = None if time_limit is None else self._started + time_limit
+
+    def start(self):
+        """Reset the clock and the iteration count, called at the start of run()."""
+        self.iterations = 0
+        self.stop_reason = None
+        self._started = time.perf_counter()
+        self._deadline = None if self.time_limit is None else self._started + self.time_limit
+        return self
+
+    def cancel(self):
+        self.token.cancel()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def remaining(self):
+        """Seconds until the deadline, None without a deadline."""
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.perf_counter())
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop_reason is not None
+
+    def should_stop(self) -> bool:
+        """Check the limits without counting an iteration."""
+        if self.stop_reason is not None:
+            return True
+        if self.token.cancelled():
+            self.stop_reason = self.CANCELLED
+        elif self._deadline is not None and time.perf_counter() >= self._deadline:
+            self.stop_reason = self.DEADLINE
+        elif self.max_iterations is not None and self.iterations >= self.max_iterations:
+            self.stop_reason = self.ITERATIONS
+        return self.stop_reason is not None
+
+    def step(self, count=1) -> bool:
+        """
+        Check the limits at an iteration boundary, then count the iteration.
+        Returns:
+            bool: True if the run has to stop before this iteration
+        """
+        if self.should_stop():
+            return True
+        self.iterations += count
+        return False
+
+    def bound_reached(self, num_boxes) -> bool:
+        """True, and the run is stopped, if a solution with num_boxes boxes reaches the lower bound."""
+        if self.lower_bound is not None and num_boxes <= self.lower_bound:
+            self.stop_reason = self.stop_reason or self.LOWER_BOUND
+            return True
+        return False
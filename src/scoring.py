@@ -1,4 +1,8 @@
-from structs import Box
+from collections import Counter
+
+import numpy as np
+
+from structs import Box, BoxMetrics
 
 def compute_utilization(box: Box) -> float:
     """
@@ -23,21 +27,9 @@ def compute_compactness(box: Box) -> float:
     For the set of rectangles in the box, the bounding rectangle is computed.
     Compactness = (sum of rectangle areas) / (bounding rectangle area)
     If no rectangles are placed, return 0.
+    The box keeps the area sum and bounding rectangle up to date, so this is O(1).
     """
-    rects = box.get_rectangles()
-    if not rects:
-        return 0
-    # Get bounding coordinates
-    x_min = min(rect.x for rect in rects)
-    y_min = min(rect.y for rect in rects)
-    x_max = max(rect.x + rect.width for rect in rects)
-    y_max = max(rect.y + rect.height for rect in rects)
-    bounding_width = x_max - x_min
-    bounding_height = y_max - y_min
-    bounding_area = bounding_width * bounding_height
-    total_rect_area = sum(rect.width * rect.height for rect in rects)
-    # Avoid division by zero if bounding_area is 0
-    return total_rect_area / bounding_area if bounding_area > 0 else 0
+    return box.get_metrics().compactness
 
 def compute_average_compactness(solution: list) -> float:
     """
@@ -52,24 +44,9 @@ def compute_contiguity(box: Box) -> float:
     For each rectangle, we count how many edges are flush with the box boundary.
     The maximum per rectangle is 4.
     The contiguity score for the box is the average contact ratio.
+    The box keeps the number of contacts up to date, so this is O(1).
     """
-    rects = box.get_rectangles()
-    if not rects:
-        return 0
-    L = box.get_length()
-    total_ratio = 0
-    for rect in rects:
-        contacts = 0
-        if rect.x == 0:
-            contacts += 1
-        if rect.y == 0:
-            contacts += 1
-        if rect.x + rect.width == L:
-            contacts += 1
-        if rect.y + rect.height == L:
-            contacts += 1
-        total_ratio += contacts / 4  # Normalize to [0,1]
-    return total_ratio / len(rects)
+    return box.get_metrics().contiguity
 
 def compute_average_contiguity(solution: list) -> float:
     """
@@ -85,17 +62,7 @@ def compute_irregular_gap_penalty(box: Box) -> float:
     Then, penalty = (bounding area - sum of rectangle areas) / bounding area.
     A lower penalty indicates that the rectangles fill their bounding region more tightly.
     """
-    rects = box.get_rectangles()
-    if not rects:
-        return 0
-    x_min = min(rect.x for rect in rects)
-    y_min = min(rect.y for rect in rects)
-    x_max = max(rect.x + rect.width for rect in rects)
-    y_max = max(rect.y + rect.height for rect in rects)
-    bounding_area = (x_max - x_min) * (y_max - y_min)
-    total_rect_area = sum(rect.width * rect.height for rect in rects)
-    # If bounding_area is zero, return 0 penalty
-    return (bounding_area - total_rect_area) / bounding_area if bounding_area > 0 else 0
+    return box.get_metrics().irregular_gap
 
 def compute_average_irregular_gap_penalty(solution: list) -> float:
     """
@@ -103,3 +70,119 @@ def compute_average_irregular_gap_penalty(solution: list) -> float:
     """
     penalties = [compute_irregular_gap_penalty(box) for box in solution]
     return sum(penalties) / len(penalties) if penalties else 0
+
+def box_metrics_from_arrays(box_id, x, y, width, height, box_size, num_boxes=None) -> BoxMetrics:
+    """
+    Computes the metrics of all boxes of a solution at once from flat arrays
+    with one entry per placed rectangle, e.g. the columns of a Snapshot or a
+    RectangleSet state, without Box objects. The sums and counts per box are
+    bincounts, the bounding rectangles segmented min/max reductions over the
+    rectangles grouped by box. The values are the same as the ones of
+    Box.get_metrics().
+    Args:
+        box_id: box of every rectangle, 0 <= box_id < num_boxes
+        num_boxes: number of boxes, boxes without rectangles get zeros;
+                   max(box_id) + 1 by default
+    Returns:
+        BoxMetrics: one array per metric, indexed by box id
+    """
+    box_id = np.asarray(box_id, dtype=np.int64)
+    x, y, width, height = (np.asarray(a, dtype=np.int64) for a in (x, y, width, height))
+    if num_boxes is None:
+        num_boxes = int(box_id.max()) + 1 if len(box_id) else 0
+    count = np.bincount(box_id, minlength=num_boxes)
+    area_sum = np.bincount(box_id, weights=width * height, minlength=num_boxes)
+    right, top = x + width, y + height
+    contacts = (x == 0).astype(np.int64) + (y == 0) + (right == box_size) + (top == box_size)
+    contacts = np.bincount(box_id, weights=contacts, minlength=num_boxes)
+
+    bounds = np.zeros((4, num_boxes), dtype=np.int64)
+    if len(box_id):
+        order = np.argsort(box_id, kind="stable")
+        grouped = box_id[order]
+        starts = np.flatnonzero(np.concatenate(([True], grouped[1:] != grouped[:-1])))
+        present = grouped[starts]
+        bounds[0, present] = np.minimum.reduceat(x[order], starts)
+        bounds[1, present] = np.minimum.reduceat(y[order], starts)
+        bounds[2, present] = np.maximum.reduceat(right[order], starts)
+        bounds[3, present] = np.maximum.reduceat(top[order], starts)
+    bounding_area = (bounds[2] - bounds[0]) * (bounds[3] - bounds[1])
+
+    filled = bounding_area > 0
+    compactness = np.divide(area_sum, bounding_area, out=np.zeros(num_boxes), where=filled)
+    irregular_gap = np.divide(bounding_area - area_sum, bounding_area, out=np.zeros(num_boxes), where=filled)
+    contiguity = np.divide(contacts / 4, count, out=np.zeros(num_boxes), where=count > 0)
+    return BoxMetrics(area_sum / (box_size * box_size), compactness, irregular_gap, contiguity)
+
+class SolutionMetrics:
+    """
+    Sums of the per-box metrics (see Box.get_metrics()) over a solution.
+    A move only changes a few boxes, so the metrics of the neighbor are derived
+    with replace() by exchanging the metrics of those boxes, in O(changed boxes)
+    instead of visiting every box. The sums are updated with float deltas, so
+    they can differ from a fresh computation in the last bits.
+    """
+
+    def __init__(self, num_boxes, compactness, irregular_gap, contiguity, utilizations, removed=(), added=()):
+        self.num_boxes = num_boxes
+        self._compactness = compactness
+        self._irregular_gap = irregular_gap
+        self._contiguity = contiguity
+        # sorted utilizations of the base solution, shared between all derived metrics
+        self._utilizations = utilizations
+        self._removed = list(removed)
+        self._added = list(added)
+
+    @classmethod
+    def from_solution(cls, solution: list) -> "SolutionMetrics":
+        metrics = [box.get_metrics() for box in solution]
+        return cls(
+            len(metrics),
+            sum(m.compactness for m in metrics),
+            sum(m.irregular_gap for m in metrics),
+            sum(m.contiguity for m in metrics),
+            sorted(m.utilization for m in metrics),
+        )
+
+    def replace(self, old: list, new: list) -> "SolutionMetrics":
+        """
+        Returns the metrics of the solution in which the boxes with the metrics
+        in old were replaced by boxes with the metrics in new. Boxes that were
+        removed only appear in old, boxes that were added only in new.
+        """
+        return SolutionMetrics(
+            self.num_boxes - len(old) + len(new),
+            self._compactness - sum(m.compactness for m in old) + sum(m.compactness for m in new),
+            self._irregular_gap - sum(m.irregular_gap for m in old) + sum(m.irregular_gap for m in new),
+            self._contiguity - sum(m.contiguity for m in old) + sum(m.contiguity for m in new),
+            self._utilizations,
+            self._removed + [m.utilization for m in old],
+            self._added + [m.utilization for m in new],
+        )
+
+    def min_utilization(self) -> float:
+        # removed boxes can be boxes added by an earlier replace(), so they are
+        # taken from the added ones first and then from the front of the base
+        removed = Counter(self._removed)
+        candidates = []
+        for value in self._added:
+            if removed[value] > 0:
+                removed[value] -= 1
+            else:
+                candidates.append(value)
+        for value in self._utilizations:
+            if removed[value] > 0:
+                removed[value] -= 1
+                continue
+            candidates.append(value)
+            break
+        return min(candidates) if candidates else 0
+
+    def average_compactness(self) -> float:
+        return self._compactness / self.num_boxes if self.num_boxes else 0
+
+    def average_irregular_gap_penalty(self) -> float:
+        return self._irregular_gap / self.num_boxes if self.num_boxes else 0
+
+    def average_contiguity(self) -> float:
+        return self._contiguity / self.num_boxes if self.num_boxes else 0
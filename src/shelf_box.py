@@ -1,6 +1,7 @@
-from structs import Rectangle
+import instrumentation
+from structs import MetricsCache, MoveJournal, Rectangle, new_box_id
 
-class ShelfBox:
+class ShelfBox(MoveJournal, MetricsCache):
     """
     A shelf-based packing algorithm that guarantees no overlaps by using fixed
     shelf heights. Each shelf is created with a height equal to the first rectangle's
@@ -11,6 +12,9 @@ class ShelfBox:
         self._length = box_size
         self.shelves = []  # List of shelves; each is a dict with keys: start_y, height, gaps, rectangles.
         self.used_area = 0
+        self.id = new_box_id()
+        self._init_journal()
+        self._init_metrics()
 
     def _create_new_shelf(self, rectangle: Rectangle) -> bool:
         """
@@ -27,6 +31,7 @@ class ShelfBox:
             'rectangles': []
         }
         self.shelves.append(new_shelf)
+        self._record("new_shelf", None)
         # Immediately place the rectangle at x = 0 in the new shelf.
         return self._place_in_shelf(new_shelf, rectangle, gap_index=0, gap_start=0, gap_width=self._length)
 
@@ -38,11 +43,15 @@ class ShelfBox:
         # For safety, ensure the rectangle fits in the gap and does not exceed shelf height.
         if rectangle.width > gap_width or rectangle.height > shelf['height']:
             return False
+        state = rectangle.get_state() if self._journal_marks else None
+        old_gap = shelf['gaps'][gap_index]
         # Set the rectangle's position.
         rectangle.x = gap_start
         rectangle.y = shelf['start_y']
+        rectangle.box_id = self.id
         shelf['rectangles'].append(rectangle)
         self.used_area += rectangle.width * rectangle.height
+        self._metrics_add(rectangle)
 
         # Update the gap: remove the used portion.
         remaining = gap_width - rectangle.width
@@ -50,6 +59,7 @@ class ShelfBox:
             shelf['gaps'][gap_index] = (gap_start + rectangle.width, remaining)
         else:
             shelf['gaps'].pop(gap_index)
+        self._record("place", rectangle, state, shelf, gap_index, old_gap, remaining <= 0)
         return True
 
     def place(self, rectangle: Rectangle) -> bool:
@@ -62,6 +72,13 @@ class ShelfBox:
         # Quick rejection if the rectangle is larger than the box dimensions.
         if rectangle.width > self._length or rectangle.height > self._length:
             return False
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("ShelfBox.place")
+            stats.count(
+                "ShelfBox.gap_scans",
+                sum(len(shelf['gaps']) for shelf in self.shelves if rectangle.height <= shelf['height']),
+            )
 
         best_candidate = None  # Will store (leftover, shelf, gap_index, gap_start, gap_width)
         # Search through existing shelves.
@@ -103,21 +120,81 @@ class ShelfBox:
         total_area = self._length * self._length
         return total_area - self.used_area
 
+    def get_free_extents(self):
+        """
+        List of (width, height) extents where a rectangle can still be placed:
+        the gaps of the existing shelves and the space for a new shelf.
+        """
+        extents = [
+            (gap_width, shelf['height'])
+            for shelf in self.shelves
+            for _, gap_width in shelf['gaps']
+        ]
+        free_height = self._length - sum(shelf['height'] for shelf in self.shelves)
+        if free_height > 0:
+            extents.append((self._length, free_height))
+        return extents
+
     def remove_rectangle(self, rectangle: Rectangle):
         """
         Removes a rectangle from the box.
         """
         for shelf in self.shelves:
             if rectangle in shelf['rectangles']:
-                shelf['rectangles'].remove(rectangle)
+                index = shelf['rectangles'].index(rectangle)
+                state = rectangle.get_state() if self._journal_marks else None
+                shelf['rectangles'].pop(index)
+                rectangle.box_id = -1
                 self.used_area -= rectangle.width * rectangle.height
+                self._metrics_remove(rectangle)
+                self._record("remove", rectangle, state, shelf, index)
                 return
-    
+
+    def rotate(self, rectangle: Rectangle) -> bool:
+        """
+        Rotates a placed rectangle and places it again.
+        Returns False and leaves the box unchanged if the rotated rectangle does not fit.
+        """
+        self.begin()
+        self.remove_rectangle(rectangle)
+        rectangle.rotate()
+        self._record("rotate", rectangle)
+        if self.place(rectangle):
+            self.commit()
+            return True
+        self.rollback()
+        return False
+
+    def _undo(self, entry):
+        """Reverts one journal entry."""
+        kind, rectangle = entry[0], entry[1]
+        if kind == "new_shelf":
+            self.shelves.pop()
+        elif kind == "place":
+            _, _, state, shelf, gap_index, old_gap, popped = entry
+            shelf['rectangles'].pop()
+            if popped:
+                shelf['gaps'].insert(gap_index, old_gap)
+            else:
+                shelf['gaps'][gap_index] = old_gap
+            self.used_area -= rectangle.width * rectangle.height
+            self._metrics_remove(rectangle)
+            rectangle.set_state(state)
+        elif kind == "remove":
+            _, _, state, shelf, index = entry
+            rectangle.set_state(state)
+            shelf['rectangles'].insert(index, rectangle)
+            self.used_area += rectangle.width * rectangle.height
+            self._metrics_add(rectangle)
+        elif kind == "rotate":
+            rectangle.rotate()
+
     def copy(self):
         """
         Copies the shelf box.
         """
         new_box = ShelfBox(self._length)
+        new_box.id = self.id
         for shelf in self.shelves:
             new_shelf = {
                 'start_y': shelf['start_y'],
@@ -127,4 +204,5 @@ class ShelfBox:
             }
             new_box.shelves.append(new_shelf)
         new_box.used_area = self.used_area
+        new_box._copy_metrics(self)
         return new_box
\ No newline at end of file
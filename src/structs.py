@@ -1,7 +1,19 @@
+import itertools
 import random
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import numpy as np
 
+import instrumentation
+from occupancy import OccupancyBitmap
+
+
+_box_ids = itertools.count()
+
+
+def new_box_id() -> int:
+    """Returns a unique id for a new box."""
+    return next(_box_ids)
+
 
 class OptimizationProblem:
     def __init__(
@@ -11,25 +23,38 @@ class OptimizationProblem:
         self._num_rectangles = num_rectangles
         self._min_size = min_size
         self._max_size = max_size
-        self._rectangles = np.array([])
+        self._rectangle_set = None
+        self._rectangles = None
         self.generate_instance()
 
-    def generate_instance(self) -> None:
-        rectangles = []
-        for _ in range(self._num_rectangles):
-            width = np.random.randint(self._min_size, self._max_size + 1)
-            height = np.random.randint(self._min_size, self._max_size + 1)
-            rect = Rectangle(width, height, 0, 0)
+    @classmethod
+    def from_sizes(cls, box_size: int, widths, heights) -> "OptimizationProblem":
+        """Instance with the given rectangle sizes, e.g. loaded from a file."""
+        problem = cls(box_size, 0, 1, 1)
+        problem._rectangle_set = RectangleSet(widths, heights)
+        problem._num_rectangles = len(problem._rectangle_set)
+        if problem._num_rectangles:
+            sizes = np.concatenate([problem._rectangle_set.width, problem._rectangle_set.height])
+            problem._min_size, problem._max_size = int(sizes.min()), int(sizes.max())
+        return problem
 
-            rectangles.append(rect)
+    def generate_instance(self) -> None:
+        self._rectangle_set = RectangleSet.generate(
+            self._num_rectangles, self._min_size, self._max_size
+        )
+        self._rectangles = None
 
-        self._rectangles = np.array(rectangles)
+    def get_rectangle_set(self) -> "RectangleSet":
+        return self._rectangle_set
 
     def get_rectangles(self):
+        # the Rectangle views are only created when someone asks for them
+        if self._rectangles is None:
+            self._rectangles = self._rectangle_set.as_array()
         return self._rectangles
 
     def get_rectangles_random(self):
-        return np.random.permutation(self._rectangles)
+        return np.random.permutation(self.get_rectangles())
 
     def get_box_size(self) -> int:
         return self._box_size
@@ -38,8 +63,300 @@ class OptimizationProblem:
         raise NotImplementedError()
 
 
-class Box:
-    def __init__(self, box_size, grid_size=2, id=None):
+class RectangleSet:
+    """
+    Columnar (struct-of-arrays) storage for the rectangles of an instance.
+    Every column is a NumPy array with one row per rectangle:
+        width, height, x, y, box_id, rotation, id (int32) and color (uint8, n x 3).
+    The id is the dense row index of the rectangle in the instance, box_id is
+    the id of the box the rectangle is placed in (-1 if it is not placed) and
+    rotation is 1 if the rectangle was rotated by 90 degrees.
+    Rectangle objects are lightweight views over one row of the set.
+    """
+
+    def __init__(self, width, height, x=None, y=None, color=None, id=None):
+        self.width = np.asarray(width, dtype=np.int32)
+        self.height = np.asarray(height, dtype=np.int32)
+        n = len(self.width)
+        self.x = np.zeros(n, dtype=np.int32) if x is None else np.asarray(x, dtype=np.int32)
+        self.y = np.zeros(n, dtype=np.int32) if y is None else np.asarray(y, dtype=np.int32)
+        self.box_id = np.full(n, -1, dtype=np.int32)
+        self.rotation = np.zeros(n, dtype=np.int32)
+        self.id = np.arange(n, dtype=np.int32) if id is None else np.asarray(id, dtype=np.int32)
+        if color is None:
+            self.color = np.random.randint(0, 256, size=(n, 3), dtype=np.uint8)
+        else:
+            self.color = np.asarray(color, dtype=np.uint8).reshape(n, 3)
+        self._views = None
+
+    @classmethod
+    def generate(cls, num_rectangles: int, min_size: int, max_size: int) -> "RectangleSet":
+        """Generates a random instance with a single vectorized call for all sizes."""
+        sizes = np.random.randint(min_size, max_size + 1, size=(2, num_rectangles))
+        return cls(sizes[0], sizes[1])
+
+    def __len__(self):
+        return len(self.width)
+
+    def __getitem__(self, index) -> "Rectangle":
+        return self.views()[index]
+
+    def __iter__(self):
+        return iter(self.views())
+
+    def area(self) -> np.ndarray:
+        return self.width.astype(np.int64) * self.height
+
+    def perimeter(self) -> np.ndarray:
+        return self.width.astype(np.int64) + self.height
+
+    def views(self) -> list:
+        """
+        Returns one Rectangle view per row. The views are cached, so the same
+        row is always represented by the same object.
+        """
+        if self._views is None:
+            self._views = [Rectangle._view(self, i) for i in range(len(self))]
+        return self._views
+
+    def take(self, order) -> list:
+        """Returns the Rectangle views of the given row indices, in that order."""
+        views = self.views()
+        return [views[i] for i in order]
+
+    def copy_rows(self, indices) -> "RectangleSet":
+        """A new set with copies of the given rows, in that order, the ids are kept."""
+        indices = np.asarray(indices, dtype=np.intp)
+        rows = RectangleSet(
+            self.width[indices], self.height[indices], self.x[indices], self.y[indices],
+            color=self.color[indices], id=self.id[indices],
+        )
+        rows.box_id[:] = self.box_id[indices]
+        rows.rotation[:] = self.rotation[indices]
+        return rows
+
+    def as_array(self) -> np.ndarray:
+        """Returns the Rectangle views as a NumPy object array."""
+        array = np.empty(len(self), dtype=object)
+        array[:] = self.views()
+        return array
+
+    def get_state(self) -> tuple:
+        """
+        Copies of the mutable columns (width, height, x, y, box_id, rotation),
+        a compact snapshot of a complete placement.
+        """
+        return (
+            self.width.copy(), self.height.copy(), self.x.copy(),
+            self.y.copy(), self.box_id.copy(), self.rotation.copy(),
+        )
+
+    def set_state(self, state: tuple):
+        """Restores a snapshot returned by get_state()."""
+        self.width[:], self.height[:], self.x[:], self.y[:], self.box_id[:], self.rotation[:] = state
+
+
+def copy_rectangles(rectangles) -> list:
+    """
+    Copies of the rectangles, for the copies of boxes. The copies of the
+    rectangles of one RectangleSet are views of a single new set, so they stay
+    columnar. They are snapshots: they no longer follow the rows of the
+    instance, e.g. RectangleSet.get_state() of the instance does not see them.
+    """
+    groups = {}  # per source set: the set, the positions in the list and the rows
+    for position, rectangle in enumerate(rectangles):
+        rows, positions, indices = groups.setdefault(id(rectangle._set), (rectangle._set, [], []))
+        positions.append(position)
+        indices.append(rectangle._index)
+    copies = [None] * len(rectangles)
+    for rows, positions, indices in groups.values():
+        for position, copy in zip(positions, rows.copy_rows(indices).views()):
+            copies[position] = copy
+    return copies
+
+
+_journal_clock = itertools.count()
+
+
+class MoveJournal:
+    """
+    Records undo entries for the changes made to a box between begin() and
+    commit() or rollback(), so a move can be tried and reverted in O(size of
+    the move) instead of copying the box. Transactions can be nested.
+    Subclasses record entries with _record() and revert them in _undo().
+    Entries carry a global sequence number, so moves spanning several boxes
+    can be reverted in the right order with rollback_all().
+    """
+
+    def _init_journal(self):
+        self._journal = []
+        self._journal_marks = []
+
+    def begin(self):
+        """Start recording changes."""
+        self._journal_marks.append(len(self._journal))
+
+    def commit(self):
+        """Keep the changes since the matching begin()."""
+        self._journal_marks.pop()
+        if not self._journal_marks:
+            self._journal.clear()
+
+    def rollback(self):
+        """Revert all changes since the matching begin()."""
+        mark = self._journal_marks.pop()
+        while len(self._journal) > mark:
+            self._undo(self._journal.pop()[1])
+
+    def in_transaction(self) -> bool:
+        return bool(self._journal_marks)
+
+    def _record(self, *entry):
+        if self._journal_marks:
+            self._journal.append((next(_journal_clock), entry))
+
+    def _undo(self, entry):
+        raise NotImplementedError()
+
+
+def begin_all(boxes):
+    """Start a transaction on every box."""
+    for box in boxes:
+        box.begin()
+
+
+def commit_all(boxes):
+    """Commit the current transaction of every box."""
+    for box in boxes:
+        box.commit()
+
+
+def rollback_all(boxes):
+    """
+    Roll back the current transaction of every box. The entries of all boxes
+    are undone together in reverse order, which is needed when rectangles were
+    moved between the boxes.
+    """
+    pending = []
+    for box in boxes:
+        mark = box._journal_marks.pop()
+        pending.extend((seq, box, entry) for seq, entry in box._journal[mark:])
+        del box._journal[mark:]
+        if not box._journal_marks:
+            box._journal.clear()
+    pending.sort(key=lambda item: item[0], reverse=True)
+    for _, box, entry in pending:
+        box._undo(entry)
+
+
+BoxMetrics = namedtuple(
+    "BoxMetrics", ["utilization", "compactness", "irregular_gap", "contiguity"]
+)
+
+
+class MetricsCache:
+    """
+    Keeps the area sum, the bounding box and the number of edges flush with the
+    box boundary of the placed rectangles up to date on every place and remove,
+    so the metrics of src/scoring.py are O(1) per box. Removing a rectangle on
+    the edge of the bounding box only sets a dirty flag, the bounding box is
+    recomputed the next time the metrics are read.
+    Subclasses call _metrics_add() and _metrics_remove() with the rectangle on
+    the position where it is (or was) placed.
+    """
+
+    def _init_metrics(self):
+        self._area_sum = 0
+        self._contacts = 0
+        self._count = 0
+        self._bounds = None  # (x_min, y_min, x_max, y_max), None if empty
+        self._bounds_dirty = False
+        self._metrics = None
+
+    def _metrics_add(self, rectangle):
+        x, y, width, height = rectangle.x, rectangle.y, rectangle.width, rectangle.height
+        self._area_sum += width * height
+        self._contacts += self._boundary_contacts(x, y, width, height)
+        self._count += 1
+        if not self._bounds_dirty:
+            if self._bounds is None:
+                self._bounds = (x, y, x + width, y + height)
+            else:
+                x_min, y_min, x_max, y_max = self._bounds
+                self._bounds = (
+                    min(x_min, x), min(y_min, y), max(x_max, x + width), max(y_max, y + height)
+                )
+        self._metrics = None
+
+    def _metrics_remove(self, rectangle):
+        x, y, width, height = rectangle.x, rectangle.y, rectangle.width, rectangle.height
+        self._area_sum -= width * height
+        self._contacts -= self._boundary_contacts(x, y, width, height)
+        self._count -= 1
+        if self._count == 0:
+            self._bounds, self._bounds_dirty = None, False
+        elif not self._bounds_dirty:
+            x_min, y_min, x_max, y_max = self._bounds
+            if x == x_min or y == y_min or x + width == x_max or y + height == y_max:
+                self._bounds_dirty = True
+        self._metrics = None
+
+    def _boundary_contacts(self, x, y, width, height):
+        length = self.get_length()
+        return (x == 0) + (y == 0) + (x + width == length) + (y + height == length)
+
+    def _copy_metrics(self, other):
+        self._area_sum = other._area_sum
+        self._contacts = other._contacts
+        self._count = other._count
+        self._bounds = other._bounds
+        self._bounds_dirty = other._bounds_dirty
+        self._metrics = other._metrics
+
+    def get_bounds(self):
+        """Bounding box (x_min, y_min, x_max, y_max) of the placed rectangles, None if empty."""
+        if self._bounds_dirty:
+            rects = self.get_rectangles()
+            self._bounds = (
+                min(rect.x for rect in rects),
+                min(rect.y for rect in rects),
+                max(rect.x + rect.width for rect in rects),
+                max(rect.y + rect.height for rect in rects),
+            )
+            self._bounds_dirty = False
+        return self._bounds
+
+    def get_metrics(self) -> BoxMetrics:
+        """
+        Returns the utilization, compactness, irregular gap penalty and
+        contiguity of the box, see src/scoring.py for the definitions.
+        """
+        if self._metrics is None:
+            box_area = self.get_length() ** 2
+            utilization = (box_area - self.get_space()) / box_area
+            compactness = irregular_gap = contiguity = 0
+            if self._count:
+                x_min, y_min, x_max, y_max = self.get_bounds()
+                bounding_area = (x_max - x_min) * (y_max - y_min)
+                if bounding_area > 0:
+                    compactness = self._area_sum / bounding_area
+                    irregular_gap = (bounding_area - self._area_sum) / bounding_area
+                contiguity = self._contacts / 4 / self._count
+            self._metrics = BoxMetrics(utilization, compactness, irregular_gap, contiguity)
+        return self._metrics
+
+
+class Box(MoveJournal, MetricsCache):
+    """
+    A box that places rectangles on the corners of already placed ones.
+    The overlap checks use one of two occupancy backends:
+        "hash"    spatial hashing of the rectangles in grid_size x grid_size cells
+        "bitmap"  an OccupancyBitmap with per-row prefix sums of the occupied cells
+    """
+
+    def __init__(self, box_size, grid_size=2, id=None, occupancy="hash"):
+        if occupancy not in ("hash", "bitmap"):
+            raise ValueError(f"Unknown occupancy backend: {occupancy}")
         self._length = box_size
         self._rectangles = []
         self._coordinates = set()
@@ -50,11 +367,18 @@ class Box:
         self.grid_size = grid_size
         self.grid = defaultdict(list)  # Dictionary mapping grid cells to rectangles
 
+        # Bitmap backend, replaces the spatial hash if enabled
+        self._occupancy = OccupancyBitmap(box_size) if occupancy == "bitmap" else None
+        self._indexed = set()  # rectangles marked in the bitmap
+
         if id is None:
-            self.id = np.random.randint(0, 100000)
+            self.id = new_box_id()
         else:
             self.id = id
 
+        self._init_journal()
+        self._init_metrics()
+
     def _get_grid_cells(self, x, y, width, height):
         """Get grid cells occupied by a given rectangle."""
         start_x, start_y = x // self.grid_size, y // self.grid_size
@@ -66,9 +390,19 @@ class Box:
         ]
 
     def compute_overlap(self, rectangle: "Rectangle", x, y) -> int:
-        """Compute overlap using spatial hashing."""
+        """Compute overlap using spatial hashing or the occupancy bitmap."""
+        stats = instrumentation.active
+        if self._occupancy is not None:
+            if stats is not None:
+                stats.count("Box.compute_overlap")
+                rows = min(y + rectangle.height, self._length) - max(y, 0)
+                stats.count("Box.compute_overlap.rows", max(rows, 0))
+            return self._occupancy.region_sum(x, y, rectangle.width, rectangle.height)
         total_overlap = 0
         cells = self._get_grid_cells(x, y, rectangle.width, rectangle.height)
+        if stats is not None:
+            stats.count("Box.compute_overlap")
+            stats.count("Box.compute_overlap.cells", len(cells))
         checked_rectangles = set()  # Avoid duplicate checks
         for cell in cells:
             for placed in self.grid[cell]:
@@ -99,6 +433,9 @@ class Box:
         Returns:
             bool: True if the rectangle can be placed, False otherwise
         """
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("Box.can_place")
         if x + rectangle.width > self._length or y + rectangle.height > self._length:
             return False
         overlap = self.compute_overlap(rectangle, x, y)
@@ -106,56 +443,109 @@ class Box:
             return False
         return True
 
-    def place(self, rectangle: "Rectangle", check = True) -> bool:
+    def place(self, rectangle: "Rectangle", check = True, rng = random) -> bool:
         """
         Place a rectangle in the box
         Args:
             rectangle (Rectangle): the rectangle to be placed
             check: check for overlaps or not
+            rng: random number generator that picks the corner without the
+                 check, the corners are drawn in sorted order, so the same
+                 state and seed give the same corner in every process
         Returns:
             bool: True if the rectangle was placed, False otherwise
         """
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("Box.place")
         if check:
             if rectangle.width * rectangle.height > self._space:
                 return False
+            if self._occupancy is not None:
+                coordinate = self._first_free_coordinate(rectangle)
+                if coordinate is None:
+                    return False
+                self._update_placement(rectangle, coordinate)
+                return True
             for coordinate in sorted(self._coordinates, key = lambda x: x[0]+x[1]):
                 x, y = coordinate
                 if self.can_place(rectangle, x, y):
                     self._update_placement(rectangle, coordinate)
                     return True
         else:
-            for _ in range(len(self._coordinates)):
-                coordinate = random.choice(list(self._coordinates))
+            coordinates = sorted(self._coordinates)
+            for _ in range(len(coordinates)):
+                coordinate = rng.choice(coordinates)
                 x, y = coordinate
                 if not((x + rectangle.width > self._length) or (y + rectangle.height > self._length)):
                     self._update_placement(rectangle, coordinate, False)
                     return True
         return False
 
+    def _first_free_coordinate(self, rectangle: "Rectangle"):
+        """
+        Test all candidate coordinates against the occupancy bitmap in one
+        vectorized pass and return the first free one in x+y order.
+        """
+        ordered = sorted(self._coordinates, key = lambda x: x[0]+x[1])
+        if not ordered:
+            return None
+        xs, ys = np.array(ordered, dtype=np.intp).T
+        inside = np.flatnonzero(
+            (xs + rectangle.width <= self._length) & (ys + rectangle.height <= self._length)
+        )
+        if len(inside) == 0:
+            return None
+        overlaps = self._occupancy.region_sums(
+            xs[inside], ys[inside], rectangle.width, rectangle.height
+        )
+        free = np.flatnonzero(overlaps == 0)
+        if len(free) == 0:
+            return None
+        return ordered[inside[free[0]]]
+
     def _update_placement(self, rectangle, coordinate, grid = True):
         """Update placement and store in grid."""
         x, y = coordinate
         if (x+rectangle.width > self._length) and (y + rectangle.height > self._length):
             print("placed over the edge")
+        state = rectangle.get_state() if self._journal_marks else None
         rectangle.x, rectangle.y = x, y
+        rectangle.box_id = self.id
         self._rectangles.append(rectangle)
 
-        if grid:
+        cells = []
+        indexed = grid and self._occupancy is not None
+        if indexed:
+            self._occupancy.add(x, y, rectangle.width, rectangle.height)
+            self._indexed.add(rectangle)
+        elif grid:
             # Update grid
             cells = self._get_grid_cells(x, y, rectangle.width, rectangle.height)
             for cell in cells:
                 self.grid[cell].append(rectangle)
 
-        self._coordinates.discard(coordinate)
+        new_coordinates = []
         if not (x + rectangle.width >= self._length):
-            self._coordinates.add((x + rectangle.width, y))
+            new_coordinates.append((x + rectangle.width, y))
         if not (y + rectangle.height >= self._length):
-            self._coordinates.add((x, y + rectangle.height))
+            new_coordinates.append((x, y + rectangle.height))
+        if self._journal_marks:
+            removed = [coordinate] if coordinate in self._coordinates else []
+            added = [c for c in set(new_coordinates) if c not in self._coordinates]
+            self._record("place", rectangle, state, cells, removed, added, indexed)
+        self._coordinates.discard(coordinate)
+        self._coordinates.update(new_coordinates)
         self._space -= rectangle.width * rectangle.height
+        self._metrics_add(rectangle)
 
     def place_no_check(self, rectangle):
+        if self._journal_marks:
+            self._record("place", rectangle, rectangle.get_state(), [], [], [], False)
+        rectangle.box_id = self.id
         self._rectangles.append(rectangle)
         self._space -= rectangle.width * rectangle.height
+        self._metrics_add(rectangle)
 
     def get_rectangles(self):
         return self._rectangles
@@ -168,71 +558,233 @@ class Box:
 
     def remove_rectangle(self, rectangle: "Rectangle", grid = True):
         """Remove a rectangle from the box."""
-        self._rectangles.remove(rectangle)
+        index = self._rectangles.index(rectangle)
+        state = rectangle.get_state() if self._journal_marks else None
+        self._rectangles.pop(index)
+        rectangle.box_id = -1
         self._space += rectangle.width * rectangle.height
+        self._metrics_remove(rectangle)
         x, y = rectangle.x, rectangle.y
+        removed, added = [], []
+        if (x, y) not in self._coordinates:
+            added.append((x, y))
         self._coordinates.add((x, y))
+        freed = []
         if not (x + rectangle.width >= self._length):
-            self._coordinates.discard((x + rectangle.width, y))
+            freed.append((x + rectangle.width, y))
         if not (y + rectangle.height >= self._length):
-            self._coordinates.discard((x, y + rectangle.height))
-
-        if grid:
+            freed.append((x, y + rectangle.height))
+        for coordinate in freed:
+            if coordinate in self._coordinates:
+                removed.append(coordinate)
+                self._coordinates.discard(coordinate)
+
+        cells = []
+        indexed = grid and rectangle in self._indexed
+        if indexed:
+            self._occupancy.remove(x, y, rectangle.width, rectangle.height)
+            self._indexed.discard(rectangle)
+        elif grid:
             # Update the spatial grid
-            cells = self._get_grid_cells(x, y, rectangle.width, rectangle.height)
-            for cell in cells:
+            for cell in self._get_grid_cells(x, y, rectangle.width, rectangle.height):
                 if rectangle in self.grid[cell]:
-                    self.grid[cell].remove(rectangle)
+                    position = self.grid[cell].index(rectangle)
+                    self.grid[cell].pop(position)
+                    cells.append((cell, position))
+        self._record("remove", rectangle, state, index, cells, removed, added, indexed)
+
+    def rotate(self, rectangle: "Rectangle") -> bool:
+        """
+        Rotate a placed rectangle, at the same position if possible, otherwise
+        at the first position where it fits.
+        Returns:
+            bool: True if the rectangle was rotated, False if the box is unchanged
+        """
+        x, y = rectangle.x, rectangle.y
+        self.begin()
+        self.remove_rectangle(rectangle)
+        rectangle.rotate()
+        self._record("rotate", rectangle)
+        if self.can_place(rectangle, x, y):
+            self._update_placement(rectangle, (x, y))
+            placed = True
+        else:
+            placed = self.place(rectangle)
+        if placed:
+            self.commit()
+        else:
+            self.rollback()
+        return placed
+
+    def _undo(self, entry):
+        kind, rectangle = entry[0], entry[1]
+        if kind == "place":
+            _, _, state, cells, removed, added, indexed = entry
+            self._rectangles.pop()
+            if indexed:
+                self._occupancy.remove(rectangle.x, rectangle.y, rectangle.width, rectangle.height)
+                self._indexed.discard(rectangle)
+            self._space += rectangle.width * rectangle.height
+            self._metrics_remove(rectangle)
+            for cell in cells:
+                self.grid[cell].pop()
+            self._coordinates.difference_update(added)
+            self._coordinates.update(removed)
+            rectangle.set_state(state)
+        elif kind == "remove":
+            _, _, state, index, cells, removed, added, indexed = entry
+            rectangle.set_state(state)
+            if indexed:
+                self._occupancy.add(rectangle.x, rectangle.y, rectangle.width, rectangle.height)
+                self._indexed.add(rectangle)
+            self._rectangles.insert(index, rectangle)
+            self._space -= rectangle.width * rectangle.height
+            self._metrics_add(rectangle)
+            for cell, position in cells:
+                self.grid[cell].insert(position, rectangle)
+            self._coordinates.difference_update(added)
+            self._coordinates.update(removed)
+        elif kind == "rotate":
+            rectangle.rotate()
 
     def copy(self):
+        """Independent copy of the box, the rectangles are copied with copy_rectangles()."""
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("Box.copy")
         new_box = Box(self._length, self.grid_size, self.id)
-        new_box._rectangles = [
-            Rectangle(r.width, r.height, r.x, r.y, r.color, r.id) for r in self._rectangles
-        ]  # Create new instances
+        if self._occupancy is not None:
+            new_box._occupancy = self._occupancy.copy()
+        new_box._rectangles = copy_rectangles(self._rectangles)  # Create new instances
         new_box._coordinates = (
             self._coordinates.copy()
         )  # Set of immutable tuples, so shallow copy is fine
         new_box._space = self._space
+        new_box._copy_metrics(self)
 
+        # the grid has to point to the new instances, the old ones keep changing
+        copies = {id(old): new for old, new in zip(self._rectangles, new_box._rectangles)}
         new_box.grid = defaultdict(list)
         for key, value in self.grid.items():
-            new_box.grid[key] = value.copy()
+            if value:
+                new_box.grid[key] = [copies.get(id(r), r) for r in value]
+        new_box._indexed = {copies.get(id(r), r) for r in self._indexed}
 
         return new_box
 
     def get_coordinates(self):
         return self._coordinates
 
+    def get_free_extents(self):
+        """
+        List of (width, height) extents, a rectangle can only be placed if it
+        fits in one of them. Rectangles are only placed on the coordinates, so
+        a rectangle placed at (x, y) is at most L - x wide and L - y high.
+        """
+        return [(self._length - x, self._length - y) for x, y in self._coordinates]
+
 class Rectangle:
+    """
+    A lightweight view over one row of a RectangleSet. Reading or writing an
+    attribute reads or writes the corresponding column of the set.
+    A Rectangle created directly owns a single row set of its own.
+    """
+
+    __slots__ = ("_set", "_index")
+
     def __init__(self, width, height, x, y, color=None, id=None):
-        self.width = width
-        self.height = height
-        self.x = x
-        self.y = y
+        self._set = RectangleSet(
+            [width],
+            [height],
+            [x],
+            [y],
+            color=None if color is None else [color],
+            id=[-1 if id is None else id],
+        )
+        self._index = 0
 
-        if color is None:
-            self.color = self.generate_random_color()  # Assign a color when created
-        else:
-            self.color = color
-        
-        if id is None:
-            self.id = np.random.randint(0,1000000)
-        else:
-            self.id = id
+    @classmethod
+    def _view(cls, rectangle_set: RectangleSet, index: int) -> "Rectangle":
+        rectangle = cls.__new__(cls)
+        rectangle._set = rectangle_set
+        rectangle._index = index
+        return rectangle
+
+    @property
+    def width(self) -> int:
+        return self._set.width.item(self._index)
+
+    @width.setter
+    def width(self, value):
+        self._set.width[self._index] = value
+
+    @property
+    def height(self) -> int:
+        return self._set.height.item(self._index)
+
+    @height.setter
+    def height(self, value):
+        self._set.height[self._index] = value
+
+    @property
+    def x(self) -> int:
+        return self._set.x.item(self._index)
+
+    @x.setter
+    def x(self, value):
+        self._set.x[self._index] = value
+
+    @property
+    def y(self) -> int:
+        return self._set.y.item(self._index)
+
+    @y.setter
+    def y(self, value):
+        self._set.y[self._index] = value
+
+    @property
+    def box_id(self) -> int:
+        return self._set.box_id.item(self._index)
+
+    @box_id.setter
+    def box_id(self, value):
+        self._set.box_id[self._index] = value
+
+    @property
+    def rotation(self) -> int:
+        return self._set.rotation.item(self._index)
+
+    @property
+    def id(self) -> int:
+        return self._set.id.item(self._index)
+
+    @property
+    def color(self) -> tuple:
+        return tuple(self._set.color[self._index].tolist())
 
     def rotate(self):
         self.width, self.height = self.height, self.width
+        self._set.rotation[self._index] ^= 1
 
-    def generate_random_color(self):
-        """Generate a random RGB color as a tuple."""
+    def get_state(self) -> tuple:
+        """Returns the mutable part of the rectangle: (width, height, x, y, box_id, rotation)."""
+        rows, i = self._set, self._index
         return (
-            np.random.randint(0, 256),
-            np.random.randint(0, 256),
-            np.random.randint(0, 256),
+            rows.width.item(i),
+            rows.height.item(i),
+            rows.x.item(i),
+            rows.y.item(i),
+            rows.box_id.item(i),
+            rows.rotation.item(i),
         )
 
+    def set_state(self, state: tuple):
+        """Restores a state returned by get_state()."""
+        rows, i = self._set, self._index
+        rows.width[i], rows.height[i], rows.x[i], rows.y[i], rows.box_id[i], rows.rotation[i] = state
+
     def copy(self,):
-        new_rectangle = Rectangle(self.width, self.height, self.x, self.y)
-        new_rectangle.color = self.color
+        new_rectangle = Rectangle(self.width, self.height, self.x, self.y, self.color, self.id)
+        new_rectangle.set_state(self.get_state())
 
         return new_rectangle
@@ -1,68 +1,101 @@
+import instrumentation
 from local_search import *
 from greedy import *
 import numpy as np
-import matplotlib.pyplot as plt
+from tsp_construction import CONSTRUCTIONS
+from tsp_improvement import LinKernighan, TourImprover
+from tsp_distance import DistanceOracle, make_oracle
+from tsp_partition import partitioned_tour
 
 class TSPProblem:
-    def __init__(self, num_cities, width=100, height=100):
+    def __init__(self, num_cities, width=100, height=100, distance_mode="auto", distance_directory=None):
         """
         :param num_cities: Number of cities to generate.
         :param width:  Width of coordinate space in which cities lie.
         :param height: Height of coordinate space in which cities lie.
+        :param distance_mode: "dense", "memmap", "lazy" or "auto", see tsp_distance.make_oracle
+        :param distance_directory: where the memory mapped distance matrices are kept
         """
         self.num_cities = num_cities
         self.width = width
         self.height = height
-        self.cities = []
+        self._coordinates = np.empty((0, 2), dtype=np.int32)
+        self._cities = None
+        self._distance_mode = distance_mode
+        self._distance_directory = distance_directory
+        self._oracle = None
         self.generate_instance()
 
+    @classmethod
+    def from_coordinates(cls, coordinates, distance_mode="auto", distance_directory=None):
+        """Instance with the given (n, 2) city coordinates, e.g. loaded from a file."""
+        coordinates = np.asarray(coordinates).reshape(-1, 2)
+        extent = coordinates.max(axis=0) if len(coordinates) else (100, 100)
+        problem = cls(0, extent[0], extent[1], distance_mode, distance_directory)
+        problem.num_cities = len(coordinates)
+        problem._coordinates = coordinates
+        return problem
+
     def generate_instance(self):
-        # Randomly place city coordinates
-        self.cities = [
-            (np.random.randint(0, self.width), np.random.randint(0, self.height))
-            for _ in range(self.num_cities)
-        ]
+        # Randomly place city coordinates, all at once
+        self._coordinates = np.random.randint(
+            0, (self.width, self.height), size=(self.num_cities, 2), dtype=np.int32
+        )
+        self._cities = None
+        self._oracle = None
+
+    @property
+    def cities(self):
+        """The cities as a list of (x, y) tuples, built on first use for the callers that want one."""
+        if self._cities is None:
+            self._cities = [tuple(city) for city in self._coordinates.tolist()]
+        return self._cities
 
     def get_num_cities(self):
         return self.num_cities
 
+    def get_oracle(self):
+        """The distance oracle of the instance, built on first use."""
+        if self._oracle is None:
+            self._oracle = make_oracle(
+                self.get_coordinates(), self._distance_mode, self._distance_directory
+            )
+        return self._oracle
+
     def get_distance(self, i, j):
-        (x1, y1) = self.cities[i]
-        (x2, y2) = self.cities[j]
-        dist = np.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
-        return dist
+        return self.get_oracle().distance(i, j)
 
     def get_cities(self):
         return self.cities
 
-def route_length(solution):
+    def get_coordinates(self):
+        """The cities as an (n, 2) NumPy array, indexed by city, integer for generated instances."""
+        return self._coordinates
+
+def route_length(solution, problem=None):
     """
-    Computes the total route length for a given city ordering 'solution'.
+    Computes the total route length of a tour. With a problem, the tour is an
+    array of city indices and its edges are gathered from the distance oracle
+    at once; without, it is a sequence of (x, y) coordinates.
     """
-    dist = 0.0
-    for i in range(len(solution)):
-        current_city = solution[i]
-        next_city = solution[(i+1) % len(solution)]
-        (x1, y1) = current_city
-        (x2, y2) = next_city
-        dist += np.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
-    return dist
+    if problem is None:
+        return DistanceOracle(solution).route_length(np.arange(len(solution)))
+    return problem.get_oracle().route_length(solution)
 
 class RuleBasedTSP(Neighborhood):
     def start(self, problem: TSPProblem):
-        cities = problem.get_cities()
+        self._problem = problem
         greedy = GreedyTSP()
-        cities = greedy.generate_order(cities)
-        return cities
+        return greedy.generate_order(problem.get_coordinates())
 
-    def generate_neighbors(self, solution):
-        # Generate neighbors by modifying the order of rectangles
+    def generate_neighbors(self, solution, executor=None, workers=1):
+        # Generate neighbors by modifying the order of the cities
         neighbors = []
         best_score = self._score_solution(solution)
         best_neighbor = solution
         length = len(solution)
         prev_order = solution
-        # section based permutation with 4 sections
+        # section based permutation with 10 sections
         num_sections = 10
         section_size = length // num_sections
         sections = [
@@ -76,7 +109,7 @@ class RuleBasedTSP(Neighborhood):
         swap_indices = random.sample(range(length - 1), num_swaps)
         for i in swap_indices:
             # Swap two elements
-            new_order = prev_order  # Create a copy before modifying
+            new_order = prev_order.copy()  # Create a copy before modifying
             new_order[i], new_order[i + 1] = new_order[i + 1], new_order[i]
             new_orders.append(new_order)
 
@@ -99,63 +132,133 @@ class RuleBasedTSP(Neighborhood):
                 result.append(new_neighbor)
 
         # Flatten the permutations before returning
-        return [[rect for section in perm for rect in section] for perm in result]
+        return [np.concatenate(perm) for perm in result]
 
     def _score_solution(self, solution):
-        return route_length(solution)
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("Neighborhood._score_solution")
+        # LocalSearch maximizes the score, the route length is minimized
+        return -route_length(solution, self._problem)
+
+class TwoOptTSP(Neighborhood):
+    """
+    2-opt and Or-opt moves with k-nearest candidate lists and don't-look bits,
+    see tsp_improvement.TourImprover. One call of generate_neighbors() runs the
+    improver until no move improves the tour, so LocalSearch stops as soon as
+    a pass finds nothing.
+    """
+    def __init__(self, k=8, construction="nearest_neighbor"):
+        self._k = k
+        self._construction = construction
+        self._improver = None
+
+    def start(self, problem: TSPProblem):
+        self._problem = problem
+        self._improver = TourImprover(problem.get_oracle(), self._k)
+        return GreedyTSP(self._construction).generate_order(problem.get_coordinates())
+
+    def generate_neighbors(self, solution, executor=None, workers=1):
+        tour, improved = self._improver.improve(solution)
+        if not improved:
+            return []
+        return [tour]
+
+    def _score_solution(self, solution):
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count("Neighborhood._score_solution")
+        return -route_length(solution, self._problem)
+
+class LinKernighanTSP:
+    """
+    Iterated Lin-Kernighan (tsp_improvement.LinKernighan) from a greedy tour,
+    within a wall-clock budget. The best tour so far is reported through
+    callback(elapsed, best_length, improver) whenever it improves.
+    """
+    def __init__(self, problem, time_limit=10.0, construction="greedy_edge", k=8, callback=None, seed=None):
+        self.problem = problem
+        self._time_limit = time_limit
+        self._construction = construction
+        self._k = k
+        self._callback = callback
+        self._seed = seed
+        self._tour = None
+        self.best_length = None
+        self.history = []
+
+    def run(self):
+        tour = GreedyTSP(self._construction).generate_order(self.problem.get_coordinates())
+        improver = LinKernighan(self.problem.get_oracle(), self._k)
+        self._tour, self.best_length = improver.optimize(
+            tour, self._time_limit, callback=self._callback, seed=self._seed
+        )
+        self.history = improver.history
+        return self._tour
+
+    def get_solution(self):
+        return self._tour
+
+class PartitionedTSP:
+    """
+    Divide and conquer for very large instances (tsp_partition): spatial
+    clusters of cluster_size cities are solved in a process pool, stitched
+    together and repaired with a 2-opt/Or-opt pass along the cluster borders.
+    """
+    def __init__(self, problem, cluster_size=2000, workers=None, cluster_time_limit=None, seed=None):
+        self.problem = problem
+        self._cluster_size = cluster_size
+        self._workers = workers
+        self._cluster_time_limit = cluster_time_limit
+        self._seed = seed
+        self._tour = None
+
+    def run(self):
+        self._tour = partitioned_tour(
+            self.problem.get_coordinates(),
+            self._cluster_size,
+            self._workers,
+            self._cluster_time_limit,
+            seed=self._seed,
+        )
+        return self._tour
+
+    def get_solution(self):
+        return self._tour
 
 class GreedyTSP:
-    def start(self, problem):
-        return problem.get_cities()
-    def generate_order(self, solution):
-        new_solution = []
-        remaining_cities = set(solution)  # Track unvisited cities
-        current_city = solution[0]  # Start at the first city
-        new_solution.append(current_city)
-        remaining_cities.remove(current_city)
+    """
+    Tour construction for the TSP on the city coordinates, see tsp_construction.
+    The tours are int32 arrays of city indices.
+    :param construction: "nearest_neighbor", "greedy_edge" or "hilbert"
+    """
+    def __init__(self, construction="nearest_neighbor"):
+        if construction not in CONSTRUCTIONS:
+            raise ValueError(f"Unknown construction: {construction}")
+        self._construction = construction
 
-        while remaining_cities:
-            closest = min(remaining_cities, key=lambda c: np.linalg.norm(np.array(c) - np.array(current_city)))
-            new_solution.append(closest)
-            remaining_cities.remove(closest)
-            current_city = closest
+    def start(self, problem):
+        return problem.get_coordinates()
 
-        return new_solution
+    def generate_order(self, solution):
+        return CONSTRUCTIONS[self._construction](solution)
 
 
 def visualize_tsp(cities, alg):
     """
-    Show a 2D plot of the TSP route.
+    Show a 2D plot of the TSP route, see tsp_render.render_tour() for writing
+    it to a file without a display.
 
-    :param cities: List of (x,y) for each city.
-    :param route: The visiting order, as a list of integer city indices,
-                  e.g. [0, 2, 1, 4, 3] meaning we go city0 -> city2 -> city1 -> city4 -> city3 -> city0
+    :param cities: List of (x,y) for each city, in visiting order. The list is
+                   not modified.
+    :param alg: The title of the plot.
     """
-    # Extract coordinates in visiting order
-    ordered_coords = cities
-    # Add the first city again at the end to close the loop
-    ordered_coords.append(cities[0])
+    # only the interactive demo needs a display
+    import matplotlib.pyplot as plt
+    from tsp_render import draw_tour
 
-    # Plot
     plt.figure()
-    # Plot all city points
-    xs = [c[0] for c in cities]
-    ys = [c[1] for c in cities]
-    plt.scatter(xs, ys, marker='o', label='Cities')
-
-    # Draw lines for the route
-    route_x = [p[0] for p in ordered_coords]
-    route_y = [p[1] for p in ordered_coords]
-    plt.plot(route_x, route_y, '-o', label='Route')
-
-    # Annotate each city with its index
-    for idx, (x, y) in enumerate(cities):
-        plt.text(x + 0.5, y + 0.5, str(idx))
-
-    plt.title(alg)
-    plt.xlabel("X Coordinate")
-    plt.ylabel("Y Coordinate")
-    plt.legend()
+    draw_tour(plt.gca(), cities, np.arange(len(cities)), alg)
     plt.show()
 
 
@@ -170,36 +273,54 @@ def main():
     problem = TSPProblem(num_cities, width, height)
     cities = problem.get_cities()
 
-    # Evaluate route length
-    route_coords = cities
-    total_length = route_length(route_coords)
+    # Evaluate route length, the tours are arrays of city indices
+    tour = np.arange(num_cities, dtype=np.int32)
+    total_length = route_length(tour, problem)
     print(f"Random route length: {total_length:.2f}")
 
     # Visualize
-    visualize_tsp(cities, "Random")
+    visualize_tsp([cities[i] for i in tour], "Random")
 
 
     greedy = Greedy(problem, GreedyTSP())
-    cities = greedy.run()
+    tour = greedy.run()
 
     # Evaluate route length
-    route_coords = cities
-    total_length = route_length(route_coords)
+    total_length = route_length(tour, problem)
     print(f"Greedy route length: {total_length:.2f}")
 
     # Visualize
-    visualize_tsp(cities, "Greedy")
+    visualize_tsp([cities[i] for i in tour], "Greedy")
 
     local = LocalSearch(problem, RuleBasedTSP())
-    cities = local.run()
+    tour = local.run()
 
     # Evaluate route length
-    route_coords = cities
-    total_length = route_length(route_coords)
+    total_length = route_length(tour, problem)
     print(f"LocalSearch route length: {total_length:.2f}")
 
     # Visualize
-    visualize_tsp(cities, "LocalSearch")
+    visualize_tsp([cities[i] for i in tour], "LocalSearch")
+
+    local = LocalSearch(problem, TwoOptTSP())
+    tour = local.run()
+
+    # Evaluate route length
+    total_length = route_length(tour, problem)
+    print(f"2-opt/Or-opt route length: {total_length:.2f}")
+
+    # Visualize
+    visualize_tsp([cities[i] for i in tour], "2-opt/Or-opt")
+
+    lin_kernighan = LinKernighanTSP(problem, time_limit=10.0)
+    tour = lin_kernighan.run()
+
+    # Evaluate route length
+    total_length = route_length(tour, problem)
+    print(f"Iterated Lin-Kernighan route length: {total_length:.2f}")
+
+    # Visualize
+    visualize_tsp([cities[i] for i in tour], "Iterated Lin-Kernighan")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,364 @@
+import math
+from array import array
+
+import numpy as np
+
+
+# Tour constructions for the TSP on an (n, 2) coordinate array. Every
+# construction returns the tour as an int32 array of city indices.
+
+
+def as_coordinates(cities) -> np.ndarray:
+    """The cities as an (n, 2) float64 array, from a list of (x, y) or an array."""
+    coordinates = np.asarray(cities, dtype=np.float64)
+    return coordinates.reshape(-1, 2)
+
+
+class CityGrid:
+    """
+    Bucket grid over the cities: every city falls in one square cell and the
+    cities of a cell are contiguous in `order`, between starts[c] and
+    starts[c + 1]. The cell size is chosen for about per_cell cities per cell.
+    """
+
+    def __init__(self, coordinates, per_cell=2.0):
+        n = len(coordinates)
+        self.coordinates = coordinates
+        low = coordinates.min(axis=0) if n else np.zeros(2)
+        extent = (coordinates.max(axis=0) - low) if n else np.zeros(2)
+        width, height = float(extent[0]), float(extent[1])
+        cities = max(n / per_cell, 1.0)
+        # the second term keeps the cells sensible if all cities are on a line
+        self.cell_size = max(
+            math.sqrt(width * height / cities), max(width, height) / cities, 1e-9
+        )
+        self.columns = int(width / self.cell_size) + 1
+        self.rows = int(height / self.cell_size) + 1
+        self.cell_x = np.minimum(
+            ((coordinates[:, 0] - low[0]) / self.cell_size).astype(np.int64), self.columns - 1
+        )
+        self.cell_y = np.minimum(
+            ((coordinates[:, 1] - low[1]) / self.cell_size).astype(np.int64), self.rows - 1
+        )
+        self.cell = self.cell_y * self.columns + self.cell_x
+        self.order = np.argsort(self.cell, kind="stable")
+        self.starts = np.searchsorted(
+            self.cell[self.order], np.arange(self.columns * self.rows + 1)
+        )
+
+    def counts(self) -> np.ndarray:
+        return np.diff(self.starts)
+
+
+def knn_candidates(coordinates, k=10, grid=None) -> np.ndarray:
+    """
+    Candidate neighbor lists: for every city up to k nearest cities among the
+    cities of the surrounding 3 x 3 grid cells, sorted by distance. Rows with
+    fewer candidates are padded with -1. The lists are exact for the
+    neighbors closer than the cell size, which is all that 2-opt style
+    candidate lists need.
+    Returns:
+        np.ndarray: (n, k) int32 array of city indices
+    """
+    coordinates = as_coordinates(coordinates)
+    n = len(coordinates)
+    k = min(k, max(n - 1, 0))
+    result = np.full((n, k), -1, dtype=np.int32)
+    if k == 0:
+        return result
+    if grid is None:
+        grid = CityGrid(coordinates, per_cell=max(2.0, k / 3))
+    counts = grid.counts()
+    xs, ys = coordinates[:, 0].copy(), coordinates[:, 1].copy()
+    offsets = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+    # cities of the 3 x 3 block of every city, per offset
+    block = np.zeros((n, len(offsets)), dtype=np.int64)
+    block_cells = np.zeros((n, len(offsets)), dtype=np.int64)
+    for o, (dx, dy) in enumerate(offsets):
+        cx, cy = grid.cell_x + dx, grid.cell_y + dy
+        inside = (cx >= 0) & (cx < grid.columns) & (cy >= 0) & (cy < grid.rows)
+        block_cells[:, o] = np.where(inside, cy * grid.columns + cx, 0)
+        block[:, o] = np.where(inside, counts[block_cells[:, o]], 0)
+    totals = block.sum(axis=1)
+    columns_before = np.cumsum(block, axis=1) - block
+    # cities with similar block sizes are handled together, so the candidate
+    # matrices need little padding
+    by_total = np.argsort(totals, kind="stable")
+    begin = 0
+    while begin < n:
+        width = max(int(totals[by_total[min(begin + 1023, n - 1)]]), 1)
+        end = min(begin + max(1, 4_000_000 // width), n)
+        width = int(totals[by_total[end - 1]])
+        cities = by_total[begin:end]
+        begin = end
+        if width == 0:
+            continue
+        candidates = np.full((len(cities), width), -1, dtype=np.int64)
+        for o in range(len(offsets)):
+            count = block[cities, o]
+            total = int(count.sum())
+            within = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+            rows = np.repeat(np.arange(len(cities)), count)
+            columns = np.repeat(columns_before[cities, o], count) + within
+            positions = np.repeat(grid.starts[block_cells[cities, o]], count) + within
+            candidates[rows, columns] = grid.order[positions]
+        safe = np.maximum(candidates, 0)
+        dx = xs[safe] - xs[cities][:, None]
+        dy = ys[safe] - ys[cities][:, None]
+        distances = dx * dx + dy * dy
+        distances[(candidates < 0) | (candidates == cities[:, None])] = np.inf
+        kk = min(k, width)
+        nearest = np.argpartition(distances, kk - 1, axis=1)[:, :kk]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        by_distance = np.argsort(nearest_distances, axis=1, kind="stable")
+        nearest = np.take_along_axis(nearest, by_distance, axis=1)
+        chosen = np.take_along_axis(candidates, nearest, axis=1)
+        chosen[np.take_along_axis(nearest_distances, by_distance, axis=1) == np.inf] = -1
+        result[cities, :kk] = chosen
+    return result
+
+
+class _Buckets:
+    """
+    The cells of a CityGrid over some of the cities, with the number of
+    unvisited cities per cell, for the nearest neighbor searches. Cell
+    coordinates are computed from the position, so the search can start
+    from a city the grid was not built over.
+    """
+
+    def __init__(self, coordinates, cities, per_cell):
+        grid = CityGrid(coordinates[cities], per_cell)
+        cell = np.full(len(coordinates), -1, dtype=np.int64)
+        cell[cities] = grid.cell
+        self.cell = array("q", cell.tobytes())
+        self.order = array("q", cities[grid.order].astype(np.int64).tobytes())
+        self.starts = grid.starts.tolist()
+        self.alive = grid.counts().tolist()
+        self.columns, self.rows, self.cell_size = grid.columns, grid.rows, grid.cell_size
+        low = coordinates[cities].min(axis=0)
+        self.low_x, self.low_y = float(low[0]), float(low[1])
+
+    def visit(self, city):
+        self.alive[self.cell[city]] -= 1
+
+    def nearest(self, x, y, xs, ys, visited, max_ring=None) -> int:
+        """
+        The unvisited city nearest to (x, y), searched in growing rings of
+        cells; -1 if none is proven nearest within max_ring rings.
+        """
+        columns, rows, cell_size = self.columns, self.rows, self.cell_size
+        alive, order, starts = self.alive, self.order, self.starts
+        cx = math.floor((x - self.low_x) / cell_size)
+        cy = math.floor((y - self.low_y) / cell_size)
+        # the rings before the first one that meets the grid are empty;
+        # without a limit, search up to the ring that covers the whole grid
+        first = max(0, -cx, cx - columns + 1, -cy, cy - rows + 1)
+        bounded = max_ring is not None
+        if not bounded:
+            max_ring = max(cx, columns - 1 - cx, cy, rows - 1 - cy) + 1
+        best, best_sq = -1, math.inf
+        for ring in range(first, max_ring + 1):
+            # the cities in this ring and beyond are at least ring - 1 cells away
+            if best >= 0 and best_sq <= ((ring - 1) * cell_size) ** 2:
+                break
+            for gy in range(max(cy - ring, 0), min(cy + ring, rows - 1) + 1):
+                if gy == cy - ring or gy == cy + ring:
+                    ring_cells = range(max(cx - ring, 0), min(cx + ring, columns - 1) + 1)
+                else:
+                    ring_cells = (cx - ring, cx + ring)
+                for gx in ring_cells:
+                    if gx < 0 or gx >= columns:
+                        continue
+                    c = gy * columns + gx
+                    if not alive[c]:
+                        continue
+                    for j in order[starts[c] : starts[c + 1]]:
+                        if not visited[j]:
+                            d = (xs[j] - x) ** 2 + (ys[j] - y) ** 2
+                            if d < best_sq:
+                                best, best_sq = j, d
+        else:
+            return -1 if bounded else best
+        return best
+
+
+def nearest_neighbor_tour(coordinates, start=0, k=10) -> np.ndarray:
+    """
+    Nearest neighbor tour. The next city is the first unvisited one of the
+    current city's candidate list if it is closer than the cell size, so it
+    is the true nearest; otherwise the grid is searched in a few growing
+    rings of cells, skipping the cells without unvisited cities, and then a
+    grid of 8 x 8 times larger cells without a ring limit. Both grids are
+    rebuilt over the unvisited cities when their number has halved, so the
+    rings stay small late in the tour. The cities are numbered along a
+    Hilbert curve first, so the lookups of nearby cities stay close in
+    memory.
+    """
+    coordinates = as_coordinates(coordinates)
+    n = len(coordinates)
+    tour = np.empty(n, dtype=np.int32)
+    if n == 0:
+        return tour
+    label = hilbert_tour(coordinates)
+    coordinates = coordinates[label]
+    start = int(np.flatnonzero(label == start)[0])
+    per_cell = max(2.0, k / 3)
+    grid = CityGrid(coordinates, per_cell)
+    # flat typed arrays rather than lists of Python numbers, which no longer
+    # fit the caches for a million cities
+    candidates = knn_candidates(coordinates, k, grid)
+    width = candidates.shape[1]
+    neighbors = array("q", candidates.astype(np.int64).tobytes())
+    xs, ys = array("d", coordinates[:, 0].tobytes()), array("d", coordinates[:, 1].tobytes())
+    # the candidate lists cover the 3 x 3 block of the first grid
+    radius_sq = grid.cell_size * grid.cell_size
+
+    visited = bytearray(n)
+    unvisited = n
+    built_for = 0  # unvisited cities when the grids were last built
+
+    current = start
+    visited[current] = 1
+    unvisited -= 1
+    tour[0] = current
+    for position in range(1, n):
+        x, y = xs[current], ys[current]
+        following = -1
+        for j in neighbors[current * width : (current + 1) * width]:
+            if j >= 0 and not visited[j]:
+                if (xs[j] - x) ** 2 + (ys[j] - y) ** 2 <= radius_sq:
+                    following = j
+                break
+        if following < 0:
+            if 2 * unvisited <= built_for or not built_for:
+                cities = np.flatnonzero(np.frombuffer(visited, dtype=np.uint8) == 0)
+                fine = _Buckets(coordinates, cities, per_cell)
+                coarse = _Buckets(coordinates, cities, 64 * per_cell)
+                built_for = unvisited
+            following = fine.nearest(x, y, xs, ys, visited, max_ring=8)
+            if following < 0:
+                following = coarse.nearest(x, y, xs, ys, visited)
+        visited[following] = 1
+        if built_for:
+            fine.visit(following)
+            coarse.visit(following)
+        unvisited -= 1
+        tour[position] = following
+        current = following
+    return label[tour].astype(np.int32)
+
+
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def greedy_edge_tour(coordinates, k=10) -> np.ndarray:
+    """
+    Greedy edge matching: the candidate edges are taken shortest first if
+    both cities still have degree < 2 and the edge does not close a cycle.
+    The resulting paths are joined by repeating the matching on the
+    candidate edges between their end points, and in Hilbert curve order if
+    that gets stuck.
+    """
+    coordinates = as_coordinates(coordinates)
+    n = len(coordinates)
+    if n < 3:
+        return np.arange(n, dtype=np.int32)
+    degree = bytearray(n)
+    parent = list(range(n))
+    links = [[-1, -1] for _ in range(n)]
+
+    def match(cities):
+        """Greedy matching over the candidate edges between the given cities."""
+        neighbors = knn_candidates(coordinates[cities], k)
+        first = np.repeat(np.arange(len(cities)), neighbors.shape[1])
+        second = neighbors.ravel().astype(np.int64)
+        valid = second >= 0
+        first, second = cities[first[valid]], cities[second[valid]]
+        low, high = np.minimum(first, second), np.maximum(first, second)
+        keys = np.unique(low * n + high)
+        low, high = keys // n, keys % n
+        lengths = np.hypot(*(coordinates[low] - coordinates[high]).T)
+        by_length = np.argsort(lengths, kind="stable")
+        added = 0
+        for a, b in zip(low[by_length].tolist(), high[by_length].tolist()):
+            if degree[a] < 2 and degree[b] < 2:
+                root_a, root_b = _find(parent, a), _find(parent, b)
+                if root_a != root_b:
+                    parent[root_a] = root_b
+                    links[a][degree[a]] = b
+                    links[b][degree[b]] = a
+                    degree[a] += 1
+                    degree[b] += 1
+                    added += 1
+        return added
+
+    fragments = n - match(np.arange(n))
+    while fragments > 1:
+        ends = np.flatnonzero(np.frombuffer(degree, dtype=np.uint8) < 2)
+        added = match(ends)
+        fragments -= added
+        if not added:
+            break
+    # walk the paths from one of their ends
+    paths, seen = [], bytearray(n)
+    for start in range(n):
+        if degree[start] == 2 or seen[start]:
+            continue
+        path, previous, current = [], -1, start
+        while current >= 0:
+            path.append(current)
+            seen[current] = 1
+            following = links[current][0] if links[current][0] != previous else links[current][1]
+            previous, current = current, following
+        paths.append(path)
+    if len(paths) > 1:
+        # join the paths the matching could not connect in Hilbert curve order
+        firsts = coordinates[[path[0] for path in paths]]
+        paths = [paths[i] for i in hilbert_tour(firsts).tolist()]
+    return np.fromiter(
+        (city for path in paths for city in path), dtype=np.int32, count=n
+    )
+
+
+def hilbert_tour(coordinates, order=16) -> np.ndarray:
+    """
+    Visit the cities along a Hilbert space filling curve over their bounding
+    square, quantized to a 2^order x 2^order grid. Fully vectorized,
+    O(n log n); the tour is typically about 25% longer than nearest neighbor.
+    """
+    coordinates = as_coordinates(coordinates)
+    n = len(coordinates)
+    if n == 0:
+        return np.empty(0, dtype=np.int32)
+    side = 1 << order
+    low = coordinates.min(axis=0)
+    span = float((coordinates.max(axis=0) - low).max()) or 1.0
+    scaled = (coordinates - low) * ((side - 1) / span)
+    x, y = scaled[:, 0].astype(np.int64), scaled[:, 1].astype(np.int64)
+    distance = np.zeros(n, dtype=np.int64)
+    s = side >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        distance += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve is continuous
+        flip = ~ry & rx
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return np.argsort(distance, kind="stable").astype(np.int32)
+
+
+CONSTRUCTIONS = {
+    "nearest_neighbor": nearest_neighbor_tour,
+    "greedy_edge": greedy_edge_tour,
+    "hilbert": hilbert_tour,
+}
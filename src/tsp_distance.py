@@ -0,0 +1,238 @@
+import hashlib
+import math
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from tsp_construction import as_coordinates, knn_candidates
+
+
+# oracle modes chosen by make_oracle() for "auto"
+DENSE_LIMIT = 5000
+MEMMAP_LIMIT = 40000
+
+
+class DistanceOracle:
+    """
+    Euclidean distances between the cities of a TSP instance, computed on the
+    fly from the coordinates. Tours are int32 arrays of city indices.
+    Subclasses precompute the distances or cache the nearest neighbours.
+    """
+
+    def __init__(self, coordinates):
+        self.coordinates = as_coordinates(coordinates)
+        self._xs = self.coordinates[:, 0].tolist()
+        self._ys = self.coordinates[:, 1].tolist()
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def distance(self, i, j) -> float:
+        return math.hypot(self._xs[i] - self._xs[j], self._ys[i] - self._ys[j])
+
+    def distances(self, first, second) -> np.ndarray:
+        """Element-wise distances between two index arrays."""
+        deltas = self.coordinates[first] - self.coordinates[second]
+        return np.hypot(deltas[..., 0], deltas[..., 1])
+
+    def row(self, i) -> np.ndarray:
+        """Distances from city i to all cities."""
+        deltas = self.coordinates - self.coordinates[i]
+        return np.hypot(deltas[:, 0], deltas[:, 1])
+
+    def route_length(self, tour) -> float:
+        """Length of the closed tour, one vectorized gather over its edges."""
+        tour = np.asarray(tour)
+        if len(tour) < 2:
+            return 0.0
+        return float(self.distances(tour, np.roll(tour, -1)).sum(dtype=np.float64))
+
+    def nearest(self, i, k):
+        """The k nearest cities of city i and their distances, sorted by distance."""
+        row = self.row(i)
+        row[i] = np.inf
+        k = min(k, len(row) - 1)
+        nearest = np.argpartition(row, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+        nearest = nearest[np.argsort(row[nearest], kind="stable")]
+        return nearest, row[nearest]
+
+    def candidate_lists(self, k) -> np.ndarray:
+        """(n, k) k-nearest candidate lists padded with -1, see knn_candidates()."""
+        return knn_candidates(self.coordinates, k)
+
+
+class DenseDistances(DistanceOracle):
+    """
+    Precomputed float32 distance matrix, n * n * 4 bytes (100 MB for
+    n = 5000), filled in row blocks with vectorized NumPy.
+    """
+
+    def __init__(self, coordinates, matrix=None):
+        super().__init__(coordinates)
+        if matrix is None:
+            n = len(self.coordinates)
+            matrix = np.empty((n, n), dtype=np.float32)
+            self._fill(self.coordinates, matrix)
+        self.matrix = matrix
+        # the hot path of the local searches, without a Python level call
+        self.distance = matrix.item
+
+    @staticmethod
+    def _fill(coordinates, matrix, block=1024):
+        for begin in range(0, len(coordinates), block):
+            deltas = coordinates[begin : begin + block, None, :] - coordinates[None, :, :]
+            matrix[begin : begin + block] = np.hypot(deltas[..., 0], deltas[..., 1])
+
+    def distances(self, first, second) -> np.ndarray:
+        return self.matrix[first, second]
+
+    def row(self, i) -> np.ndarray:
+        return np.array(self.matrix[i], dtype=np.float64)
+
+    def candidate_lists(self, k) -> np.ndarray:
+        """Exact k-nearest lists from the matrix rows."""
+        n = len(self)
+        k = min(k, max(n - 1, 0))
+        result = np.full((n, k), -1, dtype=np.int32)
+        if k == 0:
+            return result
+        block = max(1, 4_000_000 // n)
+        for begin in range(0, n, block):
+            rows = np.array(self.matrix[begin : begin + block], dtype=np.float64)
+            cities = np.arange(begin, begin + len(rows))
+            rows[np.arange(len(rows)), cities] = np.inf
+            nearest = np.argpartition(rows, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(rows, nearest, axis=1), axis=1, kind="stable")
+            result[begin : begin + len(rows)] = np.take_along_axis(nearest, order, axis=1)
+        return result
+
+
+class MemmapDistances(DenseDistances):
+    """
+    The float32 distance matrix in a file under directory, memory mapped.
+    The file name is derived from a hash of the coordinates, so a later run on
+    the same instance maps the existing file instead of computing it again.
+    """
+
+    def __init__(self, coordinates, directory):
+        coordinates = as_coordinates(coordinates)
+        n = len(coordinates)
+        fingerprint = hashlib.sha1(np.ascontiguousarray(coordinates).tobytes()).hexdigest()[:16]
+        self.path = os.path.join(directory, f"tsp_distances_{n}_{fingerprint}.f32")
+        os.makedirs(directory, exist_ok=True)
+        if not (os.path.exists(self.path) and os.path.getsize(self.path) == n * n * 4):
+            # written to a temporary file of its own first, so an interrupted run
+            # leaves no partial matrix behind and concurrent runs do not share one
+            handle, partial = tempfile.mkstemp(
+                suffix=".partial", prefix=os.path.basename(self.path) + ".", dir=directory
+            )
+            os.close(handle)
+            try:
+                matrix = np.memmap(partial, dtype=np.float32, mode="w+", shape=(n, n))
+                self._fill(coordinates, matrix)
+                matrix.flush()
+                del matrix
+                os.replace(partial, self.path)
+            except BaseException:
+                os.remove(partial)
+                raise
+        super().__init__(coordinates, np.memmap(self.path, dtype=np.float32, mode="r", shape=(n, n)))
+
+
+class LazyDistances(DistanceOracle):
+    """
+    Distances computed on the fly, for instances too large for a matrix.
+    nearest() searches a strip of the cities sorted by x around the city,
+    doubled until it holds the k nearest, instead of a whole row; its results
+    are kept in an LRU cache of cache_size cities. The candidate lists of the
+    local searches are computed once with the grid of knn_candidates() and
+    kept; the rows the grid leaves short, of cities in sparse regions, are
+    completed from nearest().
+    """
+
+    def __init__(self, coordinates, cache_size=10000):
+        super().__init__(coordinates)
+        self._cache_size = cache_size
+        self._nearest = OrderedDict()
+        self._candidates = None
+        self._by_x = None
+
+    def _strip_nearest(self, i, k):
+        n = len(self)
+        k = min(k, n - 1)
+        if k <= 0:
+            return super().nearest(i, k)
+        if self._by_x is None:
+            self._by_x = np.argsort(self.coordinates[:, 0], kind="stable")
+            self._sorted_x = self.coordinates[self._by_x, 0]
+            extent = np.ptp(self.coordinates, axis=0)
+            self._area, self._span = float(extent[0] * extent[1]), float(extent.max())
+        # about k cities in a square of this side, if they are spread evenly
+        radius = max(math.sqrt(self._area * (k + 1) / n), self._span * (k + 1) / n, 1e-9)
+        x = self._xs[i]
+        while True:
+            begin = int(np.searchsorted(self._sorted_x, x - radius, side="left"))
+            end = int(np.searchsorted(self._sorted_x, x + radius, side="right"))
+            strip = self._by_x[begin:end]
+            deltas = self.coordinates[strip] - self.coordinates[i]
+            distances = np.hypot(deltas[:, 0], deltas[:, 1])
+            distances[strip == i] = np.inf
+            # the cities outside the strip are farther than radius
+            if end - begin == n or np.count_nonzero(distances <= radius) >= k:
+                break
+            radius *= 2
+        chosen = np.argpartition(distances, k - 1)[:k]
+        chosen = chosen[np.argsort(distances[chosen], kind="stable")]
+        return strip[chosen], distances[chosen]
+
+    def nearest(self, i, k):
+        cached = self._nearest.get(i)
+        if cached is not None and len(cached[0]) >= min(k, len(self) - 1):
+            self._nearest.move_to_end(i)
+            return cached[0][:k], cached[1][:k]
+        result = self._strip_nearest(i, k)
+        self._nearest[i] = result
+        if len(self._nearest) > self._cache_size:
+            self._nearest.popitem(last=False)
+        return result
+
+    def candidate_lists(self, k) -> np.ndarray:
+        if self._candidates is None or self._candidates.shape[1] < k:
+            candidates = knn_candidates(self.coordinates, k)
+            if candidates.shape[1]:
+                for i in np.flatnonzero(candidates[:, -1] < 0).tolist():
+                    candidates[i] = self.nearest(i, candidates.shape[1])[0]
+            self._candidates = candidates
+        return self._candidates[:, :k]
+
+
+def make_oracle(coordinates, mode="auto", directory=None, cache_size=10000) -> DistanceOracle:
+    """
+    Distance oracle for the coordinates.
+    Args:
+        mode: "dense", "memmap", "lazy" or "auto", which picks dense up to
+              DENSE_LIMIT cities, memmap up to MEMMAP_LIMIT cities if a
+              directory is given, and lazy otherwise
+        directory: where the memory mapped matrices are stored
+        cache_size: cities whose k-nearest rows the lazy oracle keeps
+    """
+    coordinates = as_coordinates(coordinates)
+    n = len(coordinates)
+    if mode == "auto":
+        if n <= DENSE_LIMIT:
+            mode = "dense"
+        elif n <= MEMMAP_LIMIT and directory is not None:
+            mode = "memmap"
+        else:
+            mode = "lazy"
+    if mode == "dense":
+        return DenseDistances(coordinates)
+    if mode == "memmap":
+        if directory is None:
+            raise ValueError("The memmap mode needs a directory")
+        return MemmapDistances(coordinates, directory)
+    if mode == "lazy":
+        return LazyDistances(coordinates, cache_size)
+    raise ValueError(f"Unknown distance mode: {mode}")
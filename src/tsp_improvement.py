@@ -0,0 +1,389 @@
+import random
+import time
+from collections import deque
+
+import numpy as np
+
+from tsp_distance import DistanceOracle
+
+
+class _CandidateRows(dict):
+    """The candidate lists as Python lists, converted on first access."""
+
+    def __init__(self, candidates):
+        super().__init__()
+        self._candidates = candidates
+
+    def __missing__(self, city):
+        row = [j for j in self._candidates[city].tolist() if j >= 0]
+        self[city] = row
+        return row
+
+
+class TourImprover:
+    """
+    2-opt and Or-opt local search for the TSP.
+
+    The tour is kept as an array of cities with the inverse position array, so
+    succ/pred are O(1) and every move is evaluated in O(1) from the four or
+    six edge lengths involved. Only the k nearest cities of a city are tried
+    as new neighbours (candidate lists), and a city whose neighbourhood did
+    not yield an improvement is not looked at again until one of its tour
+    edges changes (don't-look bits). A pass therefore costs about O(n k),
+    plus the reversals, which always reverse the shorter side of the tour.
+
+    Or-opt moves a segment of up to or_opt_length cities between two other
+    neighbouring cities, possibly reversed; it is carried out as two or three
+    2-opt exchanges.
+    """
+
+    def __init__(self, distances, k=8, or_opt_length=3):
+        """
+        :param distances: a DistanceOracle, or the city coordinates
+        """
+        if not isinstance(distances, DistanceOracle):
+            distances = DistanceOracle(distances)
+        self._oracle = distances
+        self._distance = distances.distance
+        self._neighbors = _CandidateRows(distances.candidate_lists(k))
+        self._or_opt_length = or_opt_length
+        self._tour = []
+        self._position = []
+        # flips since the last mark, recorded while not None, see LinKernighan
+        self._flips = None
+        # change of the tour length by the applied moves
+        self._delta = 0.0
+        self.moves = 0
+
+    def _succ(self, city):
+        position = self._position[city] + 1
+        return self._tour[position if position < len(self._tour) else 0]
+
+    def _pred(self, city):
+        return self._tour[self._position[city] - 1]
+
+    def _reverse(self, first, last):
+        """Reverse the path from first forward to last, or the rest of the tour if that is shorter."""
+        n = len(self._tour)
+        i, j = self._position[first], self._position[last]
+        length = (j - i) % n + 1
+        if 2 * length > n:
+            i, length = (j + 1) % n, n - length
+        self._flip(i, length)
+
+    def _flip(self, i, length):
+        """Reverse the length cities from position i on, wrapping around the end."""
+        if self._flips is not None:
+            self._flips.append((i, length))
+        tour, position, n = self._tour, self._position, len(self._tour)
+        j = (i + length - 1) % n
+        for _ in range(length // 2):
+            a, b = tour[i], tour[j]
+            tour[i], tour[j] = b, a
+            position[b], position[a] = i, j
+            i = i + 1 if i + 1 < n else 0
+            j = j - 1 if j > 0 else n - 1
+
+    def _exchange(self, x1, x2, y1, y2):
+        """
+        2-opt exchange: replace the tour edges (x1, x2) and (y1, y2) by
+        (x1, y1) and (x2, y2). Both edges must point the same way, i.e.
+        x2 = succ(x1) and y2 = succ(y1), or both pred.
+        """
+        if self._succ(x1) == x2:
+            self._reverse(x2, y1)
+        else:
+            self._reverse(x1, y2)
+
+    def _try_two_opt(self, a):
+        """Try the 2-opt moves that give a a new neighbour from its candidate list."""
+        distance = self._distance
+        for succ in (True, False):
+            b = self._succ(a) if succ else self._pred(a)
+            removed = distance(a, b)
+            for c in self._neighbors[a]:
+                added = distance(a, c)
+                # the candidates are sorted, no later one can gain anything
+                if added >= removed:
+                    break
+                d = self._succ(c) if succ else self._pred(c)
+                if c == b or d == a:
+                    continue
+                delta = added + distance(b, d) - removed - distance(c, d)
+                if delta < -1e-9:
+                    self._exchange(a, b, c, d)
+                    self._delta += delta
+                    return (a, b, c, d)
+        return None
+
+    def _try_or_opt(self, a):
+        """Try to move the segments starting at a to a place next to one of the candidates."""
+        distance = self._distance
+        n = len(self._tour)
+        segment = [a]
+        for _ in range(min(self._or_opt_length, n - 3)):
+            e = segment[-1]
+            p, nx = self._pred(a), self._succ(e)
+            removed = distance(p, a) + distance(e, nx) - distance(p, nx)
+            inside = set(segment)
+            for end in {a, e}:
+                for c in self._neighbors[end]:
+                    # the new edge (c, end) has to be shorter than the gain of the removal
+                    if distance(c, end) >= removed:
+                        break
+                    if c in inside:
+                        continue
+                    for u, v in ((c, self._succ(c)), (self._pred(c), c)):
+                        if v in inside or u in inside or (u == p and v == nx):
+                            continue
+                        base = distance(u, v)
+                        # u - e ... a - v (reversed) or u - a ... e - v
+                        reversed_cost = distance(u, e) + distance(a, v) - base
+                        forward_cost = distance(u, a) + distance(e, v) - base
+                        delta = min(reversed_cost, forward_cost) - removed
+                        if delta < -1e-9:
+                            self._move_segment(a, e, p, nx, u, v, forward_cost < reversed_cost)
+                            self._delta += delta
+                            return (p, a, e, nx, u, v)
+            following = self._succ(e)
+            if following == p:
+                break
+            segment.append(following)
+        return None
+
+    def _move_segment(self, a, e, p, nx, u, v, keep_orientation):
+        """Move the segment a ... e (between p and nx) between u and v = succ(u)."""
+        # p - a..e - nx..u - v  ->  p - u..nx - e..a - v
+        self._exchange(p, a, u, v)
+        # ->  p - nx..u - e..a - v
+        self._exchange(p, u, nx, e)
+        if keep_orientation:
+            # ->  p - nx..u - a..e - v
+            self._exchange(u, e, a, v)
+
+    def _load(self, tour):
+        self._tour = [int(city) for city in tour]
+        self._position = [0] * len(self._tour)
+        for i, city in enumerate(self._tour):
+            self._position[city] = i
+
+    def _try_moves(self, a):
+        return self._try_two_opt(a) or self._try_or_opt(a)
+
+    def _optimize(self, cities, max_moves=None):
+        """Don't-look bit loop, starting with the given cities active."""
+        n = len(self._tour)
+        active = deque(cities)
+        queued = bytearray(n)
+        for city in active:
+            queued[city] = 1
+        moves = 0
+        while active:
+            a = active.popleft()
+            queued[a] = 0
+            changed = self._try_moves(a)
+            if changed is None:
+                continue
+            moves += 1
+            # the ends of the changed edges get their don't-look bits reset
+            for city in changed + (a,):
+                if not queued[city]:
+                    queued[city] = 1
+                    active.append(city)
+            if max_moves is not None and moves >= max_moves:
+                break
+        return moves
+
+    def improve(self, tour, max_moves=None):
+        """
+        Improve a tour until no 2-opt or Or-opt move with the candidate lists
+        improves it.
+        Args:
+            tour: sequence of city indices
+            max_moves: stop after this many improving moves
+        Returns:
+            tuple: (improved tour as int32 array, True if it changed)
+        """
+        self._load(tour)
+        self.moves = 0
+        if len(self._tour) < 5:
+            return np.asarray(self._tour, dtype=np.int32), False
+        self.moves = self._optimize(self._tour, max_moves)
+        return np.asarray(self._tour, dtype=np.int32), self.moves > 0
+
+    def tour_length(self, tour) -> float:
+        return self._oracle.route_length(tour)
+
+
+class LinKernighan(TourImprover):
+    """
+    Lin-Kernighan style variable depth search on top of the 2-opt and Or-opt
+    moves of TourImprover, with iterated kicks.
+
+    A sequential move starts by removing the tour edge (t1, t2) and then
+    repeatedly adds an edge (t2, t3) to a candidate t3 and removes an edge
+    (t3, t4), as long as the partial gain stays positive; every step is a
+    2-opt exchange that closes the tour with the edge (t4, t1). The move goes
+    up to depth exchanges deep (a sequential 2 * depth-opt move) and is cut
+    back to the depth with the best closed tour. The first step tries the
+    `breadth` best candidates, the deeper steps only the best one.
+
+    optimize() then runs iterated LK for a wall-clock budget: a random
+    segment-local double bridge kick, LK from the kicked cities only, and the
+    kick is kept if the tour got shorter, otherwise all flips since the kick
+    are undone. The candidate lists are built once and reused for all kicks.
+    """
+
+    def __init__(self, distances, k=8, or_opt_length=3, depth=5, breadth=5, kick_segment=50):
+        super().__init__(distances, k, or_opt_length)
+        self._depth = depth
+        self._breadth = breadth
+        self._kick_segment = kick_segment
+        self.best_length = None
+        # (elapsed seconds, best length) after every improvement
+        self.history = []
+        self.kicks = 0
+
+    def _try_moves(self, a):
+        return self._try_two_opt(a) or self._try_or_opt(a) or self._try_lin_kernighan(a)
+
+    def _steps(self, t1, t2, gain, added):
+        """Candidate steps (t3, t4, gain after the step) from t2, best first."""
+        distance = self._distance
+        forward = self._succ(t2) == t1
+        steps = []
+        for t3 in self._neighbors[t2]:
+            partial = gain - distance(t2, t3)
+            # the candidates are sorted, the partial gain only gets smaller
+            if partial <= 0:
+                break
+            if t3 == t1:
+                continue
+            t4 = self._succ(t3) if forward else self._pred(t3)
+            if t4 == t2 or (min(t3, t4), max(t3, t4)) in added:
+                continue
+            steps.append((partial + distance(t3, t4), t3, t4))
+        steps.sort(reverse=True)
+        return steps
+
+    def _undo_flips(self, mark):
+        flips, self._flips = self._flips, None
+        while len(flips) > mark:
+            self._flip(*flips.pop())
+        self._flips = flips
+
+    def _try_lin_kernighan(self, t1):
+        """Apply the best improving sequential move starting at t1, if any."""
+        distance = self._distance
+        outer = self._flips
+        if outer is None:
+            self._flips = []
+        mark = len(self._flips)
+        result = None
+        for t2 in (self._succ(t1), self._pred(t1)):
+            first_steps = self._steps(t1, t2, distance(t1, t2), set())
+            for step in first_steps[: self._breadth]:
+                best_gain, best_mark, touched = 1e-9, None, [t1, t2]
+                added = set()
+                end = t2
+                for _ in range(self._depth):
+                    gain, t3, t4 = step
+                    self._exchange(end, t1, t3, t4)
+                    added.add((min(end, t3), max(end, t3)))
+                    touched += [t3, t4]
+                    closed = gain - distance(t4, t1)
+                    if closed > best_gain:
+                        best_gain, best_mark = closed, len(self._flips)
+                    end = t4
+                    steps = self._steps(t1, end, gain, added)
+                    if not steps:
+                        break
+                    step = steps[0]
+                if best_mark is not None:
+                    self._undo_flips(best_mark)
+                    self._delta -= best_gain
+                    result = tuple(touched)
+                    break
+                self._undo_flips(mark)
+            if result is not None:
+                break
+        if outer is None:
+            self._flips = None
+        return result
+
+    def _kick(self, rng):
+        """
+        Segment-local double bridge: the tour a B C d becomes a C B d for two
+        short neighbouring segments B and C, done with three flips.
+        Returns:
+            tuple: the six cities at the changed edges
+        """
+        tour, n = self._tour, len(self._tour)
+        limit = max(1, min(self._kick_segment, (n - 2) // 2))
+        first, second = rng.randint(1, limit), rng.randint(1, limit)
+        i = rng.randrange(n)
+        a, b1, b2 = tour[i], tour[(i + 1) % n], tour[(i + first) % n]
+        c1, c2 = tour[(i + first + 1) % n], tour[(i + first + second) % n]
+        d = tour[(i + first + second + 1) % n]
+        distance = self._distance
+        self._delta += (
+            distance(a, c1) + distance(c2, b1) + distance(b2, d)
+            - distance(a, b1) - distance(b2, c1) - distance(c2, d)
+        )
+        # a B C d -> a C^r B^r d -> a C B^r d -> a C B d
+        self._flip((i + 1) % n, first + second)
+        self._flip((i + 1) % n, second)
+        self._flip((i + 1 + second) % n, first)
+        return (a, b1, b2, c1, c2, d)
+
+    def optimize(self, tour, time_limit=10.0, max_kicks=None, callback=None, seed=None):
+        """
+        Iterated Lin-Kernighan within a wall-clock budget.
+        Args:
+            tour: start tour as a sequence of city indices
+            time_limit: seconds, the local optimization of the start tour is
+                        always finished
+            max_kicks: stop after this many kicks
+            callback: called as callback(elapsed, best_length, self) after
+                      every improvement, best_tour() is the tour at that point
+            seed: seed of the kicks
+        Returns:
+            tuple: (best tour as int32 array, its length)
+        """
+        rng = random.Random(seed)
+        started = time.perf_counter()
+        self._load(tour)
+        self.history = []
+        self.kicks = 0
+        self.best_length = self._oracle.route_length(tour)
+        if len(self._tour) < 8:
+            return self.best_tour(), self.best_length
+
+        def report():
+            elapsed = time.perf_counter() - started
+            self.history.append((elapsed, self.best_length))
+            if callback is not None:
+                callback(elapsed, self.best_length, self)
+
+        self._delta = 0.0
+        self.moves = self._optimize(self._tour)
+        self.best_length += self._delta
+        report()
+        while time.perf_counter() - started < time_limit:
+            if max_kicks is not None and self.kicks >= max_kicks:
+                break
+            self.kicks += 1
+            self._flips, self._delta = [], 0.0
+            self.moves += self._optimize(self._kick(rng))
+            if self._delta < -1e-7:
+                self.best_length += self._delta
+                self._flips = None
+                report()
+            else:
+                self._undo_flips(0)
+                self._flips = None
+        return self.best_tour(), self.best_length
+
+    def best_tour(self):
+        """A copy of the best tour found so far, valid between the kicks and after optimize()."""
+        return np.asarray(self._tour, dtype=np.int32)
@@ -0,0 +1,162 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tsp_construction import as_coordinates, greedy_edge_tour, hilbert_tour
+from tsp_distance import DistanceOracle, LazyDistances, make_oracle
+from tsp_improvement import LinKernighan, TourImprover
+
+
+# Divide and conquer for very large TSP instances: the cities are split into
+# spatial clusters, every cluster is solved on its own in a process pool, the
+# sub-tours are stitched together in the order of the cluster centroids and a
+# 2-opt/Or-opt pass repairs the tour around the cluster boundaries.
+
+
+def partition(coordinates, cluster_size) -> list:
+    """
+    Split the cities into clusters of at most cluster_size cities by
+    recursive median cuts along the longer side of the bounding box (a
+    balanced k-d tree), so all clusters have about the same size.
+    Returns:
+        list: int64 index arrays, one per cluster
+    """
+    coordinates = as_coordinates(coordinates)
+    clusters = []
+    pending = [np.arange(len(coordinates))]
+    while pending:
+        cities = pending.pop()
+        if len(cities) <= cluster_size:
+            if len(cities):
+                clusters.append(cities)
+            continue
+        points = coordinates[cities]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        order = np.argsort(points[:, axis], kind="stable")
+        half = len(cities) // 2
+        pending.append(cities[order[half:]])
+        pending.append(cities[order[:half]])
+    return clusters
+
+
+def solve_cluster(coordinates, time_limit=None, seed=None):
+    """
+    Tour of one cluster: greedy edge, then 2-opt/Or-opt, or iterated
+    Lin-Kernighan if a time limit is given.
+    Returns:
+        np.ndarray: the tour as int32 indices into the cluster's coordinates
+    """
+    tour = greedy_edge_tour(coordinates)
+    if len(tour) < 5:
+        return tour
+    oracle = make_oracle(coordinates)
+    if time_limit:
+        tour, _ = LinKernighan(oracle).optimize(tour, time_limit, seed=seed)
+        return tour
+    tour, _ = TourImprover(oracle).improve(tour)
+    return tour
+
+
+def _solve_cluster_task(task):
+    return solve_cluster(*task)
+
+
+def stitch(coordinates, clusters, tours) -> np.ndarray:
+    """
+    Join the cluster cycles into one tour, in the Hilbert order of the
+    cluster centroids. Every cycle is opened at the edge, and walked in the
+    direction, that connects it most cheaply to the end of the previous path
+    and towards the centroid of the next cluster.
+    """
+    coordinates = as_coordinates(coordinates)
+    centroids = np.array([coordinates[cities].mean(axis=0) for cities in clusters])
+    order = hilbert_tour(centroids) if len(clusters) > 1 else np.zeros(1, dtype=np.int32)
+    oracle = DistanceOracle(coordinates)
+    paths = []
+    previous_end = None
+    for position, c in enumerate(order.tolist()):
+        cycle = clusters[c][tours[c]]
+        target = centroids[order[(position + 1) % len(order)]]
+        if previous_end is None or len(cycle) < 2:
+            paths.append(cycle)
+            previous_end = cycle[-1]
+            continue
+        following = np.roll(cycle, -1)
+        removed = oracle.distances(cycle, following)
+        previous = coordinates[previous_end]
+
+        def reach(cities, point):
+            deltas = coordinates[cities] - point
+            return np.hypot(deltas[:, 0], deltas[:, 1])
+
+        # forward: start at following[j], end at cycle[j]
+        forward = reach(following, previous) + reach(cycle, target) - removed
+        # backward: start at cycle[j], end at following[j]
+        backward = reach(cycle, previous) + reach(following, target) - removed
+        j_forward, j_backward = int(np.argmin(forward)), int(np.argmin(backward))
+        if forward[j_forward] <= backward[j_backward]:
+            path = np.roll(cycle, -(j_forward + 1))
+        else:
+            path = np.roll(np.roll(cycle, -j_backward)[::-1], 1)
+        paths.append(path)
+        previous_end = path[-1]
+    return np.concatenate(paths).astype(np.int32)
+
+
+def boundary_cities(candidates, labels, tour) -> np.ndarray:
+    """
+    The cities next to another cluster: a candidate neighbour lies in another
+    cluster, or the city is at one of the ends of a stitched path.
+    """
+    valid = candidates >= 0
+    other = valid & (labels[np.maximum(candidates, 0)] != labels[:, None])
+    cities = set(np.flatnonzero(other.any(axis=1)).tolist())
+    # the ends of the paths are where the tour jumps between clusters
+    jumps = np.flatnonzero(labels[tour] != labels[np.roll(tour, -1)])
+    cities.update(tour[jumps].tolist())
+    cities.update(tour[(jumps + 1) % len(tour)].tolist())
+    return np.array(sorted(cities), dtype=np.int64)
+
+
+def partitioned_tour(
+    coordinates, cluster_size=2000, workers=None, cluster_time_limit=None, k=8, seed=None
+):
+    """
+    Divide and conquer tour for very large instances.
+    Args:
+        cluster_size: cities per cluster, the work unit of one process
+        workers: processes for the clusters, by default one per CPU
+        cluster_time_limit: seconds of iterated Lin-Kernighan per cluster,
+                            None for a 2-opt/Or-opt pass only
+        k: candidate list size of the final boundary pass
+    Returns:
+        np.ndarray: the tour as an int32 index array
+    """
+    coordinates = as_coordinates(coordinates)
+    n = len(coordinates)
+    if n < 5:
+        return np.arange(n, dtype=np.int32)
+    clusters = partition(coordinates, cluster_size)
+    tasks = [
+        (coordinates[cities], cluster_time_limit, None if seed is None else seed + i)
+        for i, cities in enumerate(clusters)
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tours = list(executor.map(_solve_cluster_task, tasks, chunksize=1))
+    else:
+        tours = [_solve_cluster_task(task) for task in tasks]
+    tour = stitch(coordinates, clusters, tours)
+    if len(clusters) == 1:
+        return tour
+
+    labels = np.empty(n, dtype=np.int64)
+    for c, cities in enumerate(clusters):
+        labels[cities] = c
+    oracle = LazyDistances(coordinates)
+    improver = TourImprover(oracle, k)
+    improver._load(tour)
+    improver._optimize(boundary_cities(oracle.candidate_lists(k), labels, tour))
+    return np.asarray(improver._tour, dtype=np.int32)
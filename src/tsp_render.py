@@ -0,0 +1,83 @@
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+
+# cities are annotated with their index only up to this many cities
+LABEL_LIMIT = 200
+# route vertices drawn at most, after the pixel decimation
+MAX_POINTS = 100000
+# the cities are drawn as markers only up to this many, the route passes through all of them
+MARKER_LIMIT = 20000
+
+
+def decimate(points, resolution, max_points=MAX_POINTS) -> np.ndarray:
+    """
+    Thin out a polyline for drawing: consecutive vertices that fall in the
+    same cell of a resolution x resolution raster over the bounding box are
+    merged, which does not change the picture at that resolution. If more
+    than max_points vertices remain, every k-th one is kept. The first and
+    the last vertex are always kept.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) <= 2:
+        return points
+    low = points.min(axis=0)
+    span = float((points.max(axis=0) - low).max()) or 1.0
+    cells = np.floor((points - low) * ((resolution - 1) / span)).astype(np.int64)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (cells[1:] != cells[:-1]).any(axis=1)
+    keep[-1] = True
+    points = points[keep]
+    if len(points) > max_points:
+        step = -(-len(points) // max_points)
+        points = np.concatenate([points[:-1:step], points[-1:]])
+    return points
+
+
+def draw_tour(axes, coordinates, tour, title=None, label_limit=LABEL_LIMIT, max_points=MAX_POINTS, resolution=2000):
+    """
+    Draw a closed tour on matplotlib axes: the route as one LineCollection,
+    the cities as one scatter up to MARKER_LIMIT cities, index labels only
+    for small instances. The inputs are not modified.
+    Args:
+        coordinates: (n, 2) city coordinates
+        tour: city indices in visiting order
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    tour = np.asarray(tour, dtype=np.int64)
+    if len(tour):
+        route = coordinates[np.concatenate([tour, tour[:1]])]
+        route = decimate(route, resolution, max_points)
+        segments = np.stack([route[:-1], route[1:]], axis=1)
+        axes.add_collection(LineCollection(segments, linewidths=0.8, colors="tab:orange", label="Route"))
+        if len(coordinates) <= MARKER_LIMIT:
+            size = 12 if len(coordinates) <= label_limit else 1
+            axes.scatter(coordinates[:, 0], coordinates[:, 1], s=size, label="Cities")
+        axes.autoscale_view()
+    if len(coordinates) <= label_limit:
+        for idx, (x, y) in enumerate(coordinates):
+            axes.text(x + 0.5, y + 0.5, str(idx))
+    if title is not None:
+        axes.set_title(title)
+    axes.set_xlabel("X Coordinate")
+    axes.set_ylabel("Y Coordinate")
+    axes.legend(loc="upper right")
+
+
+def render_tour(path, coordinates, tour, title=None, size=(8, 8), dpi=100, **options):
+    """
+    Render a tour to an image file without a display (Agg canvas). The format
+    follows the file extension, e.g. .png or .svg.
+    Args:
+        options: passed on to draw_tour(), e.g. label_limit or max_points
+    """
+    figure = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    # a raster finer than the image would only add invisible vertices
+    options.setdefault("resolution", int(max(size) * dpi))
+    draw_tour(axes, coordinates, tour, title, **options)
+    figure.savefig(path)
+    return path
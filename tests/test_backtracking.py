@@ -0,0 +1,74 @@
+import random
+
+import numpy as np
+import pytest
+
+from algorithms import Backtracking, area_lower_bound, rotated_lower_bound
+from greedy import Greedy, GreedyArea
+from max_rects_box import MaxRectsBox
+from structs import OptimizationProblem
+
+
+def assert_valid_packing(problem, boxes):
+    box_size = problem.get_box_size()
+    placed = [r for box in boxes for r in box.get_rectangles()]
+    assert sorted(r.id for r in placed) == list(range(len(problem.get_rectangle_set())))
+    sizes = problem.get_rectangle_set()
+    for r in placed:
+        assert sorted((r.width, r.height)) == sorted((int(sizes.width[r.id]), int(sizes.height[r.id])))
+    for box in boxes:
+        rectangles = box.get_rectangles()
+        for i, a in enumerate(rectangles):
+            assert 0 <= a.x <= box_size - a.width and 0 <= a.y <= box_size - a.height
+            for b in rectangles[i + 1 :]:
+                assert a.x + a.width <= b.x or b.x + b.width <= a.x or a.y + a.height <= b.y or b.y + b.height <= a.y
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rotated_lower_bound_is_at_least_the_area_bound(seed):
+    rng = np.random.default_rng(seed)
+    widths, heights = rng.integers(1, 60, 40), rng.integers(1, 60, 40)
+    bound = rotated_lower_bound(widths, heights, 100)
+    assert bound >= area_lower_bound(widths, heights, 100)
+    # every rectangle wider and higher than half the box needs its own box
+    assert rotated_lower_bound([60] * 7, [70] * 7, 100) == 7
+
+
+def test_reaches_the_bound_where_greedy_does_not():
+    problem = OptimizationProblem.from_sizes(12, [2, 4, 6, 5, 5, 8], [8, 4, 5, 4, 6, 3])
+    assert len(Greedy(problem, GreedyArea(), box_type=MaxRectsBox).run()) == 2
+    backtracking = Backtracking(problem)
+    boxes = backtracking.run()
+    assert len(boxes) == backtracking.lower_bound == 1
+    assert backtracking.proven_optimal
+    assert_valid_packing(problem, boxes)
+
+
+@pytest.mark.parametrize(
+    "box_size, widths, heights",
+    [
+        (10, [4, 6, 4, 4, 6, 6], [3, 4, 5, 5, 2, 2]),
+        (12, [8, 5, 5, 7, 3, 8], [3, 5, 3, 6, 7, 2]),
+        (10, [5, 4, 6, 3, 3], [2, 6, 6, 4, 4]),
+    ],
+)
+def test_proves_optimality_above_the_bound_by_exhausting_the_search(box_size, widths, heights):
+    problem = OptimizationProblem.from_sizes(box_size, widths, heights)
+    backtracking = Backtracking(problem)
+    boxes = backtracking.run()
+    assert len(boxes) == 2 and backtracking.lower_bound == 1
+    assert backtracking.proven_optimal
+    assert_valid_packing(problem, boxes)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_node_cap_returns_a_valid_unproven_packing(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    problem = OptimizationProblem(30, 25, 3, 14)
+    backtracking = Backtracking(problem, max_nodes=200)
+    boxes = backtracking.run()
+    assert_valid_packing(problem, boxes)
+    assert len(boxes) >= backtracking.lower_bound
+    # a search stopped by the cap proves nothing
+    assert not backtracking.proven_optimal or len(boxes) == backtracking.lower_bound or backtracking.nodes < 200
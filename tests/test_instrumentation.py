@@ -0,0 +1,30 @@
+import pytest
+
+import instrumentation
+from instrumentation import Instrumentation
+from structs import Box, Rectangle
+
+
+@pytest.mark.parametrize(
+    "occupancy, visited, amount",
+    # 4 x 3 and 4 x 2 cells of the 2 x 2 hash grid; 3 bitmap rows, then the 2 rows left in the box
+    [("hash", "Box.compute_overlap.cells", 20), ("bitmap", "Box.compute_overlap.rows", 5)],
+)
+def test_overlap_checks_are_counted_for_both_backends(occupancy, visited, amount):
+    box = Box(20, occupancy=occupancy)
+    assert box.place(Rectangle(5, 4, 0, 0))
+    with Instrumentation() as stats:
+        assert box.compute_overlap(Rectangle(6, 3, 0, 0), 2, 1) == 3 * 3
+        assert box.compute_overlap(Rectangle(6, 3, 0, 0), 10, 18) == 0
+    counters = stats.as_dict()["counters"]
+    assert counters["Box.compute_overlap"] == 2
+    assert counters[visited] == amount
+
+
+def test_nothing_is_counted_outside_a_recording():
+    box = Box(20, occupancy="bitmap")
+    with Instrumentation() as stats:
+        pass
+    box.compute_overlap(Rectangle(6, 3, 0, 0), 2, 1)
+    assert instrumentation.active is None
+    assert "Box.compute_overlap" not in stats.as_dict()["counters"]
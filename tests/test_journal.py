@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from max_rects_box import MaxRectsBox
+from shelf_box import ShelfBox
+from structs import Box, RectangleSet, begin_all, commit_all, rollback_all
+
+
+def rectangles(*sizes):
+    widths, heights = zip(*sizes)
+    return RectangleSet(widths, heights, color=np.zeros((len(sizes), 3), dtype=np.uint8)).views()
+
+
+def box_state(box):
+    """Everything a rollback has to restore, independent of the box type."""
+    return (
+        [(r.id, r.get_state()) for r in box.get_rectangles()],
+        box.get_space(),
+        box.get_metrics(),
+        sorted(box.get_coordinates()) if not isinstance(box, ShelfBox) else None,
+    )
+
+
+@pytest.mark.parametrize("box_type", [Box, ShelfBox, MaxRectsBox])
+def test_nested_commit_is_undone_by_outer_rollback(box_type):
+    first, second, third = rectangles((30, 20), (20, 40), (10, 10))
+    box = box_type(100)
+    box.place(first)
+    before = box_state(box)
+    states = [r.get_state() for r in (second, third)]
+
+    box.begin()
+    assert box.place(second)
+    box.begin()
+    assert box.place(third)
+    box.commit()
+    assert box.in_transaction()
+    box.rollback()
+
+    assert not box.in_transaction()
+    assert box_state(box) == before
+    assert [r.get_state() for r in (second, third)] == states
+
+
+@pytest.mark.parametrize("box_type", [Box, ShelfBox, MaxRectsBox])
+def test_inner_rollback_keeps_outer_changes(box_type):
+    first, second = rectangles((30, 20), (20, 40))
+    box = box_type(100)
+    box.begin()
+    box.place(first)
+    after_first = box_state(box)
+    box.begin()
+    box.place(second)
+    box.remove_rectangle(first)
+    box.rollback()
+    assert box_state(box) == after_first
+    box.commit()
+    assert not box.in_transaction()
+    assert box_state(box) == after_first
+
+
+@pytest.mark.parametrize("order", [(0, 1), (1, 0)])
+@pytest.mark.parametrize("box_type", [Box, MaxRectsBox])
+def test_rollback_all_undoes_moves_between_boxes_in_sequence_order(box_type, order):
+    moved, other = rectangles((40, 40), (30, 30))
+    source, target = box_type(100), box_type(100)
+    source.place(moved)
+    target.place(other)
+    before = [box_state(source), box_state(target)]
+
+    begin_all([source, target])
+    source.remove_rectangle(moved)
+    assert target.place(moved)
+    # the rectangle goes back, so its state depends on which entry is undone last
+    target.remove_rectangle(moved)
+    assert source.place(moved)
+    boxes = [source, target]
+    rollback_all([boxes[i] for i in order])
+
+    assert [box_state(source), box_state(target)] == before
+    assert moved.box_id == source.id
+    assert not source.in_transaction() and not target.in_transaction()
+
+
+def test_commit_all_keeps_the_move():
+    moved, = rectangles((40, 40))
+    source, target = MaxRectsBox(100), MaxRectsBox(100)
+    source.place(moved)
+    begin_all([source, target])
+    source.remove_rectangle(moved)
+    target.place(moved)
+    commit_all([source, target])
+    assert source.get_rectangles() == [] and target.get_rectangles() == [moved]
+    assert moved.box_id == target.id
+    assert source.get_free_rectangles() == [(0, 0, 100, 100)]
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from max_rects_box import MaxRectsBox
+from structs import Rectangle
+
+
+def rebuilt_free_rectangles(box):
+    fresh = MaxRectsBox(box.get_length())
+    for r in box.get_rectangles():
+        fresh._split_free_rectangles(r.x, r.y, r.width, r.height)
+    return set(fresh.get_free_rectangles())
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_removal_matches_a_rebuilt_free_list(seed):
+    rng = random.Random(seed)
+    length = rng.choice([20, 50, 100])
+    box = MaxRectsBox(length, rng.choice(MaxRectsBox.HEURISTICS))
+    for _ in range(60):
+        placed = box.get_rectangles()
+        if placed and rng.random() < 0.4:
+            box.remove_rectangle(rng.choice(placed))
+        else:
+            box.place(Rectangle(rng.randint(1, length // 3), rng.randint(1, length // 3), 0, 0))
+        free = box.get_free_rectangles()
+        assert len(free) == len(set(free))
+        assert set(free) == rebuilt_free_rectangles(box)
+
+
+@pytest.mark.parametrize("heuristic", MaxRectsBox.HEURISTICS)
+def test_placements_do_not_overlap(heuristic):
+    rng = random.Random(3)
+    box = MaxRectsBox(100, heuristic)
+    for _ in range(200):
+        box.place(Rectangle(rng.randint(1, 30), rng.randint(1, 30), 0, 0))
+    placed = box.get_rectangles()
+    assert box.get_space() == 100 * 100 - sum(r.width * r.height for r in placed)
+    for i, a in enumerate(placed):
+        assert 0 <= a.x <= 100 - a.width and 0 <= a.y <= 100 - a.height
+        for b in placed[i + 1 :]:
+            assert a.x + a.width <= b.x or b.x + b.width <= a.x or a.y + a.height <= b.y or b.y + b.height <= a.y
+
+
+def test_unchecked_placement_draws_from_the_given_generator():
+    def positions(seed):
+        box = MaxRectsBox(100)
+        rng = random.Random(seed)
+        rectangles = [Rectangle(10, 20, 0, 0) for _ in range(5)]
+        for r in rectangles:
+            assert box.place(r, False, rng)
+        return [(r.x, r.y) for r in rectangles]
+
+    random.seed(0)
+    state = random.getstate()
+    assert positions(1) == positions(1)
+    assert positions(1) != positions(2)
+    assert random.getstate() == state
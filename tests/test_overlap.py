@@ -0,0 +1,98 @@
+import random
+
+import numpy as np
+import pytest
+
+from overlap import OverlapTracker, dense_overlaps, has_overlap, overlap_area, pairwise_overlaps, sweep_overlaps
+from structs import Box, Rectangle, RectangleSet, begin_all, rollback_all
+
+
+def rectangles(*sizes):
+    widths, heights = zip(*sizes)
+    return RectangleSet(widths, heights, color=np.zeros((len(sizes), 3), dtype=np.uint8)).views()
+
+
+def random_rectangles(seed, n, length=100, max_size=30):
+    rng = random.Random(seed)
+    placed = [Rectangle(rng.randint(1, max_size), rng.randint(1, max_size), 0, 0) for _ in range(n)]
+    for r in placed:
+        r.x, r.y = rng.randint(0, length - r.width), rng.randint(0, length - r.height)
+    return placed
+
+
+def brute_force_pairs(placed):
+    return sorted(
+        (i, j, overlap_area(placed[i], placed[j]))
+        for i in range(len(placed))
+        for j in range(i + 1, len(placed))
+        if overlap_area(placed[i], placed[j]) > 0
+    )
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("dense", [True, False])
+def test_pairwise_overlaps_match_brute_force(seed, dense):
+    placed = random_rectangles(seed, 60)
+    assert sorted(pairwise_overlaps(placed, dense)) == brute_force_pairs(placed)
+
+
+def test_sweep_and_dense_agree_on_touching_edges():
+    # rectangles that only share an edge do not overlap
+    xs, ys, ws, hs = [0, 10, 0, 10], [0, 0, 10, 10], [10, 10, 10, 10], [10, 10, 10, 10]
+    assert sweep_overlaps(xs, ys, ws, hs) == []
+    assert not dense_overlaps(xs, ys, ws, hs).any()
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_has_overlap_matches_brute_force(seed):
+    placed = random_rectangles(seed, 8, max_size=20)
+    assert has_overlap(placed) == bool(brute_force_pairs(placed))
+
+
+def tracker_state(tracker, tracked):
+    return (
+        tracker.total(),
+        {r.id: tracker.overlap(r) for r in tracked},
+        sorted((min(a.id, b.id), max(a.id, b.id), area) for a, b, area in tracker.pairs()),
+        tracker.penalty(0.25, 10),
+    )
+
+
+def test_overlap_tracker_rollback_restores_overlaps_and_penalty():
+    placed = rectangles((20, 20), (20, 20), (30, 10), (10, 30))
+    for r, (x, y) in zip(placed, [(0, 0), (10, 10), (5, 15), (25, 0)]):
+        r.x, r.y = x, y
+    added, = rectangles((15, 15))
+    added.x, added.y = 12, 12
+    tracker = OverlapTracker(placed)
+    before = tracker_state(tracker, placed)
+
+    tracker.begin()
+    tracker.remove(placed[0])
+    tracker.begin()
+    placed[1].x = 40
+    tracker.move(placed[1])
+    tracker.add(added)
+    tracker.commit()
+    assert added in tracker and placed[0] not in tracker
+    tracker.rollback()
+    placed[1].x = 10
+
+    assert added not in tracker and placed[0] in tracker
+    assert tracker_state(tracker, placed) == before
+    assert tracker_state(tracker, placed) == tracker_state(OverlapTracker(placed), placed)
+
+
+def test_overlap_tracker_rollback_all_with_boxes():
+    box = Box(100)
+    placed = rectangles((20, 20), (20, 20))
+    for r in placed:
+        box.place_no_check(r)
+    tracker = OverlapTracker(placed)
+    before = tracker_state(tracker, placed)
+    begin_all([box, tracker])
+    box.remove_rectangle(placed[0], False)
+    tracker.remove(placed[0])
+    rollback_all([box, tracker])
+    assert box.get_rectangles() == placed
+    assert tracker_state(tracker, placed) == before
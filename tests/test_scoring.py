@@ -0,0 +1,90 @@
+import random
+
+import numpy as np
+import pytest
+
+from greedy import Greedy, GreedyArea
+from max_rects_box import MaxRectsBox
+from progress import Snapshot
+from scoring import (
+    box_metrics_from_arrays,
+    compute_average_compactness,
+    compute_average_contiguity,
+    compute_average_irregular_gap_penalty,
+    compute_min_utilization,
+    compute_utilization,
+)
+from shelf_box import ShelfBox
+from structs import Box, OptimizationProblem
+
+
+def solution(box_type, n, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    problem = OptimizationProblem(60, n, 3, 25)
+    return Greedy(problem, GreedyArea(), box_type=box_type).run()
+
+
+def reference_metrics(boxes):
+    """The metrics computed directly from the placed rectangles."""
+    rows = []
+    for box in boxes:
+        rectangles = box.get_rectangles()
+        length = box.get_length()
+        area = sum(r.width * r.height for r in rectangles)
+        if not rectangles:
+            rows.append((0, 0, 0, 0))
+            continue
+        x0, y0 = min(r.x for r in rectangles), min(r.y for r in rectangles)
+        x1, y1 = max(r.x + r.width for r in rectangles), max(r.y + r.height for r in rectangles)
+        bounding = (x1 - x0) * (y1 - y0)
+        contacts = sum(
+            (r.x == 0) + (r.y == 0) + (r.x + r.width == length) + (r.y + r.height == length)
+            for r in rectangles
+        )
+        rows.append((area / length ** 2, area / bounding, (bounding - area) / bounding, contacts / 4 / len(rectangles)))
+    return np.array(rows, dtype=float).reshape(-1, 4)
+
+
+def vectorized_metrics(boxes):
+    snapshot = Snapshot.from_boxes(boxes)
+    placements = snapshot.placements
+    metrics = box_metrics_from_arrays(*placements[:, 1:].T, boxes[0].get_length(), snapshot.num_boxes)
+    return np.column_stack(metrics)
+
+
+def assert_metrics_agree(boxes):
+    vectorized = vectorized_metrics(boxes)
+    scalar = np.array([tuple(box.get_metrics()) for box in boxes], dtype=float)
+    np.testing.assert_allclose(vectorized, scalar)
+    np.testing.assert_allclose(vectorized, reference_metrics(boxes))
+    np.testing.assert_allclose(vectorized[:, 0], [compute_utilization(box) for box in boxes])
+    assert vectorized[:, 0].min() == pytest.approx(compute_min_utilization(boxes))
+    assert vectorized[:, 1].mean() == pytest.approx(compute_average_compactness(boxes))
+    assert vectorized[:, 2].mean() == pytest.approx(compute_average_irregular_gap_penalty(boxes))
+    assert vectorized[:, 3].mean() == pytest.approx(compute_average_contiguity(boxes))
+
+
+@pytest.mark.parametrize("box_type", [Box, ShelfBox, MaxRectsBox])
+@pytest.mark.parametrize("seed", range(3))
+def test_vectorized_metrics_match_the_boxes(box_type, seed):
+    assert_metrics_agree(solution(box_type, 80, seed))
+
+
+@pytest.mark.parametrize("box_type", [Box, MaxRectsBox])
+def test_vectorized_metrics_match_after_removals(box_type):
+    boxes = solution(box_type, 80, 7)
+    rng = random.Random(7)
+    # removals at the border make the cached bounding rectangles dirty
+    for box in boxes:
+        rectangles = box.get_rectangles()
+        for r in rng.sample(rectangles, len(rectangles) // 2):
+            box.remove_rectangle(r)
+    for r in boxes[-1].get_rectangles():
+        boxes[-1].remove_rectangle(r)
+    assert_metrics_agree(boxes)
+
+
+def test_empty_boxes_get_zeros():
+    metrics = box_metrics_from_arrays([1], [0], [0], [10], [10], 20, num_boxes=3)
+    np.testing.assert_allclose(np.column_stack(metrics), [[0, 0, 0, 0], [0.25, 1, 0, 0.5], [0, 0, 0, 0]])
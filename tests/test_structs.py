@@ -0,0 +1,47 @@
+import random
+
+import numpy as np
+import pytest
+
+from local_search import RuleBasedNeighborhood
+from structs import OptimizationProblem, RectangleSet, copy_rectangles
+
+
+def problem(seed, n=60):
+    random.seed(seed)
+    np.random.seed(seed)
+    return OptimizationProblem(50, n, 3, 20)
+
+
+def test_rectangle_set_views_write_through():
+    rectangle_set = RectangleSet([3, 4], [5, 6])
+    first, second = rectangle_set.views()
+    first.x, second.y = 7, 8
+    first.rotate()
+    assert rectangle_set.x[0] == 7 and rectangle_set.y[1] == 8
+    assert (rectangle_set.width[0], rectangle_set.height[0]) == (5, 3)
+
+
+def test_copy_rectangles_is_one_columnar_snapshot():
+    rectangle_set = problem(0).get_rectangle_set()
+    rectangles = rectangle_set.views()
+    chosen = [rectangles[i] for i in (5, 2, 9)]
+    copies = copy_rectangles(chosen)
+    assert len({id(copy._set) for copy in copies}) == 1
+    assert copies[0]._set is not rectangle_set
+    assert [c.get_state() for c in copies] == [r.get_state() for r in chosen]
+    assert [c.id for c in copies] == [r.id for r in chosen]
+    copies[0].x = 41
+    assert chosen[0].x != 41
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_rule_based_neighbor_shares_one_rectangle_set(seed):
+    optimization_problem = problem(seed)
+    neighborhood = RuleBasedNeighborhood()
+    solution = neighborhood.start(optimization_problem)
+    neighbor = neighborhood.generate_neighbors(solution)[0]
+    assert neighbor is not solution
+    rectangles = [r for box in neighbor for r in box.get_rectangles()]
+    assert len(rectangles) == len(optimization_problem.get_rectangle_set())
+    assert len({id(r._set) for r in rectangles}) == 1
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from traveling_sales_man import TSPProblem
+from tsp_construction import greedy_edge_tour, hilbert_tour, nearest_neighbor_tour
+
+
+def cities(n, seed=0):
+    return np.random.default_rng(seed).uniform(0, 1000, size=(n, 2))
+
+
+def assert_permutation(tour, n):
+    tour = np.asarray(tour)
+    assert tour.shape == (n,)
+    assert np.array_equal(np.sort(tour), np.arange(n))
+
+
+def brute_force_nearest_neighbor_tour(coordinates, start):
+    visited = np.zeros(len(coordinates), dtype=bool)
+    tour = [start]
+    visited[start] = True
+    for _ in range(len(coordinates) - 1):
+        distances = ((coordinates - coordinates[tour[-1]]) ** 2).sum(axis=1)
+        distances[visited] = np.inf
+        tour.append(int(np.argmin(distances)))
+        visited[tour[-1]] = True
+    return tour
+
+
+@pytest.mark.parametrize("construct", [nearest_neighbor_tour, greedy_edge_tour, hilbert_tour])
+@pytest.mark.parametrize("n", [1, 2, 5, 300])
+def test_construction_tours_are_permutations(construct, n):
+    assert_permutation(construct(cities(n)), n)
+
+
+def test_construction_with_duplicate_cities():
+    coordinates = np.repeat(cities(50), 3, axis=0)
+    for construct in (nearest_neighbor_tour, greedy_edge_tour, hilbert_tour):
+        assert_permutation(construct(coordinates), len(coordinates))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_nearest_neighbor_tour_matches_a_brute_force_one(seed):
+    rng = np.random.default_rng(seed)
+    # a dense and a far sparse cluster, so the searches run out of rings
+    coordinates = np.concatenate([rng.normal(0, 1, (1500, 2)), rng.uniform(20, 500, (300, 2))])
+    start = int(rng.integers(len(coordinates)))
+    tour = nearest_neighbor_tour(coordinates, start)
+    assert tour.dtype == np.int32
+    assert tour.tolist() == brute_force_nearest_neighbor_tour(coordinates, start)
+
+
+def test_generated_instance_is_one_integer_array():
+    np.random.seed(0)
+    problem = TSPProblem(500, 30, 10)
+    coordinates = problem.get_coordinates()
+    assert coordinates.shape == (500, 2) and coordinates.dtype == np.int32
+    assert coordinates.min() >= 0
+    assert coordinates[:, 0].max() < 30 and coordinates[:, 1].max() < 10
+    assert problem.get_coordinates() is coordinates
+    assert problem.get_cities() == [tuple(city) for city in coordinates.tolist()]
+
+
+def test_instance_from_coordinates():
+    problem = TSPProblem.from_coordinates([[1.5, 2.0], [3.0, 4.0], [0.0, 7.0]])
+    assert problem.get_num_cities() == 3
+    assert problem.get_coordinates().tolist() == [[1.5, 2.0], [3.0, 4.0], [0.0, 7.0]]
+    assert problem.cities == [(1.5, 2.0), (3.0, 4.0), (0.0, 7.0)]
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+from tsp_distance import DenseDistances, LazyDistances, MemmapDistances, make_oracle
+
+
+def cities(n, seed=0):
+    return np.random.default_rng(seed).uniform(0, 1000, size=(n, 2))
+
+
+@pytest.mark.parametrize("mode", ["dense", "memmap", "lazy"])
+def test_oracles_agree_with_the_coordinates(mode, tmp_path):
+    coordinates = cities(300)
+    oracle = make_oracle(coordinates, mode, tmp_path)
+    rng = np.random.default_rng(1)
+    first, second = rng.integers(0, 300, 50), rng.integers(0, 300, 50)
+    expected = np.hypot(*(coordinates[first] - coordinates[second]).T)
+    assert np.allclose(oracle.distances(first, second), expected, rtol=1e-6)
+    assert oracle.distance(int(first[0]), int(second[0])) == pytest.approx(expected[0], rel=1e-6)
+    tour = rng.permutation(300)
+    edges = coordinates[tour] - coordinates[np.roll(tour, -1)]
+    assert oracle.route_length(tour) == pytest.approx(np.hypot(edges[:, 0], edges[:, 1]).sum(), rel=1e-6)
+
+
+def test_memmap_matrix_is_reused_and_leaves_no_partial_files(tmp_path):
+    coordinates = cities(200)
+    first = MemmapDistances(coordinates, tmp_path)
+    modified = os.path.getmtime(first.path)
+    second = MemmapDistances(coordinates, tmp_path)
+    assert second.path == first.path and os.path.getmtime(second.path) == modified
+    assert os.listdir(tmp_path) == [os.path.basename(first.path)]
+    assert np.array_equal(np.asarray(second.matrix), DenseDistances(coordinates).matrix)
+
+
+def test_interrupted_memmap_fill_removes_its_temporary_file(tmp_path, monkeypatch):
+    def interrupted(coordinates, matrix, block=1024):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(MemmapDistances, "_fill", staticmethod(interrupted))
+    with pytest.raises(KeyboardInterrupt):
+        MemmapDistances(cities(50), tmp_path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_lazy_nearest_rows_are_cached_least_recently_used():
+    oracle = LazyDistances(cities(100), cache_size=2)
+    nearest, distances = oracle.nearest(0, 5)
+    row = oracle.row(0)
+    row[0] = np.inf
+    assert np.array_equal(distances, np.sort(row)[:5])
+    # repeated and shorter lookups are served from the cached row
+    assert np.shares_memory(oracle.nearest(0, 3)[0], nearest)
+    first = oracle.nearest(1, 5)[0]
+    oracle.nearest(0, 5)
+    oracle.nearest(2, 5)
+    assert np.shares_memory(oracle.nearest(0, 5)[0], nearest)
+    # city 1 was used least recently and is computed again
+    again = oracle.nearest(1, 5)[0]
+    assert np.array_equal(again, first) and not np.shares_memory(again, first)
+
+
+def test_lazy_candidate_lists_are_complete_for_isolated_cities():
+    coordinates = np.concatenate([cities(2000), [[5000.0, 5000.0], [-3000.0, 200.0]]])
+    oracle = LazyDistances(coordinates)
+    candidates = oracle.candidate_lists(8)
+    assert (candidates >= 0).all()
+    for city in (2000, 2001):
+        assert np.array_equal(candidates[city], oracle.nearest(city, 8)[0])
+    assert oracle.candidate_lists(5).shape == (2002, 5)
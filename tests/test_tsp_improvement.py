@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from tsp_construction import greedy_edge_tour
+from tsp_distance import make_oracle
+from tsp_improvement import LinKernighan, TourImprover
+
+
+def cities(n, seed=0):
+    return np.random.default_rng(seed).uniform(0, 1000, size=(n, 2))
+
+
+def assert_permutation(tour, n):
+    tour = np.asarray(tour)
+    assert tour.shape == (n,)
+    assert np.array_equal(np.sort(tour), np.arange(n))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_improve_keeps_a_permutation_and_does_not_get_longer(seed):
+    coordinates = cities(400, seed)
+    oracle = make_oracle(coordinates)
+    start = np.random.default_rng(seed).permutation(len(coordinates))
+    improver = TourImprover(oracle)
+    tour, changed = improver.improve(start)
+    assert_permutation(tour, len(coordinates))
+    assert changed
+    assert oracle.route_length(tour) < oracle.route_length(start)
+    # the don't-look bits only reset the ends of changed edges, so another
+    # pass may still find moves, but every pass shortens the tour until none does
+    for _ in range(20):
+        again, changed = improver.improve(tour)
+        assert_permutation(again, len(coordinates))
+        if not changed:
+            break
+        assert oracle.route_length(again) < oracle.route_length(tour)
+        tour = again
+    assert not changed
+    assert np.array_equal(again, tour)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_lin_kernighan_reports_the_length_of_its_tour(seed):
+    coordinates = cities(300, seed)
+    oracle = make_oracle(coordinates)
+    start = greedy_edge_tour(coordinates)
+    lin_kernighan = LinKernighan(oracle)
+    reported = []
+    tour, length = lin_kernighan.optimize(
+        start, time_limit=60, max_kicks=200, seed=seed,
+        callback=lambda elapsed, best, lk: reported.append((best, oracle.route_length(lk.best_tour()))),
+    )
+    assert_permutation(tour, len(coordinates))
+    assert lin_kernighan.kicks == 200
+    assert length == pytest.approx(oracle.route_length(tour))
+    assert length <= oracle.route_length(start) + 1e-6
+    for best, actual in reported:
+        assert best == pytest.approx(actual)
+    assert [best for _, best in lin_kernighan.history] == sorted(
+        (best for _, best in lin_kernighan.history), reverse=True
+    )
+
+
+def test_lin_kernighan_is_reproducible_with_a_seed():
+    coordinates = cities(250, 4)
+    start = greedy_edge_tour(coordinates)
+    runs = [
+        LinKernighan(make_oracle(coordinates)).optimize(start, time_limit=60, max_kicks=100, seed=7)
+        for _ in range(2)
+    ]
+    assert np.array_equal(runs[0][0], runs[1][0]) and runs[0][1] == runs[1][1]
+
+
+@pytest.mark.parametrize("max_kicks", [0, 50])
+def test_lin_kernighan_tour_is_a_two_opt_and_or_opt_optimum(max_kicks):
+    coordinates = cities(300, 5)
+    oracle = make_oracle(coordinates)
+    tour, _ = LinKernighan(oracle).optimize(
+        np.random.default_rng(5).permutation(300), time_limit=60, max_kicks=max_kicks, seed=0
+    )
+    again, changed = TourImprover(oracle).improve(tour)
+    assert not changed
+    assert np.array_equal(again, tour)
+
+
+def test_lin_kernighan_returns_small_tours_unchanged():
+    coordinates = cities(5)
+    lin_kernighan = LinKernighan(make_oracle(coordinates))
+    tour, length = lin_kernighan.optimize([3, 1, 4, 0, 2], max_kicks=10, seed=0)
+    assert tour.tolist() == [3, 1, 4, 0, 2]
+    assert length == pytest.approx(make_oracle(coordinates).route_length(tour))
+    assert np.array_equal(lin_kernighan.best_tour(), tour)
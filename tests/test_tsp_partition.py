@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from tsp_partition import partition, partitioned_tour, solve_cluster, stitch
+
+
+def cities(n, seed=0):
+    return np.random.default_rng(seed).uniform(0, 1000, size=(n, 2))
+
+
+def assert_permutation(tour, n):
+    tour = np.asarray(tour)
+    assert tour.shape == (n,)
+    assert np.array_equal(np.sort(tour), np.arange(n))
+
+
+def test_stitch_joins_the_cluster_tours_into_one_permutation():
+    coordinates = cities(500)
+    clusters = partition(coordinates, 60)
+    assert_permutation(np.concatenate(clusters), len(coordinates))
+    assert all(len(cluster) <= 60 for cluster in clusters)
+    tours = [solve_cluster(coordinates[cluster]) for cluster in clusters]
+    assert_permutation(stitch(coordinates, clusters, tours), len(coordinates))
+
+
+@pytest.mark.parametrize("n, cluster_size", [(3, 10), (50, 100), (700, 80), (700, 3)])
+def test_partitioned_tour_is_a_permutation(n, cluster_size):
+    tour = partitioned_tour(cities(n), cluster_size=cluster_size, workers=1, seed=0)
+    assert_permutation(tour, n)